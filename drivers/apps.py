@@ -4,4 +4,10 @@ from django.apps import AppConfig
 class DriversConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'drivers'
-
+    
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from .spatial import driver_deleted, driver_saved
+        
+        post_save.connect(driver_saved, sender='users.Driver', dispatch_uid='drivers.spatial.driver_saved')
+        post_delete.connect(driver_deleted, sender='users.Driver', dispatch_uid='drivers.spatial.driver_deleted')
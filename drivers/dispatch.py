@@ -0,0 +1,186 @@
+"""
+Batch dispatch: assign pending orders to available drivers in one pass.
+
+Each run takes every pending_assignment order with pickup coordinates and
+every available driver with a position and solves them as one assignment
+problem. Drivers get at most one order per run, as with assign_driver.
+
+Cost of a (driver, order) pair = pickup distance in km + DISPATCH_LOAD_WEIGHT
+x the driver's open orders. Only pairs within DISPATCH_MAX_PICKUP_KM among
+the DISPATCH_CANDIDATES nearest are considered; they are found through a
+DriverGrid rather than a full drivers x orders distance matrix. The sparse
+problem is solved with an auction algorithm, within DISPATCH_EPSILON km per
+assignment of the optimal plan over those pairs.
+"""
+from collections import deque
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from orders.models import Order
+from users.models import Driver
+from .services import assign_order
+from .spatial import DriverGrid
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = 'drivers:dispatch:running'
+LOCK_TIMEOUT = 300  # seconds; a crashed run frees the lock after this
+
+
+def candidate_edges(orders, drivers, max_km, candidates, load_weight):
+    """
+    {(driver_id, order_id): (distance_km, cost)} for nearby pairs: the nearest
+    drivers of each order when orders are scarcer, else the nearest orders of
+    each driver. orders: [(order_id, lat, lng)]; drivers: [(driver_id, lat, lng, open_orders)]
+    """
+    loads = {driver_id: load for driver_id, _, _, load in drivers}
+    grid = DriverGrid(settings.DRIVER_GRID_CELL_DEG)
+    edges = {}
+    if len(orders) < len(drivers):
+        grid.replace({driver_id: (lat, lng) for driver_id, lat, lng, _ in drivers})
+        for order_id, lat, lng in orders:
+            for distance, driver_id in grid.nearest(lat, lng, candidates, max_km):
+                edges[(driver_id, order_id)] = (distance, distance + load_weight * loads[driver_id])
+    else:
+        grid.replace({order_id: (lat, lng) for order_id, lat, lng in orders})
+        for driver_id, lat, lng, load in drivers:
+            for distance, order_id in grid.nearest(lat, lng, candidates, max_km):
+                edges[(driver_id, order_id)] = (distance, distance + load_weight * load)
+    return edges
+
+
+def auction(edges, epsilon):
+    """
+    One order per driver and one driver per order, maximising
+    sum(ceiling - cost) to within epsilon per pair. The scarcer side bids so
+    that few bidders are left to be priced out. Returns {order_id: driver_id}.
+    """
+    if not edges:
+        return {}
+    by_driver, by_order = {}, {}
+    for (driver_id, order_id), (_, cost) in edges.items():
+        by_driver.setdefault(driver_id, []).append((order_id, cost))
+        by_order.setdefault(order_id, []).append((driver_id, cost))
+    orders_bid = len(by_order) < len(by_driver)
+    choices = by_order if orders_bid else by_driver
+
+    # Any candidate pair is worth more than staying unassigned
+    ceiling = max(cost for _, cost in edges.values()) + 1.0
+    prices = {}
+    owner = {}
+    bidders = deque(choices)
+    while bidders:
+        bidder = bidders.popleft()
+        best, best_value, second_value = None, float('-inf'), 0.0  # 0: stay unassigned
+        for target, cost in choices[bidder]:
+            value = ceiling - cost - prices.get(target, 0.0)
+            if value > best_value:
+                if best is not None:
+                    second_value = max(second_value, best_value)
+                best, best_value = target, value
+            elif value > second_value:
+                second_value = value
+        if best_value <= 0:
+            continue  # priced out of every candidate
+        prices[best] = prices.get(best, 0.0) + best_value - second_value + epsilon
+        outbid = owner.get(best)
+        owner[best] = bidder
+        if outbid is not None:
+            bidders.append(outbid)
+
+    if orders_bid:
+        return {order_id: driver_id for driver_id, order_id in owner.items()}
+    return owner
+
+
+def plan(orders, drivers):
+    """[{'order_id', 'driver_id', 'distance_km', 'cost'}] for plain-tuple inputs (see candidate_edges)"""
+    edges = candidate_edges(
+        orders, drivers,
+        max_km=settings.DISPATCH_MAX_PICKUP_KM,
+        candidates=settings.DISPATCH_CANDIDATES,
+        load_weight=settings.DISPATCH_LOAD_WEIGHT,
+    )
+    assignments = []
+    for order_id, driver_id in auction(edges, settings.DISPATCH_EPSILON).items():
+        distance, cost = edges[(driver_id, order_id)]
+        assignments.append({
+            'order_id': order_id,
+            'driver_id': driver_id,
+            'distance_km': round(distance, 3),
+            'cost': round(cost, 3),
+        })
+    assignments.sort(key=lambda assignment: assignment['order_id'])
+    return assignments
+
+
+def load_inputs():
+    orders = list(
+        Order.objects.filter(
+            status='pending_assignment', pickup_latitude__isnull=False, pickup_longitude__isnull=False,
+        ).order_by('created_at').values_list('id', 'pickup_latitude', 'pickup_longitude')[:settings.DISPATCH_MAX_ORDERS]
+    )
+    drivers = list(
+        Driver.objects.filter(
+            status='available', is_active=True,
+            current_latitude__isnull=False, current_longitude__isnull=False,
+        ).annotate(
+            open_orders=Count('orders', filter=Q(orders__status__in=Order.OPEN_STATUSES))
+        ).values_list('id', 'current_latitude', 'current_longitude', 'open_orders')
+    )
+    return (
+        [(order_id, float(lat), float(lng)) for order_id, lat, lng in orders],
+        [(driver_id, float(lat), float(lng), load) for driver_id, lat, lng, load in drivers],
+    )
+
+
+def commit(assignments):
+    """Apply a plan in one transaction; pairs whose order or driver changed meanwhile are skipped"""
+    applied = []
+    with transaction.atomic():
+        orders = Order.objects.select_for_update().in_bulk([a['order_id'] for a in assignments])
+        drivers = Driver.objects.select_for_update().in_bulk([a['driver_id'] for a in assignments])
+        for assignment in assignments:
+            order = orders.get(assignment['order_id'])
+            driver = drivers.get(assignment['driver_id'])
+            if (order is None or order.status != 'pending_assignment'
+                    or driver is None or driver.status != 'available' or not driver.is_active):
+                continue
+            assign_order(order, driver)
+            applied.append(assignment)
+    return applied
+
+
+def dispatch(dry_run=False):
+    """
+    Plan (and unless dry_run, apply) one batch. Returns a summary with the
+    assignments, or None if another run holds the lock.
+    """
+    if not cache.add(LOCK_KEY, 1, LOCK_TIMEOUT):
+        return None
+    try:
+        started = time.perf_counter()
+        orders, drivers = load_inputs()
+        assignments = plan(orders, drivers)
+        planned_ms = (time.perf_counter() - started) * 1000
+        if not dry_run and assignments:
+            assignments = commit(assignments)
+        summary = {
+            'dry_run': dry_run,
+            'pending_orders': len(orders),
+            'available_drivers': len(drivers),
+            'assigned': len(assignments),
+            'total_pickup_km': round(sum(a['distance_km'] for a in assignments), 3),
+            'plan_ms': round(planned_ms, 1),
+            'assignments': assignments,
+        }
+        logger.info(f"Dispatch {'dry run' if dry_run else 'run'}: {summary['assigned']} of "
+                    f"{summary['pending_orders']} orders to {summary['available_drivers']} drivers")
+        return summary
+    finally:
+        cache.delete(LOCK_KEY)
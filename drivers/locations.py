@@ -0,0 +1,225 @@
+"""
+Driver GPS ingest.
+
+The driver app posts batches of fixes to /api/drivers/locations/. They are
+buffered - in this process, or in a Redis list shared by every web process
+when DRIVER_LOCATION_BUFFER_REDIS_URL is set - and written in bulk: one
+INSERT into the DriverLocation trail per flush, and one UPDATE of just the
+location columns per driver for its newest fix.
+
+The in-process buffer is flushed when it fills up and, so a driver's last
+fix is never left waiting for the next request to reach the same process,
+by a timer DRIVER_LOCATION_FLUSH_INTERVAL seconds after its oldest fix
+(and at exit). The shared Redis buffer is flushed by the Celery beat task.
+"""
+import atexit
+from datetime import datetime, time as dt_time, timedelta
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from pakahome.cache import invalidate_on_commit
+from users.caching import DRIVERS
+from users.models import Driver, DriverLocation
+from .spatial import driver_index
+
+logger = logging.getLogger(__name__)
+
+BUFFER_KEY = 'pakahome:driver-locations'
+FLUSH_LOCK_KEY = 'pakahome:driver-locations:flush'
+
+
+class LocalBuffer:
+    """Fixes held in this process until the next flush"""
+
+    def __init__(self):
+        self._items = []
+        self._oldest = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def push(self, rows):
+        with self._lock:
+            if not self._items:
+                self._oldest = time.monotonic()
+            self._items.extend(rows)
+            if self._timer is None:
+                self._timer = threading.Timer(settings.DRIVER_LOCATION_FLUSH_INTERVAL, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+            return len(self._items)
+
+    def _flush_on_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            flush()
+        except Exception:
+            logger.exception('Timed driver location flush failed')
+        finally:
+            connections.close_all()  # this timer thread's own connections
+
+    def drain(self, limit):
+        with self._lock:
+            rows, self._items = self._items[:limit], self._items[limit:]
+            if not self._items:
+                self._oldest = None
+            return rows
+
+    def due(self, size):
+        with self._lock:
+            if len(self._items) >= size:
+                return True
+            return self._oldest is not None and time.monotonic() - self._oldest >= settings.DRIVER_LOCATION_FLUSH_INTERVAL
+
+    def __len__(self):
+        return len(self._items)
+
+
+class RedisBuffer:
+    """One Redis list for all processes; a Celery task does the flushing"""
+
+    def __init__(self, url):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+
+    def push(self, rows):
+        return self.redis.rpush(BUFFER_KEY, *(json.dumps(row) for row in rows))
+
+    def drain(self, limit):
+        pipe = self.redis.pipeline()  # MULTI/EXEC: two flushers never get the same rows
+        pipe.lrange(BUFFER_KEY, 0, limit - 1)
+        pipe.ltrim(BUFFER_KEY, limit, -1)
+        rows, _ = pipe.execute()
+        return [json.loads(row) for row in rows]
+
+    def due(self, size):
+        # Time-based flushes come from the beat schedule
+        return self.redis.llen(BUFFER_KEY) >= size
+
+    def claim_flush(self):
+        """True for one caller per flush interval, so a burst queues a single task"""
+        return bool(self.redis.set(FLUSH_LOCK_KEY, 1, nx=True, ex=settings.DRIVER_LOCATION_FLUSH_INTERVAL))
+
+    def __len__(self):
+        return self.redis.llen(BUFFER_KEY)
+
+
+_buffer = None
+
+
+def buffer():
+    global _buffer
+    if _buffer is None:
+        url = settings.DRIVER_LOCATION_BUFFER_REDIS_URL
+        if url:
+            _buffer = RedisBuffer(url)
+        else:
+            _buffer = LocalBuffer()
+            atexit.register(flush)  # don't lose the last fixes on a clean shutdown
+    return _buffer
+
+
+def ingest(driver, fixes):
+    """Buffer validated fixes (LocationFixSerializer data) for `driver`. Returns how many."""
+    received_at = timezone.now().isoformat()
+    rows = [{
+        'driver_id': driver.id,
+        'latitude': str(fix['latitude']),
+        'longitude': str(fix['longitude']),
+        'accuracy': fix.get('accuracy'),
+        'speed': fix.get('speed'),
+        'heading': fix.get('heading'),
+        'recorded_at': fix['recorded_at'].isoformat(),
+        'received_at': received_at,
+    } for fix in fixes]
+    if not rows:
+        return 0
+
+    location_buffer = buffer()
+    location_buffer.push(rows)
+    if location_buffer.due(settings.DRIVER_LOCATION_FLUSH_SIZE):
+        if isinstance(location_buffer, LocalBuffer):
+            flush()
+        elif location_buffer.claim_flush():
+            from .tasks import flush_driver_locations
+            flush_driver_locations.delay()
+    return len(rows)
+
+
+def flush():
+    """Write everything buffered so far. Returns the number of trail rows inserted."""
+    location_buffer = buffer()
+    written = 0
+    while True:
+        rows = location_buffer.drain(settings.DRIVER_LOCATION_FLUSH_SIZE)
+        if rows:
+            written += write_fixes(rows)
+        if len(rows) < settings.DRIVER_LOCATION_FLUSH_SIZE:
+            return written
+
+
+def write_fixes(rows):
+    known = set(Driver.objects.filter(id__in={row['driver_id'] for row in rows}).values_list('id', flat=True))
+    locations = [
+        DriverLocation(
+            driver_id=row['driver_id'],
+            latitude=row['latitude'],
+            longitude=row['longitude'],
+            accuracy=row['accuracy'],
+            speed=row['speed'],
+            heading=row['heading'],
+            recorded_at=parse_datetime(row['recorded_at']),
+            received_at=parse_datetime(row['received_at']),
+        )
+        for row in rows if row['driver_id'] in known  # drop fixes of drivers deleted meanwhile
+    ]
+
+    latest = {}
+    for location in locations:
+        current = latest.get(location.driver_id)
+        if current is None or location.recorded_at > current.recorded_at:
+            latest[location.driver_id] = location
+
+    moved = []
+    with transaction.atomic():
+        DriverLocation.objects.bulk_create(locations, batch_size=500)
+        for driver_id, location in latest.items():
+            # A late batch must not move the driver back to an older position
+            updated = Driver.objects.filter(
+                Q(location_updated_at__isnull=True) | Q(location_updated_at__lt=location.recorded_at),
+                id=driver_id,
+            ).update(
+                current_latitude=location.latitude,
+                current_longitude=location.longitude,
+                location_updated_at=location.recorded_at,
+                updated_at=timezone.now(),  # server time, for the order ETags (orders.conditional)
+            )
+            if updated:
+                moved.append(location)
+        if moved:
+            # QuerySet.update() sends no post_save; the cached driver lists show positions
+            invalidate_on_commit(DRIVERS)
+
+    index = driver_index()
+    for location in moved:
+        index.moved(location.driver_id, location.latitude, location.longitude)
+    return len(locations)
+
+
+def purge_old_locations():
+    """Drop whole days of trail older than DRIVER_LOCATION_RETENTION. Returns rows removed."""
+    today = timezone.localdate()
+    cutoff = timezone.make_aware(
+        datetime.combine(today - timedelta(days=settings.DRIVER_LOCATION_RETENTION), dt_time.min)
+    )
+    deleted, _ = DriverLocation.objects.filter(recorded_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,47 @@
+"""
+Time the dispatch planner on a synthetic fleet (no database writes).
+Usage: python manage.py benchmark_dispatch [--drivers=1000] [--orders=5000] [--runs=3]
+Drivers and pickups are scattered over greater Nairobi with a denser CBD.
+"""
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from drivers.dispatch import plan
+
+CBD = (-1.2864, 36.8172)
+
+
+def random_point(rng):
+    if rng.random() < 0.4:
+        return rng.gauss(CBD[0], 0.03), rng.gauss(CBD[1], 0.03)
+    return rng.uniform(-1.45, -1.10), rng.uniform(36.65, 37.10)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark batch dispatch planning on synthetic drivers and orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--runs', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        orders = [(i, *random_point(rng)) for i in range(options['orders'])]
+        drivers = [(i, *random_point(rng), rng.choice((0, 0, 0, 1, 2))) for i in range(options['drivers'])]
+
+        timings = []
+        for _ in range(options['runs']):
+            started = time.perf_counter()
+            assignments = plan(orders, drivers)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        distances = [assignment['distance_km'] for assignment in assignments]
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(drivers)} drivers x {len(orders)} orders: {len(assignments)} assigned, "
+            f"mean pickup {statistics.mean(distances) if distances else 0:.2f} km, "
+            f"plan {min(timings):.0f} ms best / {statistics.median(timings):.0f} ms median"
+        ))
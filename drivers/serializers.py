@@ -0,0 +1,22 @@
+from datetime import timedelta
+from django.utils import timezone
+from rest_framework import serializers
+
+
+class LocationFixSerializer(serializers.Serializer):
+    """One GPS fix from the driver app"""
+    latitude = serializers.DecimalField(max_digits=9, decimal_places=6, min_value=-90, max_value=90)
+    longitude = serializers.DecimalField(max_digits=10, decimal_places=6, min_value=-180, max_value=180)
+    accuracy = serializers.FloatField(required=False, allow_null=True, min_value=0)
+    speed = serializers.FloatField(required=False, allow_null=True, min_value=0)
+    heading = serializers.FloatField(required=False, allow_null=True, min_value=0, max_value=360)
+    recorded_at = serializers.DateTimeField(required=False)
+    
+    def validate_recorded_at(self, value):
+        if value > timezone.now() + timedelta(minutes=1):
+            raise serializers.ValidationError('recorded_at is in the future')
+        return value
+    
+    def validate(self, attrs):
+        attrs.setdefault('recorded_at', timezone.now())
+        return attrs
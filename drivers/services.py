@@ -0,0 +1,27 @@
+"""Driver assignment shared by the admin endpoint and the dispatch engine"""
+from notifications.services import queue_sms_notification
+from orders.events import publish_order_event
+from orders.services import create_tracking_log
+from orders.sync import record_unassignment
+
+
+def assign_order(order, driver):
+    """Give `order` to an available `driver`: statuses, tracking log, event and driver SMS"""
+    previous_driver_id = order.driver_id
+    order.driver = driver
+    order.status = 'assigned'
+    order.save()
+    record_unassignment(order, previous_driver_id)
+    
+    # Update driver status
+    driver.status = 'busy'
+    driver.save(update_fields=['status', 'updated_at'])
+    
+    create_tracking_log(order, 'assigned', f'Order assigned to driver {driver.full_name}')
+    publish_order_event('order.assigned', order, driver_name=driver.full_name)
+    
+    # Send SMS to driver
+    queue_sms_notification(
+        driver.phone,
+        f"New order {order.tracking_code} assigned to you. Pickup: {order.pickup_address}"
+    )
@@ -0,0 +1,199 @@
+"""
+In-memory spatial index of available drivers for nearest-driver queries.
+
+Drivers are bucketed into a fixed lat/lng grid (DRIVER_GRID_CELL_DEG). A
+k-nearest query scans rings of cells outward from the query point and stops
+once no unvisited cell can hold anything closer than the k-th best match,
+so it touches a handful of cells instead of every driver. Searches are
+bounded by DRIVER_NEAREST_MAX_KM and fall back to a scan of the remaining
+drivers when the grid is sparse.
+
+The index is updated in place on every driver save and location flush in
+this process, and rebuilt from the database every DRIVER_INDEX_REFRESH
+seconds to pick up changes made by other processes.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 110.574
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class DriverGrid:
+    """Uniform grid of driver positions; thread-safe"""
+
+    def __init__(self, cell_deg):
+        self.cell_deg = cell_deg
+        self._cells = {}  # (row, col) -> {driver_id: (lat, lng)}
+        self._positions = {}  # driver_id -> (row, col)
+        self._lock = threading.Lock()
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def update(self, driver_id, lat, lng):
+        cell = self._cell(lat, lng)
+        with self._lock:
+            self._discard(driver_id)
+            self._cells.setdefault(cell, {})[driver_id] = (lat, lng)
+            self._positions[driver_id] = cell
+
+    def remove(self, driver_id):
+        with self._lock:
+            self._discard(driver_id)
+
+    def _discard(self, driver_id):
+        cell = self._positions.pop(driver_id, None)
+        if cell is not None:
+            members = self._cells[cell]
+            del members[driver_id]
+            if not members:
+                del self._cells[cell]
+
+    def replace(self, positions):
+        """Swap in a fresh set of {driver_id: (lat, lng)}"""
+        cells, index = {}, {}
+        for driver_id, (lat, lng) in positions.items():
+            cell = self._cell(lat, lng)
+            cells.setdefault(cell, {})[driver_id] = (lat, lng)
+            index[driver_id] = cell
+        with self._lock:
+            self._cells, self._positions = cells, index
+
+    def nearest(self, lat, lng, k, max_km=None):
+        """
+        Up to k (distance_km, driver_id) pairs within max_km (default
+        DRIVER_NEAREST_MAX_KM), closest first. Once the rings searched cover
+        more cells than there are drivers, the drivers not yet seen are
+        scanned directly, so a sparse grid costs O(drivers), not O(area).
+        Cells are copied under the lock; distances are computed outside it.
+        """
+        if max_km is None:
+            max_km = settings.DRIVER_NEAREST_MAX_KM
+        row0, col0 = self._cell(lat, lng)
+        # Smallest width of one cell around here, so ring r is at least (r - 1) cells away
+        cell_km = self.cell_deg * KM_PER_DEGREE_LAT * min(1.0, max(math.cos(math.radians(lat)), 0.01))
+        max_ring = int(max_km / cell_km) + 1
+        found, seen = [], set()
+        ring = 0
+        while ring <= max_ring:
+            if ring and len(found) >= k and (ring - 1) * cell_km >= found[k - 1][0]:
+                break
+            with self._lock:
+                total = len(self._positions)
+                if (2 * ring + 1) ** 2 > total:
+                    # Fewer drivers than cells from here on: read every driver not yet visited
+                    members = [
+                        (driver_id, position)
+                        for (row, col), cell_members in self._cells.items()
+                        if max(abs(row - row0), abs(col - col0)) >= ring
+                        for driver_id, position in cell_members.items()
+                    ]
+                    ring = max_ring
+                else:
+                    members = [
+                        (driver_id, position)
+                        for cell in self._ring(row0, col0, ring)
+                        for driver_id, position in self._cells.get(cell, {}).items()
+                    ]
+            for driver_id, (dlat, dlng) in members:
+                if driver_id in seen:  # moved outward between two rings
+                    continue
+                seen.add(driver_id)
+                distance = haversine_km(lat, lng, dlat, dlng)
+                if distance <= max_km:
+                    found.append((distance, driver_id))
+            found.sort()
+            ring += 1
+        return found[:k]
+
+    @staticmethod
+    def _ring(row0, col0, ring):
+        if ring == 0:
+            yield row0, col0
+            return
+        for col in range(col0 - ring, col0 + ring + 1):
+            yield row0 - ring, col
+            yield row0 + ring, col
+        for row in range(row0 - ring + 1, row0 + ring):
+            yield row, col0 - ring
+            yield row, col0 + ring
+
+    def __contains__(self, driver_id):
+        return driver_id in self._positions
+
+    def __len__(self):
+        return len(self._positions)
+
+
+class AvailableDriverIndex:
+    """DriverGrid of available, active drivers with a position, synced with the database"""
+
+    def __init__(self):
+        self.grid = DriverGrid(settings.DRIVER_GRID_CELL_DEG)
+        self._loaded_at = None
+        self._load_lock = threading.Lock()
+
+    def refresh(self):
+        from users.models import Driver
+
+        rows = Driver.objects.filter(
+            status='available', is_active=True,
+            current_latitude__isnull=False, current_longitude__isnull=False,
+        ).values_list('id', 'current_latitude', 'current_longitude')
+        self.grid.replace({driver_id: (float(lat), float(lng)) for driver_id, lat, lng in rows})
+        self._loaded_at = time.monotonic()
+
+    def ensure_fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= settings.DRIVER_INDEX_REFRESH:
+            with self._load_lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at >= settings.DRIVER_INDEX_REFRESH:
+                    self.refresh()
+
+    def driver_changed(self, driver):
+        if self._loaded_at is None:
+            return  # loaded from the database on first query
+        if (driver.status == 'available' and driver.is_active
+                and driver.current_latitude is not None and driver.current_longitude is not None):
+            self.grid.update(driver.id, float(driver.current_latitude), float(driver.current_longitude))
+        else:
+            self.grid.remove(driver.id)
+
+    def moved(self, driver_id, lat, lng):
+        """A location flush moved this driver; only indexed (available) drivers are tracked"""
+        if driver_id in self.grid:
+            self.grid.update(driver_id, float(lat), float(lng))
+
+    def nearest(self, lat, lng, k, max_km=None):
+        self.ensure_fresh()
+        return self.grid.nearest(lat, lng, k, max_km)
+
+
+_index = None
+
+
+def driver_index():
+    global _index
+    if _index is None:
+        _index = AvailableDriverIndex()
+    return _index
+
+
+def driver_saved(sender, instance, **kwargs):
+    driver_index().driver_changed(instance)
+
+
+def driver_deleted(sender, instance, **kwargs):
+    driver_index().grid.remove(instance.id)
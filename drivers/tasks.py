@@ -0,0 +1,27 @@
+"""Background driver location jobs"""
+from celery import shared_task
+from .locations import flush, purge_old_locations
+
+
+@shared_task
+def flush_driver_locations():
+    """Bulk-write buffered GPS fixes"""
+    return flush()
+
+
+@shared_task
+def purge_driver_locations():
+    """Drop trail days older than DRIVER_LOCATION_RETENTION"""
+    return purge_old_locations()
+
+
+@shared_task
+def dispatch_pending_orders():
+    """Assign pending orders to available drivers when automatic dispatch is on"""
+    from django.conf import settings
+    from .dispatch import dispatch
+
+    if not settings.DISPATCH_ENABLED:
+        return None
+    summary = dispatch()
+    return summary and summary['assigned']
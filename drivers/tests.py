@@ -3,12 +3,20 @@ Driver app tests: API and flows.
 Run: python manage.py test drivers
 """
 from decimal import Decimal
+from itertools import permutations
+from unittest import mock
+import random
+import time
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from users.models import Customer, Driver
-from orders.models import Order
+from users.models import Customer, Driver, DriverLocation
+from notifications.models import SMSLog
+from orders.models import Order, OrderTracking
+from . import dispatch, locations, spatial
 
 User = get_user_model()
 
@@ -163,7 +171,7 @@ class DriverAPITestCase(TestCase):
         self.client.force_authenticate(user=self.driver_user)
         r = self.client.get('/api/drivers/orders/')
         self.assertEqual(r.status_code, status.HTTP_200_OK)
-        data = r.json()
+        data = r.json()['results']
         self.assertIsInstance(data, list)
         self.assertGreaterEqual(len(data), 1)
         self.assertEqual(data[0]['tracking_code'], self.order.tracking_code)
@@ -333,7 +341,7 @@ class DriverAPITestCase(TestCase):
         self.client.force_authenticate(user=self.driver_user)
         r = self.client.get('/api/drivers/orders/')
         self.assertEqual(r.status_code, status.HTTP_200_OK)
-        self.assertGreaterEqual(len(r.json()), 1)
+        self.assertGreaterEqual(len(r.json()['results']), 1)
 
         r = self.client.post(f'/api/drivers/orders/{self.order.id}/accept/')
         self.assertEqual(r.status_code, status.HTTP_200_OK)
@@ -359,3 +367,219 @@ class DriverAPITestCase(TestCase):
         self.assertEqual(r.status_code, status.HTTP_200_OK)
         self.order.refresh_from_db()
         self.assertEqual(self.order.status, 'delivered')
+
+
+class FakeTimer:
+    """Stands in for threading.Timer; the test fires it"""
+    started = []
+
+    def __init__(self, interval, function):
+        self.interval, self.function = interval, function
+
+    def start(self):
+        FakeTimer.started.append(self)
+
+
+class DriverLocationIngestTestCase(TestCase):
+    """Batched GPS ingest: buffered, bulk-written trail, latest fix on Driver."""
+
+    def setUp(self):
+        locations._buffer = locations.LocalBuffer()
+        self.addCleanup(setattr, locations, '_buffer', None)
+        FakeTimer.started = []
+        timer = mock.patch('drivers.locations.threading.Timer', FakeTimer)
+        timer.start()
+        self.addCleanup(timer.stop)
+        user = User.objects.create_user(
+            phone_number=make_phone(60), email='gps@test.pakahome.local', password='1234', role='driver'
+        )
+        self.driver = Driver.objects.create(
+            user=user, full_name='GPS Driver', phone=make_phone(60), license_number='DLGPS'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def post_fixes(self, fixes):
+        return self.client.post('/api/drivers/locations/', {'fixes': fixes}, format='json')
+
+    def test_lone_fix_is_written_by_the_timer(self):
+        with self.settings(DRIVER_LOCATION_FLUSH_SIZE=10, DRIVER_LOCATION_FLUSH_INTERVAL=5):
+            self.post_fixes([{'latitude': '-1.2900', 'longitude': '36.8200', 'recorded_at': '2026-01-05T08:00:10Z'}])
+            self.post_fixes([{'latitude': '-1.2901', 'longitude': '36.8201', 'recorded_at': '2026-01-05T08:00:15Z'}])
+        self.assertEqual(DriverLocation.objects.count(), 0)
+        self.assertEqual([timer.interval for timer in FakeTimer.started], [5])  # one timer per batch of fixes
+
+        with mock.patch('drivers.locations.connections'):  # the timer thread closes its own connections
+            FakeTimer.started[0].function()
+        self.assertEqual(DriverLocation.objects.count(), 2)
+        self.driver.refresh_from_db()
+        self.assertEqual(self.driver.current_latitude, Decimal('-1.290100'))
+
+    def test_fixes_are_buffered_then_bulk_written(self):
+        fixes = [
+            {'latitude': '-1.2900', 'longitude': '36.8200', 'recorded_at': '2026-01-05T08:00:10Z'},
+            {'latitude': '-1.2920', 'longitude': '36.8220', 'recorded_at': '2026-01-05T08:00:20Z', 'speed': 8.5},
+            {'latitude': '-1.2910', 'longitude': '36.8210', 'recorded_at': '2026-01-05T08:00:15Z'},
+        ]
+        with self.settings(DRIVER_LOCATION_FLUSH_SIZE=10, DRIVER_LOCATION_FLUSH_INTERVAL=60):
+            response = self.post_fixes(fixes)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['accepted'], 3)
+        self.assertEqual(DriverLocation.objects.count(), 0)
+
+        # known drivers, one bulk INSERT, one UPDATE, savepoint pair
+        with self.assertNumQueries(5), mock.patch('drivers.locations.invalidate_on_commit') as invalidate:
+            self.assertEqual(locations.flush(), 3)
+        invalidate.assert_called_once_with('drivers')
+        self.driver.refresh_from_db()
+        # Newest by device time, not by arrival order
+        self.assertEqual(self.driver.current_latitude, Decimal('-1.292000'))
+        self.assertEqual(DriverLocation.objects.filter(driver=self.driver).count(), 3)
+
+        # A late, older fix extends the trail without moving the driver back
+        with self.settings(DRIVER_LOCATION_FLUSH_SIZE=1), \
+                mock.patch('drivers.locations.invalidate_on_commit') as invalidate:
+            self.post_fixes([{'latitude': '-1.2800', 'longitude': '36.8000', 'recorded_at': '2026-01-05T07:59:00Z'}])
+        invalidate.assert_not_called()
+        self.driver.refresh_from_db()
+        self.assertEqual(self.driver.current_latitude, Decimal('-1.292000'))
+        self.assertEqual(DriverLocation.objects.count(), 4)
+
+    def test_invalid_batches_are_rejected(self):
+        self.assertEqual(self.post_fixes([{'latitude': '91', 'longitude': '36.8'}]).status_code, 400)
+        self.assertEqual(self.post_fixes([]).status_code, 400)
+        with self.settings(DRIVER_LOCATION_MAX_BATCH=2):
+            self.assertEqual(self.post_fixes([{'latitude': '-1.29', 'longitude': '36.82'}] * 3).status_code, 400)
+        self.assertEqual(len(locations.buffer()), 0)
+
+    def test_status_update_writes_only_changed_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'/api/drivers/{self.driver.id}/status/', {'status': 'offline'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"status"', updates[0])
+        self.assertNotIn('"full_name"', updates[0])
+
+
+class NearestDriverTestCase(TestCase):
+    """Grid index k-nearest search and the admin nearest-driver endpoint."""
+
+    def setUp(self):
+        spatial._index = None
+        self.addCleanup(setattr, spatial, '_index', None)
+
+    def test_grid_matches_brute_force(self):
+        rng = random.Random(7)
+        grid = spatial.DriverGrid(0.01)
+        points = {i: (rng.uniform(-1.45, -1.15), rng.uniform(36.65, 37.05)) for i in range(3000)}
+        grid.replace(points)
+        grid.update(3000, -1.2921, 36.8219)
+        points[3000] = (-1.2921, 36.8219)
+        grid.remove(5)
+        del points[5]
+        for _ in range(50):
+            lat, lng = rng.uniform(-1.6, -1.0), rng.uniform(36.5, 37.2)
+            expected = sorted((spatial.haversine_km(lat, lng, *point), i) for i, point in points.items())[:5]
+            self.assertEqual(grid.nearest(lat, lng, 5), expected)
+            within = [match for match in expected if match[0] <= 2.0]
+            self.assertEqual(grid.nearest(lat, lng, 5, max_km=2.0), within)
+
+    def test_sparse_grid_search_is_bounded(self):
+        grid = spatial.DriverGrid(0.01)
+        grid.replace({1: (0.0, 0.0), 2: (-1.2921, 36.8219)})
+        started = time.perf_counter()
+        self.assertEqual([driver_id for _, driver_id in grid.nearest(-1.2921, 36.8219, 5)], [2])
+        self.assertEqual([driver_id for _, driver_id in grid.nearest(-1.2921, 36.8219, 5, max_km=20000)], [2, 1])
+        self.assertEqual(spatial.DriverGrid(0.01).nearest(-1.2921, 36.8219, 5), [])
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+    def test_nearest_endpoint_follows_driver_changes(self):
+        admin = User.objects.create_user(
+            phone_number=make_phone(70), email='near-admin@test.pakahome.local', password='1234', role='admin'
+        )
+        drivers = []
+        for i, (lat, lng) in enumerate([('-1.2700', '36.8100'), ('-1.3000', '36.8300'), ('-1.2650', '36.8050')]):
+            user = User.objects.create_user(
+                phone_number=make_phone(71 + i), email=f'near{i}@test.pakahome.local', password='1234', role='driver'
+            )
+            drivers.append(Driver.objects.create(
+                user=user, full_name=f'Near {i}', phone=make_phone(71 + i), license_number=f'DLN{i}',
+                status='available', current_latitude=lat, current_longitude=lng,
+            ))
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        response = client.get('/api/drivers/nearest/', {'lat': '-1.2680', 'lng': '36.8080', 'k': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['driver']['id'] for row in response.data], [drivers[0].id, drivers[2].id])
+        self.assertLess(response.data[0]['distance_km'], 0.5)
+
+        drivers[0].status = 'busy'
+        drivers[0].save(update_fields=['status'])
+        response = client.get('/api/drivers/nearest/', {'lat': '-1.2680', 'lng': '36.8080', 'k': 2})
+        self.assertEqual([row['driver']['id'] for row in response.data], [drivers[2].id, drivers[1].id])
+
+        self.assertEqual(client.get('/api/drivers/nearest/').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DispatchTestCase(TestCase):
+    """Batch assignment of pending orders to available drivers."""
+
+    def test_auction_finds_the_cheapest_full_assignment(self):
+        rng = random.Random(3)
+        for _ in range(20):
+            costs = {(d, o): rng.uniform(0, 10) for d in range(5) for o in range(5)}
+            edges = {pair: (cost, cost) for pair, cost in costs.items()}
+            owner = dispatch.auction(edges, 0.001)
+            self.assertEqual(sorted(owner), list(range(5)))
+            self.assertEqual(sorted(owner.values()), list(range(5)))
+            best = min(sum(costs[(d, o)] for o, d in enumerate(perm)) for perm in permutations(range(5)))
+            self.assertLessEqual(sum(costs[(d, o)] for o, d in owner.items()), best + 5 * 0.001 + 1e-9)
+
+    def test_dispatch_dry_run_then_commit(self):
+        admin = User.objects.create_user(
+            phone_number=make_phone(80), email='dispatch-admin@test.pakahome.local', password='1234', role='admin'
+        )
+        customer_user = User.objects.create_user(
+            phone_number=make_phone(81), email='dispatch-customer@test.pakahome.local', password='1234', role='customer'
+        )
+        customer = Customer.objects.create(user=customer_user, full_name='Dispatch Customer', phone=make_phone(81))
+        spots = [('-1.2700', '36.8100'), ('-1.3000', '36.7800')]
+        drivers, orders = [], []
+        for i, (lat, lng) in enumerate(spots):
+            user = User.objects.create_user(
+                phone_number=make_phone(82 + i), email=f'dispatch{i}@test.pakahome.local', password='1234', role='driver'
+            )
+            drivers.append(Driver.objects.create(
+                user=user, full_name=f'Dispatch {i}', phone=make_phone(82 + i), license_number=f'DLD{i}',
+                status='available', current_latitude=lat, current_longitude=lng,
+            ))
+        # Pickups listed in the opposite order to the drivers nearest them
+        for lat, lng in reversed(spots):
+            orders.append(Order.objects.create(
+                customer=customer, pickup_name='A', pickup_phone=make_phone(81), pickup_address='Pickup',
+                pickup_latitude=Decimal(lat) + Decimal('0.001'), pickup_longitude=lng,
+                delivery_name='B', delivery_phone=make_phone(81), delivery_address='Drop',
+                price=Decimal('150'), status='pending_assignment',
+            ))
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        response = client.post('/api/drivers/dispatch/', {'dry_run': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['assigned'], 2)
+        planned = {(a['order_id'], a['driver_id']) for a in response.data['assignments']}
+        self.assertEqual(planned, {(orders[0].id, drivers[1].id), (orders[1].id, drivers[0].id)})
+        self.assertFalse(Order.objects.exclude(status='pending_assignment').exists())
+
+        response = client.post('/api/drivers/dispatch/', {}, format='json')
+        self.assertEqual(response.data['assigned'], 2)
+        for order_id, driver_id in planned:
+            order = Order.objects.get(id=order_id)
+            self.assertEqual((order.status, order.driver_id), ('assigned', driver_id))
+        self.assertEqual(set(Driver.objects.values_list('status', flat=True)), {'busy'})
+        self.assertEqual(OrderTracking.objects.filter(status='assigned').count(), 2)
+        self.assertEqual(SMSLog.objects.filter(message__startswith='New order').count(), 2)
+
+        self.assertEqual(client.post('/api/drivers/dispatch/', {}, format='json').data['assigned'], 0)
@@ -1,11 +1,26 @@
+from datetime import timedelta
 from rest_framework import status, generics, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from django.conf import settings
 from django.shortcuts import get_object_or_404
-from users.models import Driver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from users.models import Driver, DriverLocation
 from users.serializers import DriverSerializer
+from orders.conditional import conditional_response, orders_etag
+from orders.events import publish_order_event
 from orders.models import Order
-from orders.serializers import OrderSerializer
+from orders.serializers import OrderSerializer, OrderListSerializer
+from orders.sync import changes_response
+from pakahome.cache import cache_response
+from pakahome.pagination import paginated_response
+from users.caching import DRIVERS
+from .dispatch import dispatch
+from .locations import ingest
+from .serializers import LocationFixSerializer
+from .services import assign_order
+from .spatial import driver_index
 
 
 class DriverListView(generics.ListAPIView):
@@ -16,11 +31,12 @@ class DriverListView(generics.ListAPIView):
     def get_queryset(self):
         if self.request.user.role != 'admin':
             return Driver.objects.none()
-        return Driver.objects.filter(is_active=True).order_by('id')
+        return DriverSerializer.setup_eager_loading(Driver.objects.filter(is_active=True)).order_by('id')
 
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@cache_response(DRIVERS, vary_on_role=True)
 def available_drivers(request):
     """Get list of available drivers"""
     if request.user.role != 'admin':
@@ -29,11 +45,54 @@ def available_drivers(request):
             status=status.HTTP_403_FORBIDDEN
         )
     
-    drivers = Driver.objects.filter(status='available', is_active=True)
+    drivers = DriverSerializer.setup_eager_loading(Driver.objects.filter(status='available', is_active=True))
     serializer = DriverSerializer(drivers, many=True)
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def nearest_drivers(request):
+    """
+    The k closest available drivers to ?order_id= (its pickup point) or ?lat=&lng=,
+    with haversine distances (admin only; optional ?k= and ?max_km=)
+    """
+    if request.user.role != 'admin':
+        return Response(
+            {'error': 'Only admins can search for drivers'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    try:
+        k = min(int(request.query_params.get('k', 5)), 50)
+        max_km = float(request.query_params['max_km']) if 'max_km' in request.query_params else None
+        if 'order_id' in request.query_params:
+            order = get_object_or_404(Order, id=int(request.query_params['order_id']))
+            if order.pickup_latitude is None or order.pickup_longitude is None:
+                return Response(
+                    {'error': 'Order has no pickup coordinates'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            lat, lng = float(order.pickup_latitude), float(order.pickup_longitude)
+        else:
+            lat, lng = float(request.query_params['lat']), float(request.query_params['lng'])
+    except (KeyError, ValueError):
+        return Response(
+            {'error': 'order_id, or lat and lng, are required'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if k < 1:
+        return Response({'error': 'k must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    matches = driver_index().nearest(lat, lng, k, max_km)
+    drivers = DriverSerializer.setup_eager_loading(Driver.objects.filter(id__in=[driver_id for _, driver_id in matches]))
+    drivers = {driver.id: driver for driver in drivers}
+    return Response([
+        {'distance_km': round(distance, 3), 'driver': DriverSerializer(drivers[driver_id]).data}
+        for distance, driver_id in matches if driver_id in drivers
+    ])
+
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def assign_driver(request, order_id):
@@ -61,24 +120,7 @@ def assign_driver(request, order_id):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    order.driver = driver
-    order.status = 'assigned'
-    order.save()
-    
-    # Update driver status
-    driver.status = 'busy'
-    driver.save()
-    
-    # Create tracking log
-    from orders.services import create_tracking_log
-    create_tracking_log(order, 'assigned', f'Order assigned to driver {driver.full_name}')
-    
-    # Send SMS to driver
-    from notifications.services import send_sms_notification
-    send_sms_notification(
-        driver.phone,
-        f"New order {order.tracking_code} assigned to you. Pickup: {order.pickup_address}"
-    )
+    assign_order(order, driver)
     
     return Response({
         'message': 'Driver assigned successfully',
@@ -86,6 +128,26 @@ def assign_driver(request, order_id):
     })
 
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def dispatch_orders(request):
+    """Assign all pending orders to available drivers in one batch (admin only; {"dry_run": true} to preview)"""
+    if request.user.role != 'admin':
+        return Response(
+            {'error': 'Only admins can dispatch orders'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    dry_run = str(request.data.get('dry_run', False)).lower() in ('true', '1')
+    summary = dispatch(dry_run=dry_run)
+    if summary is None:
+        return Response(
+            {'error': 'A dispatch run is already in progress'}, 
+            status=status.HTTP_409_CONFLICT
+        )
+    return Response(summary)
+
+
 @api_view(['GET', 'POST'])
 @permission_classes([permissions.IsAuthenticated])
 def update_driver_status(request, driver_id):
@@ -118,6 +180,7 @@ def update_driver_status(request, driver_id):
     latitude = request.data.get('latitude')
     longitude = request.data.get('longitude')
     
+    update_fields = []
     if new_status:
         if new_status not in ['available', 'busy', 'offline']:
             return Response(
@@ -125,12 +188,16 @@ def update_driver_status(request, driver_id):
                 status=status.HTTP_400_BAD_REQUEST
             )
         driver.status = new_status
+        update_fields.append('status')
     
     if latitude and longitude:
         driver.current_latitude = latitude
         driver.current_longitude = longitude
+        driver.location_updated_at = timezone.now()
+        update_fields += ['current_latitude', 'current_longitude', 'location_updated_at']
     
-    driver.save()
+    if update_fields:
+        driver.save(update_fields=update_fields + ['updated_at'])
     
     return Response({
         'message': 'Status updated successfully',
@@ -168,6 +235,7 @@ def my_driver_status(request):
     latitude = request.data.get('latitude')
     longitude = request.data.get('longitude')
     
+    update_fields = []
     if new_status:
         if new_status not in ['available', 'busy', 'offline']:
             return Response(
@@ -175,12 +243,16 @@ def my_driver_status(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         driver.status = new_status
+        update_fields.append('status')
     
     if latitude and longitude:
         driver.current_latitude = latitude
         driver.current_longitude = longitude
+        driver.location_updated_at = timezone.now()
+        update_fields += ['current_latitude', 'current_longitude', 'location_updated_at']
     
-    driver.save()
+    if update_fields:
+        driver.save(update_fields=update_fields + ['updated_at'])
     
     return Response({
         'message': 'Status updated successfully',
@@ -221,10 +293,11 @@ def accept_order(request, order_id):
     # Create tracking log
     from orders.services import create_tracking_log
     create_tracking_log(order, 'accepted', f'Order accepted by driver {driver.full_name}')
+    publish_order_event('order.status', order, previous_status='assigned')
     
     # Send SMS to customer
-    from notifications.services import send_sms_notification
-    send_sms_notification(
+    from notifications.services import queue_sms_notification
+    queue_sms_notification(
         order.customer.phone,
         f"Driver {driver.full_name} has accepted your order {order.tracking_code}. They will pick up soon!"
     )
@@ -238,7 +311,7 @@ def accept_order(request, order_id):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def driver_orders(request):
-    """Get orders assigned to current driver"""
+    """Get orders assigned to current driver, newest first (cursor-paginated; ?updated_since=<cursor> for changes only)"""
     user = request.user
     if user.role != 'driver':
         return Response(
@@ -248,12 +321,73 @@ def driver_orders(request):
     
     try:
         driver = user.driver_profile
-        orders = Order.objects.filter(driver=driver).order_by('-created_at')
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        orders = Order.objects.filter(driver=driver)
+        if 'updated_since' in request.query_params:
+            return changes_response(
+                request, OrderListSerializer.setup_eager_loading(orders, request), OrderListSerializer
+            )
+        
+        def build_response():
+            rows = OrderListSerializer.setup_eager_loading(orders, request)
+            return paginated_response(request, rows, OrderListSerializer, context={'request': request})
+        
+        return conditional_response(request, orders_etag(request, orders), build_response)
     except Driver.DoesNotExist:
         return Response(
             {'error': 'Driver profile not found'}, 
             status=status.HTTP_404_NOT_FOUND
         )
 
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def ingest_locations(request):
+    """Accept a batch of GPS fixes from the driver app ({"fixes": [...]} or one fix)"""
+    if request.user.role != 'driver':
+        return Response(
+            {'error': 'Only drivers can report locations'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    try:
+        driver = request.user.driver_profile
+    except Driver.DoesNotExist:
+        return Response(
+            {'error': 'Driver profile not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    fixes = request.data.get('fixes') if 'fixes' in request.data else [request.data]
+    if not isinstance(fixes, list) or not fixes:
+        return Response(
+            {'error': 'fixes must be a non-empty list'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(fixes) > settings.DRIVER_LOCATION_MAX_BATCH:
+        return Response(
+            {'error': f'At most {settings.DRIVER_LOCATION_MAX_BATCH} fixes per request'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    serializer = LocationFixSerializer(data=fixes, many=True)
+    serializer.is_valid(raise_exception=True)
+    accepted = ingest(driver, serializer.validated_data)
+    return Response({'accepted': accepted}, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def driver_trail(request, driver_id):
+    """A driver's recorded GPS trail, oldest first (admin only; ?since=<ISO time>)"""
+    if request.user.role != 'admin':
+        return Response(
+            {'error': 'Only admins can view driver trails'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    driver = get_object_or_404(Driver, id=driver_id)
+    since = parse_datetime(request.query_params.get('since', '')) or timezone.now() - timedelta(hours=24)
+    fixes = (DriverLocation.objects.filter(driver=driver, recorded_at__gte=since)
+             .order_by('recorded_at')
+             .values('latitude', 'longitude', 'accuracy', 'speed', 'heading', 'recorded_at')[:5000])
+    return Response({'driver_id': driver.id, 'fixes': list(fixes)})
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_smslog_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='smslog',
+            index=models.Index(fields=['created_at', 'id'], name='smslog_created_at_id_idx'),
+        ),
+    ]
@@ -2,16 +2,25 @@ from django.db import models
 
 
 class SMSLog(models.Model):
-    """Log of SMS notifications sent"""
+    """Log of SMS notifications sent.
+
+    Also acts as the SMS outbox: queued messages are stored with status
+    'pending' and picked up by notifications.tasks.drain_sms_outbox.
+    """
     phone_number = models.CharField(max_length=15)
     message = models.TextField()
     status = models.CharField(max_length=20, default='pending')
     response = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='smslog_outbox_idx'),
+            models.Index(fields=['created_at', 'id'], name='smslog_created_at_id_idx'),  # cursor pages
+        ]
     
     def __str__(self):
         return f"SMS to {self.phone_number} - {self.status}"
-
@@ -1,8 +1,47 @@
 """Africa's Talking SMS service"""
+from datetime import timedelta
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
 import requests
+from pakahome import outbound
 from .models import SMSLog
 
+AFRICASTALKING_SMS_PATH = "/version1/messaging"
+
+# Africa's Talking per-recipient status codes that mean the message was accepted
+AFRICASTALKING_SUCCESS_CODES = {100, 101, 102}
+
+DRAIN_SCHEDULED_KEY = 'notifications:sms_drain_scheduled'
+
+
+def format_phone_number(phone_number):
+    """Normalize a phone number to 254XXXXXXXXX for Africa's Talking"""
+    phone = phone_number.replace('+', '').replace(' ', '')
+    if not phone.startswith('254'):
+        if phone.startswith('0'):
+            phone = '254' + phone[1:]
+        else:
+            phone = '254' + phone
+    return phone
+
+
+def _post_messages(recipients, message):
+    """POST one message to one or more recipients (comma-separated 'to')."""
+    headers = {
+        'ApiKey': settings.AFRICASTALKING_API_KEY,
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'Accept': 'application/json'
+    }
+    data = {
+        'username': settings.AFRICASTALKING_USERNAME,
+        'to': ','.join(recipients),
+        'message': message,
+        'from': settings.AFRICASTALKING_SENDER_ID
+    }
+    return outbound.client('africastalking').post(AFRICASTALKING_SMS_PATH, headers=headers, data=data)
+
 
 def send_sms_notification(phone_number, message):
     """
@@ -11,8 +50,7 @@ def send_sms_notification(phone_number, message):
     """
     api_key = settings.AFRICASTALKING_API_KEY
     username = settings.AFRICASTALKING_USERNAME
-    sender_id = settings.AFRICASTALKING_SENDER_ID
-    
+
     if not api_key or not username:
         # Log but don't fail if API not configured
         SMSLog.objects.create(
@@ -22,33 +60,10 @@ def send_sms_notification(phone_number, message):
             response='API not configured'
         )
         return False
-    
-    url = "https://api.africastalking.com/version1/messaging"
-    
-    headers = {
-        'ApiKey': api_key,
-        'Content-Type': 'application/x-www-form-urlencoded',
-        'Accept': 'application/json'
-    }
-    
-    # Format phone number
-    phone = phone_number.replace('+', '').replace(' ', '')
-    if not phone.startswith('254'):
-        if phone.startswith('0'):
-            phone = '254' + phone[1:]
-        else:
-            phone = '254' + phone
-    
-    data = {
-        'username': username,
-        'to': phone,
-        'message': message,
-        'from': sender_id
-    }
-    
+
     try:
-        response = requests.post(url, headers=headers, data=data, timeout=10)
-        
+        response = _post_messages([format_phone_number(phone_number)], message)
+
         # Log the SMS
         sms_log = SMSLog.objects.create(
             phone_number=phone_number,
@@ -56,7 +71,7 @@ def send_sms_notification(phone_number, message):
             status='sent' if response.status_code == 201 else 'failed',
             response=response.text
         )
-        
+
         if response.status_code == 201:
             return True
         else:
@@ -70,3 +85,124 @@ def send_sms_notification(phone_number, message):
         )
         return False
 
+
+def queue_sms_notification(phone_number, message):
+    """
+    Queue an SMS on the outbox instead of sending it inside the request.
+    The message is sent by the drain_sms_outbox worker task, batched with
+    other recipients of the same text.
+    """
+    sms_log = SMSLog.objects.create(
+        phone_number=phone_number,
+        message=message,
+        status='pending',
+        next_attempt_at=timezone.now()
+    )
+    transaction.on_commit(schedule_sms_drain)
+    return sms_log
+
+
+def schedule_sms_drain():
+    """Schedule one drain per batch window so queued messages get grouped."""
+    from .tasks import drain_sms_outbox
+
+    if settings.CELERY_TASK_ALWAYS_EAGER:
+        # No worker: send right away
+        drain_sms_outbox.delay()
+        return
+
+    window = settings.SMS_BATCH_WINDOW
+    if cache.add(DRAIN_SCHEDULED_KEY, True, timeout=max(window, 1)):
+        drain_sms_outbox.apply_async(countdown=window)
+
+
+def retry_delay(attempts):
+    """Exponential backoff (in seconds) after the given number of failed attempts"""
+    delay = settings.SMS_RETRY_BACKOFF * (2 ** max(attempts - 1, 0))
+    return min(delay, settings.SMS_RETRY_BACKOFF_MAX)
+
+
+def send_sms_batch(sms_logs):
+    """
+    Send a batch of queued SMSLog rows.
+    Rows with the same message text go out in one Africa's Talking request
+    with all their recipients. Each row is marked sent, rescheduled with
+    backoff, or failed once SMS_MAX_ATTEMPTS is reached.
+    Returns the number of rows sent.
+    """
+    if not settings.AFRICASTALKING_API_KEY or not settings.AFRICASTALKING_USERNAME:
+        for sms_log in sms_logs:
+            _mark_failed(sms_log, 'API not configured', retry=False)
+        return 0
+
+    by_message = {}
+    for sms_log in sms_logs:
+        by_message.setdefault(sms_log.message, []).append(sms_log)
+
+    sent = 0
+    chunk_size = settings.SMS_MAX_RECIPIENTS_PER_REQUEST
+    for message, group in by_message.items():
+        for start in range(0, len(group), chunk_size):
+            sent += _send_group(message, group[start:start + chunk_size])
+    return sent
+
+
+def _send_group(message, sms_logs):
+    by_phone = {}
+    for sms_log in sms_logs:
+        by_phone.setdefault(format_phone_number(sms_log.phone_number), []).append(sms_log)
+
+    try:
+        response = _post_messages(list(by_phone), message)
+    except requests.exceptions.RequestException as e:
+        for sms_log in sms_logs:
+            _mark_failed(sms_log, str(e))
+        return 0
+
+    if response.status_code != 201:
+        for sms_log in sms_logs:
+            _mark_failed(sms_log, response.text)
+        return 0
+
+    try:
+        recipients = response.json()['SMSMessageData']['Recipients']
+    except (ValueError, KeyError, TypeError):
+        recipients = None
+
+    if recipients is None:
+        # Accepted, but no per-recipient breakdown to go on
+        for sms_log in sms_logs:
+            _mark_sent(sms_log, response.text)
+        return len(sms_logs)
+
+    sent = 0
+    results = {str(r.get('number', '')).replace('+', ''): r for r in recipients}
+    for phone, phone_logs in by_phone.items():
+        result = results.get(phone)
+        for sms_log in phone_logs:
+            if result and result.get('statusCode') in AFRICASTALKING_SUCCESS_CODES:
+                _mark_sent(sms_log, str(result))
+                sent += 1
+            else:
+                _mark_failed(sms_log, str(result) if result else response.text)
+    return sent
+
+
+def _mark_sent(sms_log, response_text):
+    sms_log.status = 'sent'
+    sms_log.response = response_text
+    sms_log.attempts += 1
+    sms_log.next_attempt_at = None
+    sms_log.save(update_fields=['status', 'response', 'attempts', 'next_attempt_at'])
+
+
+def _mark_failed(sms_log, response_text, retry=True):
+    sms_log.attempts += 1
+    sms_log.response = response_text
+    if retry and sms_log.attempts < settings.SMS_MAX_ATTEMPTS:
+        sms_log.status = 'pending'
+        sms_log.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(sms_log.attempts))
+    else:
+        sms_log.status = 'failed'
+        sms_log.next_attempt_at = None
+    sms_log.save(update_fields=['status', 'response', 'attempts', 'next_attempt_at'])
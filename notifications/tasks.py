@@ -0,0 +1,45 @@
+"""Background SMS delivery"""
+from datetime import timedelta
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import SMSLog
+from .services import send_sms_batch
+
+
+def claim_sms_batch(limit):
+    """
+    Claim up to `limit` due outbox rows.
+    Claimed rows have next_attempt_at pushed out by SMS_CLAIM_LEASE so other
+    workers skip them; if this worker dies mid-send they become due again.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            SMSLog.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:limit]
+        )
+        if batch:
+            SMSLog.objects.filter(id__in=[sms_log.id for sms_log in batch]).update(
+                next_attempt_at=now + timedelta(seconds=settings.SMS_CLAIM_LEASE)
+            )
+    return batch
+
+
+@shared_task
+def drain_sms_outbox():
+    """
+    Send queued SMS in batches until the outbox has nothing due.
+    Backed-off retries are picked up by the periodic run in CELERY_BEAT_SCHEDULE.
+    """
+    batch_size = settings.SMS_BATCH_SIZE
+    sent = 0
+    while True:
+        batch = claim_sms_batch(batch_size)
+        if batch:
+            sent += send_sms_batch(batch)
+        if len(batch) < batch_size:
+            break
+    return sent
@@ -0,0 +1,71 @@
+"""
+SMS outbox tests: batching and retries.
+Run: python manage.py test notifications
+"""
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from .models import SMSLog
+from .services import queue_sms_notification
+from .tasks import drain_sms_outbox
+
+
+def at_response(status_code, numbers=(), recipient_status=101):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.text = 'response'
+    response.json.return_value = {
+        'SMSMessageData': {
+            'Recipients': [{'number': f'+{n}', 'statusCode': recipient_status} for n in numbers]
+        }
+    }
+    return response
+
+
+@override_settings(AFRICASTALKING_API_KEY='key', AFRICASTALKING_USERNAME='pakahome', SMS_MAX_ATTEMPTS=2)
+class SMSOutboxTestCase(TestCase):
+
+    def test_queue_does_not_call_provider(self):
+        with mock.patch('pakahome.outbound.UpstreamClient.post') as post:
+            sms_log = queue_sms_notification('0700000001', 'Hello')
+        post.assert_not_called()
+        self.assertEqual(sms_log.status, 'pending')
+
+    def test_drain_groups_recipients_per_message(self):
+        queue_sms_notification('0700000001', 'Order picked up')
+        queue_sms_notification('0700000002', 'Order picked up')
+        queue_sms_notification('0700000003', 'Order delivered')
+
+        def fake_post(path, headers, data):
+            return at_response(201, data['to'].split(','))
+
+        with mock.patch('pakahome.outbound.UpstreamClient.post', side_effect=fake_post) as post:
+            sent = drain_sms_outbox()
+
+        self.assertEqual(sent, 3)
+        self.assertEqual(post.call_count, 2)
+        recipients = sorted(call.kwargs['data']['to'] for call in post.call_args_list)
+        self.assertEqual(recipients, ['254700000001,254700000002', '254700000003'])
+        self.assertEqual(SMSLog.objects.filter(status='sent').count(), 3)
+
+    def test_failed_send_backs_off_then_gives_up(self):
+        sms_log = queue_sms_notification('0700000001', 'Hello')
+
+        with mock.patch('pakahome.outbound.UpstreamClient.post', return_value=at_response(500)):
+            drain_sms_outbox()
+        sms_log.refresh_from_db()
+        self.assertEqual(sms_log.status, 'pending')
+        self.assertEqual(sms_log.attempts, 1)
+        self.assertGreater(sms_log.next_attempt_at, timezone.now())
+
+        # Not due yet: nothing is sent
+        with mock.patch('pakahome.outbound.UpstreamClient.post') as post:
+            drain_sms_outbox()
+        post.assert_not_called()
+
+        SMSLog.objects.filter(id=sms_log.id).update(next_attempt_at=timezone.now())
+        with mock.patch('pakahome.outbound.UpstreamClient.post', return_value=at_response(500)):
+            drain_sms_outbox()
+        sms_log.refresh_from_db()
+        self.assertEqual(sms_log.status, 'failed')
+        self.assertEqual(sms_log.attempts, 2)
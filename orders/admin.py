@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderTracking
+from .models import Order, OrderDailySummary, OrderTracking, OrderTombstone, GeocodeCacheEntry
 
 
 @admin.register(Order)
@@ -18,3 +18,24 @@ class OrderTrackingAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at']
     date_hierarchy = 'created_at'
 
+
+@admin.register(GeocodeCacheEntry)
+class GeocodeCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ['normalized_address', 'created_at', 'expires_at']
+    search_fields = ['normalized_address']
+    readonly_fields = ['address_key', 'created_at']
+
+
+@admin.register(OrderTombstone)
+class OrderTombstoneAdmin(admin.ModelAdmin):
+    list_display = ['tracking_code', 'reason', 'driver_id', 'created_at']
+    list_filter = ['reason']
+    search_fields = ['tracking_code']
+    readonly_fields = ['created_at']
+
+
+@admin.register(OrderDailySummary)
+class OrderDailySummaryAdmin(admin.ModelAdmin):
+    list_display = ['day', 'status', 'driver_id', 'orders', 'value', 'paid_orders', 'revenue']
+    list_filter = ['status']
+    date_hierarchy = 'day'
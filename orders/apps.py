@@ -4,4 +4,30 @@ from django.apps import AppConfig
 class OrdersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'orders'
-
+    
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save, pre_save
+        from . import summary
+        from .caching import driver_changed, order_changed, order_related_changed
+        from .sync import order_deleted, order_part_saved
+        
+        post_delete.connect(order_deleted, sender='orders.Order', dispatch_uid='orders.sync.order_deleted')
+        post_save.connect(order_part_saved, sender='payments.Payment', dispatch_uid='orders.sync.payment_saved')
+        post_save.connect(order_part_saved, sender='orders.OrderTracking', dispatch_uid='orders.sync.tracking_saved')
+        
+        post_save.connect(order_changed, sender='orders.Order', dispatch_uid='orders.caching.order_saved')
+        post_delete.connect(order_changed, sender='orders.Order', dispatch_uid='orders.caching.order_deleted')
+        post_save.connect(order_related_changed, sender='orders.OrderTracking', dispatch_uid='orders.caching.tracking_saved')
+        post_delete.connect(order_related_changed, sender='orders.OrderTracking',
+                            dispatch_uid='orders.caching.tracking_deleted')
+        post_save.connect(order_related_changed, sender='payments.Payment', dispatch_uid='orders.caching.payment_saved')
+        post_delete.connect(order_related_changed, sender='payments.Payment', dispatch_uid='orders.caching.payment_deleted')
+        post_save.connect(driver_changed, sender='users.Driver', dispatch_uid='orders.caching.driver_saved')
+        
+        pre_save.connect(summary.order_before_save, sender='orders.Order', dispatch_uid='orders.summary.order_before_save')
+        post_save.connect(summary.order_saved, sender='orders.Order', dispatch_uid='orders.summary.order_saved')
+        post_delete.connect(summary.order_deleted, sender='orders.Order', dispatch_uid='orders.summary.order_deleted')
+        pre_save.connect(summary.payment_before_save, sender='payments.Payment',
+                         dispatch_uid='orders.summary.payment_before_save')
+        post_save.connect(summary.payment_saved, sender='payments.Payment', dispatch_uid='orders.summary.payment_saved')
+        post_delete.connect(summary.payment_deleted, sender='payments.Payment', dispatch_uid='orders.summary.payment_deleted')
@@ -0,0 +1,213 @@
+"""
+Server-side Places Autocomplete with a prefix-aware cache.
+
+Addresses we have delivered to (the offline gazetteer) are listed first; a
+query that spells out one of them in full is answered from the gazetteer
+alone. The remaining places come, in order, from:
+  1. the cached predictions for the exact (normalized) query;
+  2. the cached predictions of a shorter prefix, narrowed locally - only when
+     that prefix returned fewer than MAX_PREDICTIONS, i.e. Google gave us
+     every match and a longer query can only select among them;
+  3. Google, with identical concurrent queries coalesced into one call.
+
+Google bills the autocomplete requests of a session token as one session
+when the picked prediction is resolved with place_details() under the same
+token; otherwise each request is billed on its own.
+"""
+import hashlib
+import re
+import threading
+import unicodedata
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from pakahome import outbound
+from .gazetteer import gazetteer
+
+AUTOCOMPLETE_PATH = "/maps/api/place/autocomplete/json"
+PLACE_DETAILS_PATH = "/maps/api/place/details/json"
+
+MAX_PREDICTIONS = 5  # Google never returns more than five
+MIN_PREFIX_LENGTH = 2
+CACHE_PREFIX = 'autocomplete:v1:'
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    text = unicodedata.normalize('NFKC', query or '').lower()
+    text = _PUNCTUATION_RE.sub(' ', text)
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def cache_key(normalized):
+    return CACHE_PREFIX + hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def narrow(predictions, normalized):
+    """Predictions whose description still matches every query token as a word prefix"""
+    tokens = normalized.split()
+    narrowed = []
+    for prediction in predictions:
+        words = normalize_query(prediction.get('description', '')).split()
+        if all(any(word.startswith(token) for word in words) for token in tokens):
+            prediction = dict(prediction)
+            # Offsets were computed for the shorter query
+            prediction.pop('matched_substrings', None)
+            narrowed.append(prediction)
+    return narrowed
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share its result"""
+
+    class _Call:
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, timeout=10):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            if not call.event.wait(timeout):
+                raise TimeoutError('Timed out waiting for in-flight request')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+_in_flight = SingleFlight()
+
+
+def fetch_predictions(query, sessiontoken):
+    params = {
+        'input': query,
+        'key': settings.GOOGLE_MAPS_API_KEY,
+        'components': 'country:ke',  # Restrict to Kenya
+        'sessiontoken': sessiontoken,
+    }
+    response = outbound.client('google_maps').get(AUTOCOMPLETE_PATH, params=params)
+    return response.json()
+
+
+def _store(normalized, payload):
+    predictions = payload.get('predictions', [])
+    entry = {
+        'predictions': predictions,
+        'complete': len(predictions) < MAX_PREDICTIONS,
+    }
+    cache.set(cache_key(normalized), entry, settings.AUTOCOMPLETE_CACHE_TTL)
+    return entry
+
+
+def _from_cache(normalized):
+    prefixes = [normalized[:i] for i in range(len(normalized), MIN_PREFIX_LENGTH - 1, -1)]
+    keys = [cache_key(prefix) for prefix in prefixes]
+    cached = cache.get_many(keys)
+
+    exact = cached.get(keys[0])
+    if exact is not None:
+        return exact['predictions'], 'cache'
+
+    for key in keys[1:]:
+        entry = cached.get(key)
+        if entry is None or not entry['complete']:
+            continue
+        narrowed = narrow(entry['predictions'], normalized)
+        if narrowed:
+            cache.set(cache_key(normalized), {'predictions': narrowed, 'complete': True},
+                      settings.AUTOCOMPLETE_CACHE_TTL)
+            return narrowed, 'prefix'
+        break
+    return None, None
+
+
+def merge(local, predictions):
+    """Gazetteer rows ahead of `predictions`, without repeating an address, at most MAX_PREDICTIONS"""
+    seen = {normalize_query(prediction['description']) for prediction in local}
+    merged = list(local)
+    for prediction in predictions:
+        if len(merged) >= MAX_PREDICTIONS:
+            break
+        if normalize_query(prediction.get('description', '')) not in seen:
+            merged.append(prediction)
+    return merged
+
+
+def autocomplete(query, sessiontoken=None):
+    """
+    Return a Places-style payload: {'status', 'predictions', 'sessiontoken', 'source'}.
+    The session token is created if the client did not send one; clients should
+    echo it until the user picks a prediction, then send it to place_details().
+    """
+    sessiontoken = sessiontoken or uuid.uuid4().hex
+    normalized = normalize_query(query)
+    if len(normalized) < MIN_PREFIX_LENGTH:
+        return {'status': 'ZERO_RESULTS', 'predictions': [], 'sessiontoken': sessiontoken, 'source': 'local'}
+
+    local = []
+    if len(normalized) >= settings.GAZETTEER_MIN_QUERY:
+        local = [{'description': place.text, 'place_id': None, 'source': 'gazetteer'}
+                 for place in gazetteer.search(normalized, MAX_PREDICTIONS)]
+        if gazetteer.exact(query):
+            return {'status': 'OK', 'predictions': local, 'sessiontoken': sessiontoken, 'source': 'gazetteer'}
+
+    predictions, source = _from_cache(normalized)
+    if predictions is not None:
+        return {'status': 'OK', 'predictions': merge(local, predictions), 'sessiontoken': sessiontoken,
+                'source': source}
+
+    def call_google():
+        payload = fetch_predictions(query, sessiontoken)
+        if payload.get('status') in ('OK', 'ZERO_RESULTS'):
+            _store(normalized, payload)
+        return payload
+
+    payload = _in_flight.do(normalized, call_google)
+    result = dict(payload)
+    result.update({'sessiontoken': sessiontoken, 'source': 'google'})
+    if local:
+        result.update({'status': 'OK', 'predictions': merge(local, payload.get('predictions', []))})
+    return result
+
+
+def place_details(place_id, sessiontoken=None):
+    """
+    Location of a picked prediction as a Geocoding-style payload:
+    {'status', 'results': [{'formatted_address', 'geometry', 'place_id'}]}.
+    Pass the autocomplete session token; it ends the session.
+    """
+    params = {
+        'place_id': place_id,
+        'fields': 'formatted_address,geometry,place_id',  # Basic fields only
+        'key': settings.GOOGLE_MAPS_API_KEY,
+    }
+    if sessiontoken:
+        params['sessiontoken'] = sessiontoken
+    payload = outbound.client('google_maps').get(PLACE_DETAILS_PATH, params=params).json()
+    result = payload.get('result')
+    return {'status': payload.get('status'), 'results': [result] if result else []}
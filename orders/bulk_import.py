@@ -0,0 +1,215 @@
+"""
+Bulk order import for corporate shippers.
+
+Rows come from a JSON array or an uploaded CSV (same column names as
+POST /api/orders/) and are processed in chunks of ORDER_IMPORT_CHUNK_SIZE:
+
+  1. each row is validated with OrderCreateSerializer;
+  2. addresses still missing coordinates are geocoded once per distinct
+     normalized address, ORDER_IMPORT_GEOCODE_WORKERS at a time;
+  3. the chunk is priced in one pass and written with two bulk_creates
+     (orders, then their first tracking logs) in one transaction, which
+     also counts the orders into the dashboard summary.
+
+A bad row is reported and skipped; it never fails the rest of the import.
+A CSV line that cannot be decoded or parsed ends the import with a failed
+row; the rows before it are kept. Results are yielded chunk by chunk so
+large files can be streamed back.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import csv
+from decimal import Decimal, ROUND_DOWN
+from itertools import islice
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+
+from .geocoding import normalize_address
+from .models import Order, OrderTracking
+from .pricing import pricing_engine
+from .summary import record_created
+from .serializers import OrderCreateSerializer
+from .services import geocode_address
+
+logger = logging.getLogger(__name__)
+
+COORDINATE_STEP = Decimal('0.000001')
+INITIAL_STATUS = 'pending_payment'
+INITIAL_DESCRIPTION = 'Order created, awaiting payment'
+
+
+class UnreadableCSV(ValueError):
+    pass
+
+
+def csv_rows(upload):
+    """
+    Rows of an uploaded CSV file as dicts, read lazily; blank cells are dropped.
+    Raises UnreadableCSV at the first line that is not UTF-8 or not valid CSV.
+    """
+    def lines():
+        # Decoded line by line, so an error names the line instead of an 8 KB block
+        for number, line in enumerate(upload.file, start=1):
+            try:
+                yield line.decode('utf-8-sig' if number == 1 else 'utf-8')
+            except UnicodeDecodeError:
+                raise UnreadableCSV(f'Line {number} is not UTF-8 text; save the file as "CSV UTF-8"') from None
+
+    reader = csv.DictReader(lines())
+    try:
+        for row in reader:
+            yield {field.strip(): value.strip() for field, value in row.items()
+                   if field and value is not None and value.strip() != ''}
+    except csv.Error as e:
+        raise UnreadableCSV(f'Line {reader.line_num + 1}: {e}') from None  # line_num counts lines already read
+
+
+def _quantize(value):
+    return Decimal(str(value)).quantize(COORDINATE_STEP, rounding=ROUND_DOWN)
+
+
+def _geocode_in_worker(address):
+    try:
+        return geocode_address(address)
+    finally:
+        connections.close_all()  # this thread's own connections, if the geocode cache opened any
+
+
+class OrderImporter:
+    """Imports rows for one customer; geocodes are shared across chunks"""
+
+    def __init__(self, customer):
+        self.customer = customer
+        self.locations = {}  # normalized address -> (lat, lng) or None
+        self.created = 0
+        self.failed = 0
+        self.unreadable = None
+
+    def _read(self, rows):
+        try:
+            yield from rows
+        except UnreadableCSV as e:
+            self.unreadable = e
+
+    def run(self, rows):
+        """Yield one result dict per row, in input order"""
+        rows = enumerate(self._read(rows), start=1)
+        max_rows = settings.ORDER_IMPORT_MAX_ROWS
+        while True:
+            chunk = list(islice(rows, settings.ORDER_IMPORT_CHUNK_SIZE))
+            if not chunk:
+                if self.unreadable is not None:
+                    self.failed += 1
+                    yield {'row': self.created + self.failed, 'status': 'failed',
+                           'errors': {'non_field_errors': [f'{self.unreadable}; the rest were not read']}}
+                return
+            over = [(number, row) for number, row in chunk if number > max_rows]
+            chunk = [(number, row) for number, row in chunk if number <= max_rows]
+            yield from self.import_chunk(chunk)
+            if over:
+                self.failed += 1
+                yield {'row': over[0][0], 'status': 'failed',
+                       'errors': {'non_field_errors': [f'At most {max_rows} rows per import; the rest were not read']}}
+                return
+
+    def summary(self):
+        return {'created': self.created, 'failed': self.failed}
+
+    def import_chunk(self, chunk):
+        results = {}
+        valid = []
+        for number, row in chunk:
+            if not isinstance(row, dict):
+                results[number] = {'row': number, 'status': 'failed',
+                                   'errors': {'non_field_errors': ['Each row must be an object']}}
+                continue
+            serializer = OrderCreateSerializer(data=dict(row))
+            if serializer.is_valid():
+                valid.append((number, serializer.validated_data))
+            else:
+                results[number] = {'row': number, 'status': 'failed', 'errors': serializer.errors}
+
+        self.geocode([data for _, data in valid])
+        orders = self.build_orders(valid)
+        results.update(self.save(orders))
+
+        for number, _ in chunk:
+            if results[number]['status'] == 'created':
+                self.created += 1
+            else:
+                self.failed += 1
+            yield results[number]
+
+    def geocode(self, rows):
+        """Fill in missing coordinates, one geocode per distinct address not seen earlier in this import"""
+        wanted = {}
+        for data in rows:
+            for prefix in ('pickup', 'delivery'):
+                if not data.get(f'{prefix}_latitude') or not data.get(f'{prefix}_longitude'):
+                    key = normalize_address(data[f'{prefix}_address'])
+                    if key not in self.locations:
+                        wanted.setdefault(key, data[f'{prefix}_address'])
+        if wanted:
+            workers = min(settings.ORDER_IMPORT_GEOCODE_WORKERS, len(wanted))
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='order-import-geocode') as pool:
+                    found = pool.map(_geocode_in_worker, wanted.values())
+                    for key, (lat, lng) in zip(wanted, found):
+                        self.locations[key] = (_quantize(lat), _quantize(lng)) if lat and lng else None
+            else:
+                for key, address in wanted.items():
+                    lat, lng = geocode_address(address)
+                    self.locations[key] = (_quantize(lat), _quantize(lng)) if lat and lng else None
+
+        for data in rows:
+            for prefix in ('pickup', 'delivery'):
+                if not data.get(f'{prefix}_latitude') or not data.get(f'{prefix}_longitude'):
+                    location = self.locations[normalize_address(data[f'{prefix}_address'])]
+                    if location is not None:
+                        data[f'{prefix}_latitude'], data[f'{prefix}_longitude'] = location
+
+    def build_orders(self, valid):
+        """[(row number, unsaved Order)], priced as in OrderListCreateView.create"""
+        priced = [(number, data) for number, data in valid if all(
+            data.get(field) for field in ('pickup_latitude', 'pickup_longitude', 'delivery_latitude', 'delivery_longitude')
+        )]
+        quotes = pricing_engine().quote_many([
+            (data['pickup_latitude'], data['pickup_longitude'], data['delivery_latitude'], data['delivery_longitude'])
+            for _, data in priced
+        ])
+        prices = {number: (quote.price, quote.is_within_nairobi) for (number, _), quote in zip(priced, quotes)}
+
+        orders = []
+        for number, data in valid:
+            # Default to outside Nairobi pricing if geocoding fails
+            price, is_within_nairobi = prices.get(number, (settings.PRICING_OUTSIDE_NAIROBI, False))
+            order = Order(customer=self.customer, status=INITIAL_STATUS,
+                          price=price, is_within_nairobi=is_within_nairobi, **data)
+            order.tracking_code = order.generate_tracking_code()  # bulk_create skips Order.save
+            orders.append((number, order))
+        return orders
+
+    def save(self, orders):
+        if not orders:
+            return {}
+        try:
+            with transaction.atomic():
+                Order.objects.bulk_create([order for _, order in orders])
+                OrderTracking.objects.bulk_create([
+                    OrderTracking(order=order, status=INITIAL_STATUS, description=INITIAL_DESCRIPTION)
+                    for _, order in orders
+                ])
+                record_created([order for _, order in orders])  # bulk_create sends no post_save
+        except DatabaseError as e:
+            logger.exception('Bulk order import chunk failed')
+            return {number: {'row': number, 'status': 'failed', 'errors': {'non_field_errors': [f'Could not save: {e}']}}
+                    for number, _ in orders}
+        return {number: {
+            'row': number,
+            'status': 'created',
+            'order_id': order.id,
+            'tracking_code': order.tracking_code,
+            'price': f'{Decimal(order.price):.2f}',
+            'is_within_nairobi': order.is_within_nairobi,
+        } for number, order in orders}
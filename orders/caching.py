@@ -0,0 +1,28 @@
+"""
+Cache invalidation for order writes: the order's tracking document (see
+orders.tracking) and the driver lists, which show order counts.
+"""
+from pakahome.cache import invalidate_on_commit
+from users.caching import DRIVERS
+from .tracking import document_changed
+
+
+def order_changed(sender, instance, **kwargs):
+    invalidate_on_commit(DRIVERS)
+    document_changed(instance.tracking_code)
+
+
+def order_related_changed(sender, instance, **kwargs):
+    """Tracking logs and payments are part of the tracking document"""
+    document_changed(instance.order.tracking_code)
+
+
+def driver_changed(sender, instance, **kwargs):
+    """Tracking documents of the driver's open orders name the driver"""
+    from .models import Order
+
+    tracking_codes = Order.objects.filter(
+        driver_id=instance.id, status__in=Order.OPEN_STATUSES
+    ).values_list('tracking_code', flat=True)
+    for tracking_code in tracking_codes:
+        document_changed(tracking_code)
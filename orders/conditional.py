@@ -0,0 +1,57 @@
+"""
+Conditional GET for order endpoints.
+
+The ETag of an order list (or single order) is derived from one aggregate
+query - row count, newest Order.updated_at and newest updated_at of the
+embedded customer and driver profiles - so an unchanged resource is answered
+with 304 Not Modified without loading or serializing any orders. Tracking
+logs and payments bump their order's updated_at (orders.sync), and location
+writes bump the driver's, so the aggregate follows single-row joins only.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def orders_etag(request, queryset):
+    """Weak ETag for `queryset` as seen by this user at this URL"""
+    state = queryset.order_by().aggregate(
+        count=Count('id'),
+        updated=Max('updated_at'),
+        customer=Max('customer__updated_at'),
+        driver=Max('driver__updated_at'),
+    )
+    parts = [
+        str(request.user.pk or ''),
+        request.get_full_path(),
+        str(state['count']),
+        *(value.isoformat() if value else '' for value in (state['updated'], state['customer'], state['driver'])),
+    ]
+    digest = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+    return 'W/' + quote_etag(digest)
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = parse_etags(header)
+    if '*' in candidates:
+        return True
+    bare = etag.removeprefix('W/')
+    return any(candidate.removeprefix('W/') == bare for candidate in candidates)
+
+
+def conditional_response(request, etag, build_response):
+    """304 if the client already has `etag`, else build_response() with the ETag attached"""
+    if etag_matches(request, etag):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = build_response()
+    response['ETag'] = etag
+    # Clients may keep the copy but must revalidate it every time
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,246 @@
+"""
+Cached Google directions and distance matrix.
+
+Origins and destinations are snapped to a DIRECTIONS_SNAP_DEG grid (0.001
+degrees, ~110 m) so trips between the same office, hub or estate share one
+entry. Entries live in a size-bounded in-process LRU in front of the Django
+cache, both expiring after DIRECTIONS_CACHE_TTL, and hold only what clients
+read: distance, duration, addresses and the encoded overview polyline.
+
+Distance-matrix requests look up every pair first and fetch the missing
+ones in batches of at most MATRIX_MAX_ORIGINS x MATRIX_MAX_DESTINATIONS per
+upstream call.
+"""
+import math
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+from pakahome import outbound
+from .geocoding import LRUCache
+from .services import geocode_address
+
+DIRECTIONS_PATH = '/maps/api/directions/json'
+DISTANCE_MATRIX_PATH = '/maps/api/distancematrix/json'
+CACHE_PREFIX = 'directions:v1:'
+MATRIX_MAX_ORIGINS = 10
+MATRIX_MAX_DESTINATIONS = 10  # 100 elements: Google's per-request limit
+
+
+def locate(text):
+    """(lat, lng) for "lat,lng" or an address (geocoded through the cache); None if unknown"""
+    parts = text.split(',')
+    if len(parts) == 2:
+        try:
+            return float(parts[0]), float(parts[1])
+        except ValueError:
+            pass
+    lat, lng = geocode_address(text, interactive=True)
+    return (lat, lng) if lat is not None and lng is not None else None
+
+
+def snap(point):
+    step = settings.DIRECTIONS_SNAP_DEG
+    return round(point[0] / step), round(point[1] / step)
+
+
+def snapped_text(point):
+    """Coordinates of the grid point a location snaps to, as sent upstream"""
+    step = settings.DIRECTIONS_SNAP_DEG
+    row, col = snap(point)
+    decimals = max(0, -math.floor(math.log10(step)))
+    return f'{row * step:.{decimals}f},{col * step:.{decimals}f}'
+
+
+def pair_key(kind, origin, destination):
+    (orow, ocol), (drow, dcol) = snap(origin), snap(destination)
+    return f'{CACHE_PREFIX}{kind}:{orow}:{ocol}:{drow}:{dcol}'
+
+
+class DirectionsCache:
+    """LRU in front of the Django cache, with hit/miss counters"""
+
+    def __init__(self, maxsize):
+        self.lru = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.counters = {'lru_hits': 0, 'cache_hits': 0, 'misses': 0}
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            value = self.lru.get(key)
+            if value is not None:
+                found[key] = value
+        self.count('lru_hits', len(found))
+        remote_keys = [key for key in keys if key not in found]
+        if remote_keys:
+            remote = cache.get_many(remote_keys)
+            for key, value in remote.items():
+                self.lru.set(key, value, settings.DIRECTIONS_CACHE_TTL)
+            found.update(remote)
+            self.count('cache_hits', len(remote))
+            self.count('misses', len(remote_keys) - len(remote))
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, entries):
+        ttl = settings.DIRECTIONS_CACHE_TTL
+        for key, value in entries.items():
+            self.lru.set(key, value, ttl)
+        cache.set_many(entries, ttl)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = sum(counters.values())
+        counters.update({
+            'lookups': lookups,
+            'hit_rate': round((lookups - counters['misses']) / lookups, 4) if lookups else None,
+            'lru_size': len(self.lru),
+            'lru_maxsize': self.lru.maxsize,
+        })
+        return counters
+
+
+directions_cache = DirectionsCache(settings.DIRECTIONS_CACHE_LRU_SIZE)
+
+
+def compact_route(route):
+    """The cached part of a Google route"""
+    legs = route['legs']
+    return {
+        'distance': sum(leg['distance']['value'] for leg in legs),  # metres
+        'duration': sum(leg['duration']['value'] for leg in legs),  # seconds
+        'start_address': legs[0].get('start_address', ''),
+        'end_address': legs[-1].get('end_address', ''),
+        'summary': route.get('summary', ''),
+        'polyline': route.get('overview_polyline', {}).get('points', ''),
+    }
+
+
+def expand_route(entry, source):
+    """Directions-API-shaped payload for a compact entry"""
+    distance_text = f"{entry['distance'] / 1000:.1f} km"
+    duration_text = f"{max(1, round(entry['duration'] / 60))} mins"
+    return {
+        'status': 'OK',
+        'routes': [{
+            'summary': entry['summary'],
+            'overview_polyline': {'points': entry['polyline']},
+            'legs': [{
+                'distance': {'text': distance_text, 'value': entry['distance']},
+                'duration': {'text': duration_text, 'value': entry['duration']},
+                'start_address': entry['start_address'],
+                'end_address': entry['end_address'],
+            }],
+        }],
+        'route_summary': {
+            'distance': distance_text,
+            'duration': duration_text,
+            'start_address': entry['start_address'],
+            'end_address': entry['end_address'],
+        },
+        'source': source,
+    }
+
+
+def cached_directions(origin, destination):
+    """
+    Directions between two (lat, lng) points through the cache. Returns a
+    Directions-API-shaped payload; only OK answers are cached.
+    """
+    key = pair_key('route', origin, destination)
+    entry = directions_cache.get(key)
+    if entry is not None:
+        return expand_route(entry, 'cache')
+
+    params = {
+        'origin': snapped_text(origin),
+        'destination': snapped_text(destination),
+        'key': settings.GOOGLE_MAPS_API_KEY,
+        'region': 'ke',
+        'alternatives': 'false',
+    }
+    data = outbound.client('google_maps').get(DIRECTIONS_PATH, params=params).json()
+    if data.get('status') != 'OK' or not data.get('routes'):
+        return data
+    entry = compact_route(data['routes'][0])
+    directions_cache.set_many({key: entry})
+    return expand_route(entry, 'google')
+
+
+def _fetch_matrix_block(origins, destinations):
+    """One Distance Matrix call; {(origin, destination): {'distance', 'duration'} or None}"""
+    params = {
+        'origins': '|'.join(snapped_text(point) for point in origins),
+        'destinations': '|'.join(snapped_text(point) for point in destinations),
+        'key': settings.GOOGLE_MAPS_API_KEY,
+        'region': 'ke',
+    }
+    data = outbound.client('google_maps').get(DISTANCE_MATRIX_PATH, params=params).json()
+    if data.get('status') != 'OK':
+        raise ValueError(data.get('error_message') or data.get('status', 'Distance matrix failed'))
+    results = {}
+    for origin, row in zip(origins, data.get('rows', [])):
+        for destination, element in zip(destinations, row.get('elements', [])):
+            if element.get('status') == 'OK':
+                results[(origin, destination)] = {
+                    'distance': element['distance']['value'],
+                    'duration': element['duration']['value'],
+                }
+            else:
+                results[(origin, destination)] = None
+    return results
+
+
+def distance_matrix(origins, destinations):
+    """
+    {'rows': [[{'distance', 'duration'} or None, ...], ...], 'cached', 'fetched', 'upstream_calls'}
+    for lists of (lat, lng); distances in metres, durations in seconds.
+    """
+    keys = {(o, d): pair_key('pair', o, d) for o in set(origins) for d in set(destinations)}
+    found = directions_cache.get_many(list(set(keys.values())))
+    values = {pair: found.get(key) for pair, key in keys.items()}
+
+    # Group missing destinations by origin, then batch origins that miss the same destinations
+    missing = {}
+    for (origin, destination), value in values.items():
+        if value is None:
+            missing.setdefault(origin, set()).add(destination)
+    groups = {}
+    for origin, wanted in missing.items():
+        groups.setdefault(frozenset(snap(point) for point in wanted), (wanted, []))[1].append(origin)
+
+    calls, fetched, to_store = 0, 0, {}
+    for wanted, group_origins in groups.values():
+        wanted = sorted(wanted)
+        for i in range(0, len(group_origins), MATRIX_MAX_ORIGINS):
+            block_origins = group_origins[i:i + MATRIX_MAX_ORIGINS]
+            for j in range(0, len(wanted), MATRIX_MAX_DESTINATIONS):
+                block = _fetch_matrix_block(block_origins, wanted[j:j + MATRIX_MAX_DESTINATIONS])
+                calls += 1
+                for pair, value in block.items():
+                    values[pair] = value
+                    if value is not None:
+                        to_store[keys[pair]] = value
+                        fetched += 1
+    if to_store:
+        directions_cache.set_many(to_store)
+
+    return {
+        'rows': [[values[(origin, destination)] for destination in destinations] for origin in origins],
+        'cached': len(values) - sum(len(wanted) for wanted in missing.values()),
+        'fetched': fetched,
+        'upstream_calls': calls,
+    }
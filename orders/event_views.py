@@ -0,0 +1,79 @@
+"""Server-sent event stream of order changes (served by the ASGI app)"""
+import asyncio
+import json
+import time
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from users.models import Customer, Driver
+from .events import bus, visible_to
+from .models import Order
+
+HEARTBEAT_INTERVAL = 15  # seconds between keep-alive comments
+STREAM_MAX_AGE = 600  # seconds; the browser reconnects on its own
+RECONNECT_DELAY_MS = 3000
+
+PUBLIC_EVENT_FIELDS = ('type', 'tracking_code', 'status', 'at')
+
+
+async def _viewer(request, tracking_code):
+    if tracking_code:
+        if not await Order.objects.filter(tracking_code=tracking_code).aexists():
+            return None
+        return {'tracking_code': tracking_code}
+
+    user = await request.auser()
+    if not user.is_authenticated:
+        return None
+    viewer = {'role': user.role}
+    if user.role == 'customer':
+        viewer['customer_id'] = await Customer.objects.filter(user=user).values_list('id', flat=True).afirst()
+    elif user.role == 'driver':
+        viewer['driver_id'] = await Driver.objects.filter(user=user).values_list('id', flat=True).afirst()
+    return viewer
+
+
+async def event_stream(viewer, max_age=STREAM_MAX_AGE):
+    yield f'retry: {RECONNECT_DELAY_MS}\n\n'
+    deadline = time.monotonic() + max_age
+    async with bus().subscribe() as queue:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = await asyncio.wait_for(queue.get(), min(HEARTBEAT_INTERVAL, remaining))
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if not visible_to(event, viewer):
+                continue
+            if viewer.get('tracking_code'):
+                event = {key: event[key] for key in PUBLIC_EVENT_FIELDS}
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+@require_GET
+async def order_events(request):
+    """
+    Stream order status changes, assignments and payment confirmations the
+    caller may see: all orders for admins, their own for customers and
+    drivers, or one order with ?tracking_code= (public, for the tracking page).
+    """
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI Django would buffer the endless stream; clients fall back to polling
+        return JsonResponse({'error': 'Event stream requires the ASGI server'}, status=503)
+
+    tracking_code = request.GET.get('tracking_code')
+    viewer = await _viewer(request, tracking_code)
+    if viewer is None:
+        if tracking_code:
+            return JsonResponse({'error': 'Order not found'}, status=404)
+        return JsonResponse({'error': 'Authentication credentials were not provided.'}, status=401)
+
+    response = StreamingHttpResponse(event_stream(viewer), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
@@ -0,0 +1,150 @@
+"""
+Order change events for the dashboards' server-sent event stream.
+
+Views call publish_order_event() where an order changes; the event goes out
+once the transaction commits. With ORDER_EVENTS_REDIS_URL set, events travel
+over Redis pub/sub so changes made by any web or Celery process reach every
+open stream; otherwise an in-process bus serves single-process servers.
+"""
+import asyncio
+from contextlib import asynccontextmanager, suppress
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'pakahome:order-events'
+SUBSCRIBER_QUEUE_SIZE = 100  # a client this far behind misses events and reloads
+
+
+def _offer(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        pass
+
+
+class LocalBus:
+    """Fan events out to the asyncio queues of streams in this process"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # The stream's event loop has shut down
+                pass
+
+    @asynccontextmanager
+    async def subscribe(self):
+        entry = (asyncio.get_running_loop(), asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.add(entry)
+        try:
+            yield entry[1]
+        finally:
+            with self._lock:
+                self._subscribers.discard(entry)
+
+
+class RedisBus:
+    """Redis pub/sub on one channel shared by all processes"""
+
+    def __init__(self, url):
+        self.url = url
+        self._client = None
+
+    def publish(self, event):
+        import redis
+
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(CHANNEL, json.dumps(event))
+
+    @asynccontextmanager
+    async def subscribe(self):
+        import redis.asyncio as aioredis
+
+        client = aioredis.from_url(self.url)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(CHANNEL)
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+        async def pump():
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    _offer(queue, json.loads(message['data']))
+
+        task = asyncio.create_task(pump())
+        try:
+            yield queue
+        finally:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+            await pubsub.aclose()
+            await client.aclose()
+
+
+_bus = None
+
+
+def bus():
+    global _bus
+    if _bus is None:
+        url = settings.ORDER_EVENTS_REDIS_URL
+        _bus = RedisBus(url) if url else LocalBus()
+    return _bus
+
+
+def order_event(event_type, order, **extra):
+    event = {
+        'type': event_type,
+        'order_id': order.id,
+        'tracking_code': order.tracking_code,
+        'status': order.status,
+        'customer_id': order.customer_id,
+        'driver_id': order.driver_id,
+        'at': timezone.now().isoformat(),
+    }
+    event.update(extra)
+    return event
+
+
+def publish_order_event(event_type, order, **extra):
+    """Publish an order change once the current transaction commits"""
+    event = order_event(event_type, order, **extra)
+
+    def send():
+        try:
+            bus().publish(event)
+        except Exception as e:
+            # Streams are best effort; the write itself has succeeded
+            logger.warning(f"Could not publish order event: {e}")
+
+    transaction.on_commit(send)
+
+
+def visible_to(event, viewer):
+    """viewer: {'role', 'customer_id', 'driver_id', 'tracking_code'} of a stream"""
+    if viewer.get('tracking_code'):
+        return event['tracking_code'] == viewer['tracking_code']
+    role = viewer.get('role')
+    if role == 'admin':
+        return True
+    if role == 'customer':
+        return event['customer_id'] == viewer.get('customer_id')
+    if role == 'driver':
+        return viewer.get('driver_id') is not None and event['driver_id'] == viewer['driver_id']
+    return False
@@ -0,0 +1,318 @@
+"""
+Offline gazetteer of places we have already delivered to.
+
+Built from the pickup/delivery addresses and coordinates of delivered
+orders (see the build_gazetteer management command) and stored in one
+memory-mapped file, so lookups need neither the network nor the database.
+
+File layout (little-endian):
+    header   MAGIC, version, record_count, key_count, watermark, watermark_id
+    records  record_count x (text_offset, text_len, hits, lat, lng)
+    keys     key_count x (key_offset, key_len, is_full, record_index), sorted by key
+    strings  UTF-8 display texts and keys
+
+Every record is indexed under its full normalized address and under the
+suffixes starting at each later word, so "sarit" finds "Sarit Centre,
+Westlands" and "westl" finds it too. The watermark is the (delivered_at in
+microseconds, id) of the last order read; incremental builds resume after it.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from .geocoding import normalize_address
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PKGZ'
+VERSION = 2
+HEADER = struct.Struct('<4sHHIIqQ')
+RECORD = struct.Struct('<IIIdd')
+KEY = struct.Struct('<IHHI')
+MAX_SUFFIX_WORDS = 6
+RELOAD_CHECK_INTERVAL = 30  # seconds between mtime checks
+FILE_MODE = 0o644
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class Place:
+    __slots__ = ('text', 'latitude', 'longitude', 'hits')
+
+    def __init__(self, text, latitude, longitude, hits):
+        self.text = text
+        self.latitude = latitude
+        self.longitude = longitude
+        self.hits = hits
+
+    def as_dict(self):
+        return {
+            'address': self.text,
+            'latitude': round(self.latitude, 6),
+            'longitude': round(self.longitude, 6),
+            'hits': self.hits,
+        }
+
+
+class GazetteerIndex:
+    """Read-only view over one index file"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(self.path, 'rb') as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < HEADER.size:
+            self._mm.close()
+            raise ValueError(f'{self.path} is not a gazetteer index')
+        (magic, version, _, self.record_count, self.key_count,
+         self.watermark, self.watermark_id) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f'{self.path} is not a gazetteer index')
+        self._records_at = HEADER.size
+        self._keys_at = self._records_at + self.record_count * RECORD.size
+        self._strings_at = self._keys_at + self.key_count * KEY.size
+
+    def close(self):
+        self._mm.close()
+
+    def _string(self, offset, length):
+        start = self._strings_at + offset
+        return self._mm[start:start + length]
+
+    def _key(self, i):
+        key_offset, key_len, is_full, record_index = KEY.unpack_from(self._mm, self._keys_at + i * KEY.size)
+        return self._string(key_offset, key_len), is_full, record_index
+
+    def record(self, i):
+        text_offset, text_len, hits, lat, lng = RECORD.unpack_from(self._mm, self._records_at + i * RECORD.size)
+        return Place(self._string(text_offset, text_len).decode('utf-8'), lat, lng, hits)
+
+    def records(self):
+        for i in range(self.record_count):
+            yield self.record(i)
+
+    def _lower_bound(self, key):
+        lo, hi = 0, self.key_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def exact(self, address):
+        key = normalize_address(address).encode('utf-8')
+        if not key:
+            return None
+        i = self._lower_bound(key)
+        while i < self.key_count:
+            candidate, is_full, record_index = self._key(i)
+            if candidate != key:
+                break
+            if is_full:
+                return self.record(record_index)
+            i += 1
+        return None
+
+    def search(self, prefix, limit=5):
+        """Places with a word sequence starting with `prefix`, most used first"""
+        key = normalize_address(prefix).encode('utf-8')
+        if not key:
+            return []
+        seen = set()
+        i = self._lower_bound(key)
+        while i < self.key_count:
+            candidate, _, record_index = self._key(i)
+            if not candidate.startswith(key):
+                break
+            seen.add(record_index)
+            i += 1
+        places = [self.record(index) for index in seen]
+        places.sort(key=lambda place: (-place.hits, place.text))
+        return places[:limit]
+
+
+def to_micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def write_index(path, places, watermark=(0, 0)):
+    """Write `places` (normalized address -> Place) atomically to `path`"""
+    strings = bytearray()
+    records = []
+    keys = []
+
+    def add_string(data):
+        offset = len(strings)
+        strings.extend(data)
+        return offset, len(data)
+
+    for index, (normalized, place) in enumerate(sorted(places.items())):
+        text_offset, text_len = add_string(place.text.encode('utf-8'))
+        records.append(RECORD.pack(text_offset, text_len, min(place.hits, 2 ** 32 - 1),
+                                   place.latitude, place.longitude))
+        words = normalized.split()
+        for start in range(min(len(words), MAX_SUFFIX_WORDS)):
+            key = ' '.join(words[start:]).encode('utf-8')
+            keys.append((key, start == 0, index))
+
+    keys.sort(key=lambda item: (item[0], not item[1]))
+    key_entries = []
+    for key, is_full, index in keys:
+        key_offset, key_len = add_string(key[:65535])
+        key_entries.append(KEY.pack(key_offset, key_len, int(is_full), index))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.gazetteer-')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(HEADER.pack(MAGIC, VERSION, 0, len(records), len(key_entries), *watermark))
+            fh.writelines(records)
+            fh.writelines(key_entries)
+            fh.write(strings)
+        # mkstemp creates the file 0600; web and worker processes may run as another user
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return len(records)
+
+
+def build(path=None, full=False):
+    """
+    Merge delivered orders into the index at `path`.
+    Incremental by default: only orders after the stored (delivered_at, id)
+    watermark are read and their coordinates folded into the running average
+    per address. An index in an older format is rebuilt in full.
+    Returns (places_in_index, orders_read).
+    """
+    from django.db.models import Q
+    from .models import Order
+
+    path = str(path or settings.GAZETTEER_PATH)
+    places = {}
+    watermark = (0, 0)
+    if not full and os.path.exists(path):
+        try:
+            existing = GazetteerIndex(path)
+        except ValueError as e:
+            logger.warning(f"Rebuilding gazetteer in full: {e}")
+        else:
+            try:
+                watermark = (existing.watermark, existing.watermark_id)
+                for place in existing.records():
+                    places[normalize_address(place.text)] = place
+            finally:
+                existing.close()
+
+    orders = Order.objects.filter(status='delivered', delivered_at__isnull=False)
+    if watermark != (0, 0):
+        # Orders delivered in the same microsecond as the last one read are told apart by id
+        delivered_at = from_micros(watermark[0])
+        orders = orders.filter(Q(delivered_at__gt=delivered_at) | Q(delivered_at=delivered_at, id__gt=watermark[1]))
+    orders = orders.order_by('delivered_at', 'id').values_list(
+        'pickup_address', 'pickup_latitude', 'pickup_longitude',
+        'delivery_address', 'delivery_latitude', 'delivery_longitude', 'delivered_at', 'id',
+    )
+
+    read = 0
+    for row in orders.iterator(chunk_size=2000):
+        read += 1
+        for address, lat, lng in (row[0:3], row[3:6]):
+            if lat is None or lng is None:
+                continue
+            normalized = normalize_address(address)
+            if not normalized:
+                continue
+            place = places.get(normalized)
+            if place is None:
+                places[normalized] = Place(address.strip(), float(lat), float(lng), 1)
+            else:
+                hits = place.hits + 1
+                place.latitude += (float(lat) - place.latitude) / hits
+                place.longitude += (float(lng) - place.longitude) / hits
+                place.hits = hits
+        watermark = (to_micros(row[6]), row[7])
+
+    write_index(path, places, watermark)
+    return len(places), read
+
+
+class Gazetteer:
+    """
+    Process-wide handle that reopens the index when the file is rebuilt.
+    A replaced index is closed once the last lookup still reading it is done.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._index = None
+        self._mtime = None
+        self._checked_at = 0
+        self._readers = Counter()
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            index = GazetteerIndex(self.path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not open gazetteer index: {e}")
+            return
+        previous, self._index, self._mtime = self._index, index, mtime
+        if previous is not None and not self._readers[previous]:
+            del self._readers[previous]
+            previous.close()
+
+    @contextmanager
+    def _reading(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._index is None or now - self._checked_at >= RELOAD_CHECK_INTERVAL:
+                self._checked_at = now
+                self._reload()
+            index = self._index
+            if index is not None:
+                self._readers[index] += 1
+        try:
+            yield index
+        finally:
+            if index is not None:
+                with self._lock:
+                    self._readers[index] -= 1
+                    if not self._readers[index] and index is not self._index:
+                        del self._readers[index]
+                        index.close()
+
+    def exact(self, address):
+        with self._reading() as index:
+            return index.exact(address) if index else None
+
+    def search(self, prefix, limit=5):
+        with self._reading() as index:
+            return index.search(prefix, limit) if index else []
+
+
+gazetteer = Gazetteer(settings.GAZETTEER_PATH)
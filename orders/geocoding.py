@@ -0,0 +1,224 @@
+"""
+Geocoding behind a two-tier cache.
+
+Lookups go: offline gazetteer -> in-process LRU -> GeocodeCacheEntry table
+-> Google Geocoding API.
+Entries are keyed by a normalized address so "Westlands, Nairobi" and
+"  westlands nairobi, Kenya" share one row, and expire after GEOCODE_CACHE_TTL.
+"""
+from collections import OrderedDict
+from datetime import timedelta
+import hashlib
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
+
+from pakahome import outbound
+from .models import GeocodeCacheEntry
+
+logger = logging.getLogger(__name__)
+
+GEOCODE_PATH = "/maps/api/geocode/json"
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+_COUNTRY_SUFFIXES = (' kenya', ' ke')
+
+
+def normalize_address(address):
+    """Canonical form of an address used as the cache key"""
+    text = unicodedata.normalize('NFKC', address or '').lower()
+    text = _PUNCTUATION_RE.sub(' ', text)
+    text = _WHITESPACE_RE.sub(' ', text).strip()
+    for suffix in _COUNTRY_SUFFIXES:
+        if text.endswith(suffix):
+            text = text[:-len(suffix)].strip()
+    return text
+
+
+def address_key(normalized_address):
+    return hashlib.sha256(normalized_address.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """Small thread-safe LRU with a per-entry expiry time"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class GeocodeCache:
+    """LRU in front of the GeocodeCacheEntry table, with hit/miss counters"""
+
+    def __init__(self, maxsize, ttl):
+        self.ttl = ttl
+        self.lru = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.counters = {'gazetteer_hits': 0, 'lru_hits': 0, 'db_hits': 0, 'misses': 0}
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, address):
+        """Return the cached Google payload for an address, or None"""
+        normalized = normalize_address(address)
+        if not normalized:
+            return None
+        key = address_key(normalized)
+
+        payload = self.lru.get(key)
+        if payload is not None:
+            self.count('lru_hits')
+            return payload
+
+        entry = GeocodeCacheEntry.objects.filter(
+            address_key=key, expires_at__gt=timezone.now()
+        ).only('payload', 'expires_at').first()
+        if entry is not None:
+            self.count('db_hits')
+            remaining = (entry.expires_at - timezone.now()).total_seconds()
+            self.lru.set(key, entry.payload, min(self.ttl, remaining))
+            return entry.payload
+
+        self.count('misses')
+        return None
+
+    def set(self, address, payload):
+        normalized = normalize_address(address)
+        if not normalized:
+            return
+        key = address_key(normalized)
+        expires_at = timezone.now() + timedelta(seconds=self.ttl)
+        try:
+            GeocodeCacheEntry.objects.update_or_create(
+                address_key=key,
+                defaults={
+                    'normalized_address': normalized,
+                    'payload': payload,
+                    'expires_at': expires_at,
+                }
+            )
+        except IntegrityError:
+            # Another worker stored the same address first
+            pass
+        self.lru.set(key, payload, self.ttl)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = sum(counters.values())
+        hits = counters['gazetteer_hits'] + counters['lru_hits'] + counters['db_hits']
+        counters.update({
+            'lookups': lookups,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            'lru_size': len(self.lru),
+            'lru_maxsize': self.lru.maxsize,
+            'db_entries': GeocodeCacheEntry.objects.filter(expires_at__gt=timezone.now()).count(),
+        })
+        return counters
+
+
+geocode_cache = GeocodeCache(
+    maxsize=settings.GEOCODE_CACHE_LRU_SIZE,
+    ttl=settings.GEOCODE_CACHE_TTL,
+)
+
+
+def fetch_geocode(address, interactive=False):
+    """
+    Call the Google Geocoding API. Returns the decoded JSON payload.
+    interactive: a request is waiting; use the short-timeout upstream without retries.
+    """
+    params = {
+        'address': address,
+        'key': settings.GOOGLE_MAPS_API_KEY,
+        'region': 'ke',  # Bias results to Kenya
+    }
+    upstream = 'google_maps_interactive' if interactive else 'google_maps'
+    response = outbound.client(upstream).get(GEOCODE_PATH, params=params)
+    return response.json()
+
+
+def geocode(address, interactive=False):
+    """
+    Geocode an address through the cache.
+    Returns the Google Geocoding payload ({'status': ..., 'results': [...]});
+    only successful lookups are cached.
+    """
+    from .gazetteer import gazetteer
+
+    place = gazetteer.exact(address)
+    if place is not None:
+        geocode_cache.count('gazetteer_hits')
+        return gazetteer_payload(place)
+
+    payload = geocode_cache.get(address)
+    if payload is not None:
+        return payload
+
+    if not settings.GOOGLE_MAPS_API_KEY:
+        return {'status': 'REQUEST_DENIED', 'results': []}
+
+    payload = fetch_geocode(address, interactive)
+    if payload.get('status') == 'OK' and payload.get('results'):
+        # Keep just what callers read; drops photos/plus codes etc. from the row
+        payload = {'status': 'OK', 'results': payload['results'][:1]}
+        geocode_cache.set(address, payload)
+    return payload
+
+
+def gazetteer_payload(place):
+    """Geocoding-API-shaped payload for a gazetteer place"""
+    return {
+        'status': 'OK',
+        'source': 'gazetteer',
+        'results': [{
+            'formatted_address': place.text,
+            'geometry': {'location': {'lat': round(place.latitude, 6), 'lng': round(place.longitude, 6)}},
+        }],
+    }
+
+
+def purge_expired():
+    """Delete expired cache rows. Returns the number removed."""
+    deleted, _ = GeocodeCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
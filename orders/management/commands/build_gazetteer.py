@@ -0,0 +1,32 @@
+"""
+Build or update the offline gazetteer from delivered orders.
+Usage: python manage.py build_gazetteer [--full] [--path=/path/to/gazetteer.idx]
+Run it periodically (e.g. nightly cron); without --full only orders delivered
+since the last run are read.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from orders.gazetteer import build
+
+
+class Command(BaseCommand):
+    help = 'Build or incrementally update the offline place index from delivered orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Rebuild from all delivered orders instead of merging new ones',
+        )
+        parser.add_argument(
+            '--path',
+            type=str,
+            default=str(settings.GAZETTEER_PATH),
+            help='Index file to write',
+        )
+
+    def handle(self, *args, **options):
+        places, read = build(options['path'], full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Gazetteer written to {options['path']}: {places} places ({read} new orders read)"
+        ))
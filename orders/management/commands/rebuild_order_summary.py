@@ -0,0 +1,33 @@
+"""
+Recompute the admin dashboard summary (OrderDailySummary) from the orders table.
+Usage: python manage.py rebuild_order_summary [--since=YYYY-MM-DD]
+Run it once to backfill, and after bulk SQL changes to orders; without
+--since every day is rebuilt. Best run while few orders are being written.
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from orders.summary import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily order summary behind the admin dashboard stats.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            type=str,
+            default=None,
+            help='Only rebuild days from this date (YYYY-MM-DD) on',
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"--since must be a date as YYYY-MM-DD, not {options['since']!r}")
+        buckets = rebuild(since)
+        scope = f'from {since}' if since else 'for every day'
+        self.stdout.write(self.style.SUCCESS(f'Order summary rebuilt {scope}: {buckets} buckets'))
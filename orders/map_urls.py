@@ -3,9 +3,14 @@ from . import map_views
 
 urlpatterns = [
     path('autocomplete/', map_views.autocomplete, name='map_autocomplete'),
+    path('place-details/', map_views.place_details, name='map_place_details'),
     path('geocode/', map_views.geocode, name='map_geocode'),
+    path('geocode/stats/', map_views.geocode_cache_stats, name='map_geocode_stats'),
     path('directions/', map_views.directions, name='map_directions'),
+    path('directions/stats/', map_views.directions_cache_stats, name='map_directions_stats'),
+    path('distance-matrix/', map_views.distance_matrix, name='map_distance_matrix'),
     path('validate-address/', map_views.validate_address, name='validate_address'),
     path('route-optimization/', map_views.route_optimization, name='route_optimization'),
+    path('driver-route/', map_views.driver_route, name='driver_route'),
 ]
 
@@ -2,13 +2,20 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status, permissions
 from django.conf import settings
-import requests
+from .autocomplete import autocomplete as cached_autocomplete, place_details as fetch_place_details
+from .gazetteer import gazetteer
+from .geocoding import geocode as geocode_cached, geocode_cache
+from pakahome import outbound
+from users.models import Driver
+from .models import Order
+from .directions import cached_directions, directions_cache, distance_matrix as cached_distance_matrix, locate
+from .routing import haversine_matrix, optimize_stops
 
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def autocomplete(request):
-    """Google Maps Places Autocomplete"""
+    """Google Maps Places Autocomplete (prefix-cached; pass back the returned sessiontoken)"""
     api_key = settings.GOOGLE_MAPS_API_KEY
     query = request.GET.get('query', '')
     
@@ -24,16 +31,37 @@ def autocomplete(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    url = "https://maps.googleapis.com/maps/api/place/autocomplete/json"
-    params = {
-        'input': query,
-        'key': api_key,
-        'components': 'country:ke',  # Restrict to Kenya
-    }
+    try:
+        data = cached_autocomplete(query, request.GET.get('sessiontoken'))
+        return Response(data)
+    except Exception as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def place_details(request):
+    """Location of a picked autocomplete prediction (send its place_id and the sessiontoken)"""
+    api_key = settings.GOOGLE_MAPS_API_KEY
+    place_id = request.GET.get('place_id', '')
+    
+    if not api_key:
+        return Response(
+            {'error': 'Google Maps API key not configured'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    if not place_id:
+        return Response(
+            {'error': 'place_id parameter is required'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
     try:
-        response = requests.get(url, params=params, timeout=5)
-        data = response.json()
+        data = fetch_place_details(place_id, request.GET.get('sessiontoken'))
         return Response(data)
     except Exception as e:
         return Response(
@@ -45,7 +73,7 @@ def autocomplete(request):
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def geocode(request):
-    """Geocode an address"""
+    """Geocode an address (served from the geocode cache when possible)"""
     api_key = settings.GOOGLE_MAPS_API_KEY
     address = request.GET.get('address', '')
     
@@ -61,16 +89,8 @@ def geocode(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
-    params = {
-        'address': address,
-        'key': api_key,
-        'region': 'ke',  # Bias results to Kenya
-    }
-    
     try:
-        response = requests.get(url, params=params, timeout=5)
-        data = response.json()
+        data = geocode_cached(address, interactive=True)
         return Response(data)
     except Exception as e:
         return Response(
@@ -79,10 +99,25 @@ def geocode(request):
         )
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def geocode_cache_stats(request):
+    """Geocode cache hit/miss counters for this process (admin only)"""
+    if request.user.role != 'admin':
+        return Response(
+            {'error': 'Only admins can view cache statistics'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    return Response(geocode_cache.stats())
+
+
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def directions(request):
-    """Get directions between two points with route optimization"""
+    """
+    Get directions between two points with route optimization. Plain
+    origin-to-destination requests are served from the directions cache.
+    """
     api_key = settings.GOOGLE_MAPS_API_KEY
     origin = request.GET.get('origin', '')
     destination = request.GET.get('destination', '')
@@ -101,7 +136,17 @@ def directions(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    url = "https://maps.googleapis.com/maps/api/directions/json"
+    if not waypoints:
+        origin_point, destination_point = locate(origin), locate(destination)
+        if origin_point is not None and destination_point is not None:
+            try:
+                return Response(cached_directions(origin_point, destination_point))
+            except Exception as e:
+                return Response(
+                    {'error': str(e)}, 
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+    
     params = {
         'origin': origin,
         'destination': destination,
@@ -118,7 +163,7 @@ def directions(request):
             params['waypoints'] = waypoints
     
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = outbound.client('google_maps').get('/maps/api/directions/json', params=params)
         data = response.json()
         
         if data.get('status') == 'OK' and data.get('routes'):
@@ -140,10 +185,68 @@ def directions(request):
         )
 
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def distance_matrix(request):
+    """
+    Road distance (m) and duration (s) for every origin x destination pair
+    ({"origins": [...], "destinations": [...]}, "lat,lng" or addresses).
+    Cached pairs are reused; missing ones are fetched in batched upstream calls.
+    """
+    origins = request.data.get('origins') or []
+    destinations = request.data.get('destinations') or []
+    
+    if not isinstance(origins, list) or not isinstance(destinations, list) or not origins or not destinations:
+        return Response(
+            {'error': 'origins and destinations must be non-empty lists'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if len(origins) * len(destinations) > settings.DISTANCE_MATRIX_MAX_ELEMENTS:
+        return Response(
+            {'error': f'At most {settings.DISTANCE_MATRIX_MAX_ELEMENTS} origin x destination pairs per request'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    origins = [str(text).strip() for text in origins]
+    destinations = [str(text).strip() for text in destinations]
+    points = {}
+    for text in origins + destinations:
+        point = points[text] if text in points else locate(text)
+        if point is None:
+            return Response(
+                {'error': f'Could not locate {text}'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        points[text] = point
+    
+    try:
+        result = cached_distance_matrix([points[text] for text in origins], [points[text] for text in destinations])
+    except Exception as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_502_BAD_GATEWAY
+        )
+    result.update({'origins': origins, 'destinations': destinations})
+    return Response(result)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def directions_cache_stats(request):
+    """Directions / distance-matrix cache counters for this process (admin only)"""
+    if request.user.role != 'admin':
+        return Response(
+            {'error': 'Only admins can view cache statistics'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    return Response(directions_cache.stats())
+
+
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
 def validate_address(request):
-    """Validate and geocode an address"""
+    """Validate and geocode an address (known delivery addresses are answered offline)"""
     api_key = settings.GOOGLE_MAPS_API_KEY
     address = request.data.get('address', '')
     
@@ -159,8 +262,19 @@ def validate_address(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    place = gazetteer.exact(address)
+    if place is not None:
+        return Response({
+            'valid': True,
+            'formatted_address': place.text,
+            'latitude': round(place.latitude, 6),
+            'longitude': round(place.longitude, 6),
+            'place_id': None,
+            'address_components': [],
+            'source': 'gazetteer',
+        })
+    
     # Use Places API for better address validation
-    url = "https://maps.googleapis.com/maps/api/place/findplacefromtext/json"
     params = {
         'input': address,
         'inputtype': 'textquery',
@@ -170,7 +284,7 @@ def validate_address(request):
     }
     
     try:
-        response = requests.get(url, params=params, timeout=5)
+        response = outbound.client('google_maps').get('/maps/api/place/findplacefromtext/json', params=params)
         data = response.json()
         
         if data.get('status') == 'OK' and data.get('candidates'):
@@ -196,20 +310,41 @@ def validate_address(request):
         )
 
 
+def _google_route(points):
+    """Turn-by-turn Google route through points in the given order (no re-ordering)"""
+    params = {
+        'origin': '{},{}'.format(*points[0]),
+        'destination': '{},{}'.format(*points[-1]),
+        'key': settings.GOOGLE_MAPS_API_KEY,
+        'region': 'ke',
+    }
+    if len(points) > 2:
+        params['waypoints'] = '|'.join('{},{}'.format(*point) for point in points[1:-1])
+    response = outbound.client('google_maps').get('/maps/api/directions/json', params=params)
+    data = response.json()
+    if data.get('status') == 'OK' and data.get('routes'):
+        return data['routes'][0]
+    return None
+
+
+def _route_summary(route, matrix_km):
+    distance = sum(matrix_km[a][b] for a, b in zip(route, route[1:]))
+    return {
+        'distance': round(distance, 2),  # km
+        'duration': round(distance / settings.ROUTE_AVERAGE_SPEED_KMH * 60, 1),  # minutes, estimated
+    }
+
+
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def route_optimization(request):
-    """Optimize route with multiple waypoints"""
-    api_key = settings.GOOGLE_MAPS_API_KEY
+    """
+    Optimize the order of "|"-separated waypoints ("lat,lng" or addresses) between
+    origin and destination locally; ?polyline=true adds Google's turn-by-turn route
+    """
     origin = request.GET.get('origin', '')
     destination = request.GET.get('destination', '')
-    waypoints = request.GET.get('waypoints', '')  # Comma-separated waypoints
-    
-    if not api_key:
-        return Response(
-            {'error': 'Google Maps API key not configured'}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+    waypoints = [waypoint for waypoint in request.GET.get('waypoints', '').split('|') if waypoint.strip()]
     
     if not origin or not destination or not waypoints:
         return Response(
@@ -217,37 +352,115 @@ def route_optimization(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    url = "https://maps.googleapis.com/maps/api/directions/json"
-    params = {
-        'origin': origin,
-        'destination': destination,
-        'waypoints': f'optimize:true|{waypoints}',
-        'key': api_key,
-        'region': 'ke',
-    }
-    
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
-        
-        if data.get('status') == 'OK' and data.get('routes'):
-            route = data['routes'][0]
-            # Extract optimized waypoint order
-            waypoint_order = route.get('waypoint_order', [])
-            optimized_route = {
-                'waypoint_order': waypoint_order,
-                'distance': sum(leg['distance']['value'] for leg in route['legs']) / 1000,  # km
-                'duration': sum(leg['duration']['value'] for leg in route['legs']) / 60,  # minutes
-                'route': route
-            }
-            return Response(optimized_route)
-        else:
+    points = []
+    for text in [origin, *waypoints, destination]:
+        point = locate(text.strip())
+        if point is None:
             return Response(
-                {'error': data.get('error_message', 'Route optimization failed')}, 
+                {'error': f'Could not locate {text}'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
-    except Exception as e:
+        points.append(point)
+    
+    matrix = haversine_matrix(points)
+    route, _ = optimize_stops(points, end=len(points) - 1, matrix=matrix,
+                              time_limit=settings.ROUTE_OPTIMIZE_TIME_LIMIT)
+    result = {
+        'waypoint_order': [stop - 1 for stop in route[1:-1]],
+        **_route_summary(route, matrix),
+        'source': 'local',
+        'route': None,
+    }
+    
+    if request.GET.get('polyline', 'false').lower() == 'true':
+        if len(points) > settings.GOOGLE_DIRECTIONS_MAX_WAYPOINTS + 2:
+            result['route_error'] = 'Too many waypoints for a Google route'
+        elif settings.GOOGLE_MAPS_API_KEY:
+            try:
+                result['route'] = _google_route([points[stop] for stop in route])
+            except Exception as e:
+                result['route_error'] = str(e)
+    return Response(result)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def driver_route(request):
+    """
+    Best visiting order for the current driver's open orders, from their last
+    known position: pickups of not-yet-collected orders come before their
+    deliveries. ?polyline=true adds Google's turn-by-turn route.
+    """
+    if request.user.role != 'driver':
         return Response(
-            {'error': str(e)}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            {'error': 'Only drivers can plan their route'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    try:
+        driver = request.user.driver_profile
+    except Driver.DoesNotExist:
+        return Response(
+            {'error': 'Driver profile not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    if driver.current_latitude is None or driver.current_longitude is None:
+        return Response(
+            {'error': 'Driver location unknown; report a location first'}, 
+            status=status.HTTP_400_BAD_REQUEST
         )
+    
+    points = [(float(driver.current_latitude), float(driver.current_longitude))]
+    stops = [{'type': 'start'}]
+    precedence = []
+    orders = Order.objects.filter(
+        driver=driver, status__in=Order.OPEN_STATUSES
+    ).order_by('created_at')
+    skipped = []
+    for order in orders:
+        if order.delivery_latitude is None or order.delivery_longitude is None:
+            skipped.append(order.tracking_code)
+            continue
+        if order.status in ('assigned', 'accepted'):
+            if order.pickup_latitude is None or order.pickup_longitude is None:
+                skipped.append(order.tracking_code)
+                continue
+            points.append((float(order.pickup_latitude), float(order.pickup_longitude)))
+            stops.append({'type': 'pickup', 'order_id': order.id, 'tracking_code': order.tracking_code,
+                          'address': order.pickup_address})
+            precedence.append((len(points) - 1, len(points)))
+        points.append((float(order.delivery_latitude), float(order.delivery_longitude)))
+        stops.append({'type': 'delivery', 'order_id': order.id, 'tracking_code': order.tracking_code,
+                      'address': order.delivery_address})
+    
+    matrix = haversine_matrix(points)
+    route, _ = optimize_stops(points, precedence, matrix=matrix, time_limit=settings.ROUTE_OPTIMIZE_TIME_LIMIT)
+    speed = settings.ROUTE_AVERAGE_SPEED_KMH
+    ordered, travelled = [], 0.0
+    for previous, stop in zip(route, route[1:]):
+        travelled += matrix[previous][stop]
+        ordered.append({
+            **stops[stop],
+            'latitude': points[stop][0],
+            'longitude': points[stop][1],
+            'distance_from_start': round(travelled, 2),  # km
+            'eta_minutes': round(travelled / speed * 60, 1),
+        })
+    result = {
+        'stops': ordered,
+        **_route_summary(route, matrix),
+        'skipped_orders': skipped,  # no coordinates to route with
+        'source': 'local',
+        'route': None,
+    }
+    
+    if request.GET.get('polyline', 'false').lower() == 'true' and len(route) > 1:
+        if len(route) > settings.GOOGLE_DIRECTIONS_MAX_WAYPOINTS + 2:
+            result['route_error'] = 'Too many stops for a Google route'
+        elif settings.GOOGLE_MAPS_API_KEY:
+            try:
+                result['route'] = _google_route([points[stop] for stop in route])
+            except Exception as e:
+                result['route_error'] = str(e)
+    return Response(result)
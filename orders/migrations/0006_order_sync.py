@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_geocodecacheentry'),
+        ('users', '0004_alter_driver_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.BigIntegerField()),
+                ('tracking_code', models.CharField(max_length=20)),
+                ('customer_id', models.BigIntegerField(null=True)),
+                ('driver_id', models.BigIntegerField(null=True)),
+                ('reason', models.CharField(choices=[('deleted', 'Deleted'), ('unassigned', 'Unassigned from driver')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at', 'id'], name='order_updated_at_id_idx'),
+        ),
+    ]
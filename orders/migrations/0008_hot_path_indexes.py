@@ -0,0 +1,42 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_created_at_cursor_indexes'),
+        ('users', '0006_created_at_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_status_created_idx',
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='users.customer'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='driver',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='users.driver'),
+        ),
+        migrations.AlterField(
+            model_name='ordertracking',
+            name='order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='tracking_logs', to='orders.order'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'pending_assignment')), fields=['created_at'], name='order_pending_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ordertracking',
+            index=models.Index(fields=['order', 'created_at'], name='tracking_order_created_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderDailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('pending_payment', 'Pending Payment'), ('pending_assignment', 'Pending Assignment'), ('assigned', 'Assigned'), ('accepted', 'Accepted by Driver'), ('picked_up', 'Picked Up'), ('in_transit', 'In Transit'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('driver_id', models.BigIntegerField(null=True)),
+                ('orders', models.IntegerField(default=0)),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('paid_orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='orderdailysummary',
+            constraint=models.UniqueConstraint(fields=('day', 'status', 'driver_id'), name='order_summary_bucket_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderdailysummary',
+            constraint=models.UniqueConstraint(condition=models.Q(('driver_id__isnull', True)), fields=('day', 'status'), name='order_summary_unassigned_unique'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from users.models import Customer, Driver
 import uuid
@@ -16,10 +16,14 @@ class Order(models.Model):
         ('delivered', 'Delivered'),
         ('cancelled', 'Cancelled'),
     ]
+    # With a driver and not finished
+    OPEN_STATUSES = ('assigned', 'accepted', 'picked_up', 'in_transit')
     
     tracking_code = models.CharField(max_length=20, unique=True, editable=False)
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders')
-    driver = models.ForeignKey(Driver, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
+    # Indexed by the (customer|driver, created_at, id) composites in Meta
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders', db_index=False)
+    driver = models.ForeignKey(Driver, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders',
+                               db_index=False)
     
     # Pickup details
     pickup_name = models.CharField(max_length=255)
@@ -54,10 +58,28 @@ class Order(models.Model):
     # Driver feedback
     driver_feedback = models.TextField(blank=True, null=True, help_text='Feedback from driver after delivery')
     
+    class Meta:
+        indexes = [
+            # Keyset scans for ?updated_since= sync
+            models.Index(fields=['updated_at', 'id'], name='order_updated_at_id_idx'),
+            # Cursor pages (newest first on created_at, id) of each role's list
+            models.Index(fields=['created_at', 'id'], name='order_created_at_id_idx'),
+            models.Index(fields=['customer', 'created_at', 'id'], name='order_customer_created_idx'),
+            models.Index(fields=['driver', 'created_at', 'id'], name='order_driver_created_idx'),
+            # The dispatch queue, oldest first, over just the pending rows. Finished
+            # orders are most of the table and no hot query filters on their status,
+            # so status has no full index; a driver's open orders come off the driver
+            # index above (SQLite cannot match a partial index to a bound IN list).
+            models.Index(fields=['created_at'], name='order_pending_created_idx',
+                         condition=models.Q(status='pending_assignment')),
+        ]
+    
     def save(self, *args, **kwargs):
         if not self.tracking_code:
             self.tracking_code = self.generate_tracking_code()
-        super().save(*args, **kwargs)
+        # One transaction with the pre_save handlers, which lock the row (orders.summary)
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
     
     def generate_tracking_code(self):
         """Generate unique tracking code"""
@@ -69,7 +91,7 @@ class Order(models.Model):
 
 class OrderTracking(models.Model):
     """Track order status changes and location updates"""
-    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='tracking_logs')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='tracking_logs', db_index=False)
     status = models.CharField(max_length=20)
     location_latitude = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
     location_longitude = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
@@ -78,7 +100,65 @@ class OrderTracking(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Logs are always read per order, newest first; also serves the order FK
+            models.Index(fields=['order', 'created_at'], name='tracking_order_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.order.tracking_code} - {self.status} at {self.created_at}"
 
+
+class OrderTombstone(models.Model):
+    """Marks an order that left someone's list, so incremental sync clients can drop it"""
+    REASON_CHOICES = [
+        ('deleted', 'Deleted'),
+        ('unassigned', 'Unassigned from driver'),
+    ]
+    
+    order_id = models.BigIntegerField()
+    tracking_code = models.CharField(max_length=20)
+    customer_id = models.BigIntegerField(null=True)
+    driver_id = models.BigIntegerField(null=True)  # for 'unassigned': the driver who lost the order
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    def __str__(self):
+        return f"{self.tracking_code} {self.reason} at {self.created_at}"
+
+
+class OrderDailySummary(models.Model):
+    """
+    Orders created on `day` (local date) that are now in `status` with driver
+    `driver_id` (None: unassigned). Kept up to date by orders.summary.
+    """
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    driver_id = models.BigIntegerField(null=True)  # no FK: rows outlive deleted drivers, like OrderTombstone
+    orders = models.IntegerField(default=0)
+    value = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # sum of order prices
+    paid_orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # prices of orders with a completed payment
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status', 'driver_id'], name='order_summary_bucket_unique'),
+            # NULLs never conflict, so unassigned buckets need their own constraint
+            models.UniqueConstraint(fields=['day', 'status'], condition=models.Q(driver_id__isnull=True),
+                                    name='order_summary_unassigned_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} {self.status} driver={self.driver_id}: {self.orders}"
+
+
+class GeocodeCacheEntry(models.Model):
+    """Cached Google Geocoding response, keyed by a normalized address"""
+    address_key = models.CharField(max_length=64, unique=True)  # sha256 of normalized address
+    normalized_address = models.TextField()
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"{self.normalized_address} (expires {self.expires_at})"
@@ -0,0 +1,191 @@
+"""
+Zone and distance-band pricing.
+
+Zones from settings.PRICING_ZONES are compiled once per process into a grid
+of PRICING_GRID_DEG cells over each polygon's bounding box. Cells that no
+polygon edge passes through are known to be wholly inside or outside, so
+most lookups are a dict hit; only points in edge cells run the ray-casting
+test. Nothing here touches the network or the database, so a bulk quote of
+hundreds of trips is pure CPU.
+"""
+from decimal import Decimal
+import math
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from drivers.spatial import haversine_km
+
+INSIDE, OUTSIDE, EDGE = 1, 0, 2
+
+
+def point_in_polygon(lat, lng, polygon):
+    """Ray casting over [(lat, lng), ...]"""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lng_i = polygon[i]
+        lat_j, lng_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat):
+            crossing = lng_i + (lat - lat_i) * (lng_j - lng_i) / (lat_j - lat_i)
+            if lng < crossing:
+                inside = not inside
+        j = i
+    return inside
+
+
+class Zone:
+    """A priced polygon with its precomputed cell grid"""
+
+    def __init__(self, name, price, polygon, cell_deg, within_nairobi=False):
+        self.name = name
+        self.price = Decimal(str(price))
+        self.within_nairobi = within_nairobi
+        self.polygon = [(float(lat), float(lng)) for lat, lng in polygon]
+        self.cell_deg = cell_deg
+        lats = [lat for lat, _ in self.polygon]
+        lngs = [lng for _, lng in self.polygon]
+        self.bounds = (min(lats), min(lngs), max(lats), max(lngs))
+        self.cells = self._build_cells()
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def _build_cells(self):
+        min_lat, min_lng, max_lat, max_lng = self.bounds
+        row0, col0 = self._cell(min_lat, min_lng)
+        row1, col1 = self._cell(max_lat, max_lng)
+        edge_cells = set()
+        for (lat_a, lng_a), (lat_b, lng_b) in zip(self.polygon, self.polygon[1:] + self.polygon[:1]):
+            # Every cell the edge's bounding box overlaps: conservative, never misses a crossing
+            r0, c0 = self._cell(min(lat_a, lat_b), min(lng_a, lng_b))
+            r1, c1 = self._cell(max(lat_a, lat_b), max(lng_a, lng_b))
+            edge_cells.update((row, col) for row in range(r0, r1 + 1) for col in range(c0, c1 + 1))
+        cells = {}
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                if (row, col) in edge_cells:
+                    cells[(row, col)] = EDGE
+                else:
+                    center = ((row + 0.5) * self.cell_deg, (col + 0.5) * self.cell_deg)
+                    cells[(row, col)] = INSIDE if point_in_polygon(*center, self.polygon) else OUTSIDE
+        return cells
+
+    def contains(self, lat, lng):
+        min_lat, min_lng, max_lat, max_lng = self.bounds
+        if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+            return False
+        state = self.cells.get(self._cell(lat, lng), EDGE)
+        if state == EDGE:
+            return point_in_polygon(lat, lng, self.polygon) or self._on_boundary(lat, lng)
+        return state == INSIDE
+
+    def _on_boundary(self, lat, lng):
+        # Points exactly on an edge count as inside, as the old bounding box check did
+        for (lat_a, lng_a), (lat_b, lng_b) in zip(self.polygon, self.polygon[1:] + self.polygon[:1]):
+            cross = (lat - lat_a) * (lng_b - lng_a) - (lng - lng_a) * (lat_b - lat_a)
+            if (abs(cross) < 1e-12 and min(lat_a, lat_b) <= lat <= max(lat_a, lat_b)
+                    and min(lng_a, lng_b) <= lng <= max(lng_a, lng_b)):
+                return True
+        return False
+
+
+class Quote:
+    __slots__ = ('price', 'pickup_zone', 'delivery_zone', 'distance_km', 'is_within_nairobi')
+
+    def __init__(self, price, pickup_zone, delivery_zone, distance_km, is_within_nairobi):
+        self.price = price
+        self.pickup_zone = pickup_zone
+        self.delivery_zone = delivery_zone
+        self.distance_km = distance_km
+        self.is_within_nairobi = is_within_nairobi  # both ends in zones marked within_nairobi
+
+    def as_dict(self):
+        return {
+            'price': str(self.price),
+            'is_within_nairobi': self.is_within_nairobi,
+            'pickup_zone': self.pickup_zone,
+            'delivery_zone': self.delivery_zone,
+            'distance_km': round(self.distance_km, 2),
+        }
+
+
+class PricingEngine:
+    """Compiled zones and distance bands from settings"""
+
+    def __init__(self, zones, bands, default_price, cell_deg):
+        self.zones = [Zone(zone['name'], zone['price'], zone['polygon'], cell_deg, zone.get('within_nairobi', False))
+                      for zone in zones]
+        self.bands = sorted((float(max_km), Decimal(str(price))) for max_km, price in bands)
+        self.default_price = Decimal(str(default_price))
+
+    @classmethod
+    def from_settings(cls):
+        return cls(settings.PRICING_ZONES, settings.PRICING_DISTANCE_BANDS,
+                   settings.PRICING_OUTSIDE_NAIROBI, settings.PRICING_GRID_DEG)
+
+    def zone_for(self, lat, lng):
+        for zone in self.zones:
+            if zone.contains(lat, lng):
+                return zone
+        return None
+
+    def quote(self, pickup_lat, pickup_lng, delivery_lat, delivery_lng):
+        pickup_lat, pickup_lng = float(pickup_lat), float(pickup_lng)
+        delivery_lat, delivery_lng = float(delivery_lat), float(delivery_lng)
+        pickup_zone = self.zone_for(pickup_lat, pickup_lng)
+        delivery_zone = self.zone_for(delivery_lat, delivery_lng)
+        distance = haversine_km(pickup_lat, pickup_lng, delivery_lat, delivery_lng)
+        return self._price(pickup_zone, delivery_zone, distance)
+
+    def _price(self, pickup_zone, delivery_zone, distance):
+        if pickup_zone is not None and pickup_zone is delivery_zone:
+            price = pickup_zone.price
+        else:
+            price = next((band_price for max_km, band_price in self.bands if distance <= max_km), self.default_price)
+        return Quote(
+            price,
+            pickup_zone.name if pickup_zone else None,
+            delivery_zone.name if delivery_zone else None,
+            distance,
+            bool(pickup_zone and delivery_zone and pickup_zone.within_nairobi and delivery_zone.within_nairobi),
+        )
+
+    def quote_many(self, trips):
+        """Quotes for [(pickup_lat, pickup_lng, delivery_lat, delivery_lng), ...]; repeated points are located once"""
+        zones = {}
+
+        def zone_at(lat, lng):
+            point = (lat, lng)
+            if point not in zones:
+                zones[point] = self.zone_for(lat, lng)
+            return zones[point]
+
+        quotes = []
+        for pickup_lat, pickup_lng, delivery_lat, delivery_lng in trips:
+            pickup_lat, pickup_lng = float(pickup_lat), float(pickup_lng)
+            delivery_lat, delivery_lng = float(delivery_lat), float(delivery_lng)
+            pickup_zone = zone_at(pickup_lat, pickup_lng)
+            delivery_zone = zone_at(delivery_lat, delivery_lng)
+            distance = haversine_km(pickup_lat, pickup_lng, delivery_lat, delivery_lng)
+            quotes.append(self._price(pickup_zone, delivery_zone, distance))
+        return quotes
+
+
+_engine = None
+
+
+def pricing_engine():
+    """The process-wide engine, compiled on first use"""
+    global _engine
+    if _engine is None:
+        _engine = PricingEngine.from_settings()
+    return _engine
+
+
+@receiver(setting_changed)
+def _reset_on_settings_change(setting, **kwargs):
+    global _engine
+    if setting.startswith('PRICING_'):
+        _engine = None
@@ -0,0 +1,164 @@
+"""
+Local multi-stop route optimisation.
+
+Orders a run of stops with nearest-neighbour construction followed by 2-opt
+and or-opt improvement over a distance matrix (haversine km by default).
+Precedence pairs keep each pickup ahead of its delivery. The route starts
+at stop 0 and either ends anywhere (open run) or at a fixed last stop.
+
+Moves are costed in O(1) and only checked against precedence when they
+would improve the route, so 100+ stops solve in well under a second. 2-opt
+reverses segments, so the matrix is expected to be symmetric.
+"""
+import time
+
+from drivers.spatial import haversine_km
+
+IMPROVEMENT_EPSILON = 1e-9
+OR_OPT_SEGMENTS = (1, 2, 3)
+
+
+def haversine_matrix(points):
+    """Symmetric km matrix for [(lat, lng), ...]"""
+    size = len(points)
+    matrix = [[0.0] * size for _ in range(size)]
+    for i in range(size):
+        lat1, lng1 = points[i]
+        for j in range(i + 1, size):
+            matrix[i][j] = matrix[j][i] = haversine_km(lat1, lng1, *points[j])
+    return matrix
+
+
+def route_cost(route, matrix):
+    return sum(matrix[a][b] for a, b in zip(route, route[1:]))
+
+
+class RouteProblem:
+    """
+    matrix: square cost matrix over stops 0..n-1; route starts at stop 0.
+    precedence: [(before, after)] stop pairs, e.g. (pickup, delivery).
+    end: stop that must come last, or None for an open route.
+    """
+
+    def __init__(self, matrix, precedence=(), end=None):
+        self.matrix = matrix
+        self.size = len(matrix)
+        self.end = end
+        self.must_follow = {}  # stop -> stops that must come before it
+        self.must_precede = {}  # stop -> stops that must come after it
+        for before, after in precedence:
+            self.must_follow.setdefault(after, set()).add(before)
+            self.must_precede.setdefault(before, set()).add(after)
+
+    def nearest_neighbour(self):
+        matrix = self.matrix
+        route = [0]
+        visited = {0}
+        pending = set(range(1, self.size)) - {self.end}
+        while pending:
+            current = route[-1]
+            ready = [stop for stop in pending if self.must_follow.get(stop, set()) <= visited]
+            if not ready:
+                raise ValueError('Precedence constraints contain a cycle')
+            stop = min(ready, key=lambda candidate: matrix[current][candidate])
+            route.append(stop)
+            visited.add(stop)
+            pending.discard(stop)
+        if self.end is not None and self.end != 0:
+            route.append(self.end)
+        return route
+
+    def feasible(self, route):
+        position = {stop: index for index, stop in enumerate(route)}
+        return all(position[before] < position[after]
+                   for after, befores in self.must_follow.items() for before in befores)
+
+    def _last_movable(self, route):
+        # Index of the last stop that may move (the fixed end stays put)
+        return len(route) - 2 if self.end is not None else len(route) - 1
+
+    def two_opt(self, route, deadline):
+        """Reverse route[i..j] while that shortens the route"""
+        matrix = self.matrix
+        last = self._last_movable(route)
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            for i in range(1, last):
+                a, b = route[i - 1], route[i]
+                for j in range(i + 1, last + 1):
+                    c = route[j]
+                    delta = matrix[a][c] - matrix[a][b]
+                    if j + 1 < len(route):
+                        d = route[j + 1]
+                        delta += matrix[b][d] - matrix[c][d]
+                    if delta < -IMPROVEMENT_EPSILON and self._can_reverse(route, i, j):
+                        route[i:j + 1] = reversed(route[i:j + 1])
+                        improved = True
+                        b = route[i]
+        return route
+
+    def _can_reverse(self, route, i, j):
+        segment = set(route[i:j + 1])
+        return not any(self.must_precede.get(stop, set()) & segment for stop in segment)
+
+    def or_opt(self, route, deadline):
+        """Move runs of 1-3 consecutive stops to a cheaper place, keeping their order"""
+        matrix = self.matrix
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            for length in OR_OPT_SEGMENTS:
+                last = self._last_movable(route)
+                i = 1
+                while i + length - 1 <= last:
+                    j = i + length - 1
+                    prev_stop, first, tail = route[i - 1], route[i], route[j]
+                    next_stop = route[j + 1] if j + 1 < len(route) else None
+                    removed = matrix[prev_stop][first] - (matrix[prev_stop][next_stop] if next_stop is not None else 0.0)
+                    if next_stop is not None:
+                        removed += matrix[tail][next_stop]
+                    best = None
+                    rest = route[:i] + route[j + 1:]
+                    rest_last = len(rest) - 1 if self.end is None else len(rest) - 2
+                    for k in range(0, rest_last + 1):  # insert after rest[k]
+                        if k == i - 1:
+                            continue
+                        u = rest[k]
+                        v = rest[k + 1] if k + 1 < len(rest) else None
+                        added = matrix[u][first] + (matrix[tail][v] - matrix[u][v] if v is not None else 0.0)
+                        delta = added - removed
+                        if delta < -IMPROVEMENT_EPSILON and (best is None or delta < best[0]):
+                            candidate = rest[:k + 1] + route[i:j + 1] + rest[k + 1:]
+                            if self.feasible(candidate):
+                                best = (delta, candidate)
+                    if best is not None:
+                        route[:] = best[1]
+                        improved = True
+                    i += 1
+        return route
+
+    def solve(self, time_limit=0.5):
+        """Best route found within time_limit seconds"""
+        deadline = time.perf_counter() + time_limit
+        route = self.nearest_neighbour()
+        while True:
+            before = route_cost(route, self.matrix)
+            self.two_opt(route, deadline)
+            self.or_opt(route, deadline)
+            if route_cost(route, self.matrix) >= before - IMPROVEMENT_EPSILON or time.perf_counter() >= deadline:
+                return route
+
+
+def optimize_stops(points, precedence=(), end=None, matrix=None, time_limit=0.5):
+    """
+    Visit order for [(lat, lng), ...] starting at points[0].
+    Returns (route as indexes into points, total km or matrix units).
+    """
+    if matrix is None:
+        matrix = haversine_matrix(points)
+    if len(points) <= 2:
+        route = list(range(len(points)))
+        return route, route_cost(route, matrix)
+    route = RouteProblem(matrix, precedence, end).solve(time_limit)
+    return route, route_cost(route, matrix)
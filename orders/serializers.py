@@ -1,8 +1,36 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import Order, OrderTracking
+from users.models import Customer, Driver
 from users.serializers import CustomerSerializer, DriverSerializer
 
 
+def requested_fields(request):
+    """Field names from ?fields=a,b,c, or None when the parameter is absent"""
+    if request is None or 'fields' not in request.query_params:
+        return None
+    return {name.strip() for name in request.query_params['fields'].split(',') if name.strip()}
+
+
+class SparseFieldsetMixin:
+    """
+    Trim the serializer to ?fields=... from the request in its context.
+    Meta.optional_fields are only included when asked for by name.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = requested_fields(self.context.get('request'))
+        optional = set(getattr(self.Meta, 'optional_fields', ()))
+        for name in list(self.fields):
+            if requested is not None:
+                keep = name in requested
+            else:
+                keep = name not in optional
+            if not keep:
+                self.fields.pop(name)
+
+
 class OrderTrackingSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderTracking
@@ -31,6 +59,21 @@ class OrderSerializer(serializers.ModelSerializer):
         read_only_fields = ['tracking_code', 'customer', 
                            'created_at', 'updated_at', 'picked_up_at', 'delivered_at']
     
+    @staticmethod
+    def setup_eager_loading(queryset, prefix=''):
+        """
+        Everything the serializer reads, in a fixed number of queries however
+        many orders are listed. `prefix` is the lookup path to the order when
+        loading orders through another model (e.g. 'order__').
+        """
+        drivers = DriverSerializer.setup_eager_loading(Driver.objects.all())
+        return queryset.select_related(
+            f'{prefix}customer__user', f'{prefix}payment'
+        ).prefetch_related(
+            Prefetch(f'{prefix}driver', queryset=drivers),
+            f'{prefix}tracking_logs',
+        )
+    
     def get_payment_status(self, obj):
         """Get payment status if payment exists"""
         try:
@@ -46,6 +89,54 @@ class OrderSerializer(serializers.ModelSerializer):
             return None
 
 
+class CustomerSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Customer
+        fields = ['id', 'full_name', 'phone']
+
+
+class DriverSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Driver
+        fields = ['id', 'full_name', 'phone', 'vehicle_registration']
+
+
+class OrderListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Compact order row for dashboard lists; see OrderSerializer for the full order"""
+    customer = CustomerSummarySerializer(read_only=True)
+    driver = DriverSummarySerializer(read_only=True)
+    tracking_logs = OrderTrackingSerializer(many=True, read_only=True)
+    payment_status = serializers.SerializerMethodField()
+    payment_amount = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Order
+        fields = ['id', 'tracking_code', 'status', 'price', 'is_within_nairobi',
+                  'payment_status', 'customer', 'driver',
+                  'pickup_name', 'pickup_phone', 'pickup_address',
+                  'pickup_latitude', 'pickup_longitude',
+                  'delivery_name', 'delivery_phone', 'delivery_address',
+                  'delivery_latitude', 'delivery_longitude',
+                  'parcel_description', 'special_instructions',
+                  'created_at', 'updated_at',
+                  'parcel_weight', 'picked_up_at', 'delivered_at', 'driver_feedback',
+                  'payment_amount', 'tracking_logs']
+        optional_fields = ['parcel_weight', 'picked_up_at', 'delivered_at', 'driver_feedback',
+                           'payment_amount', 'tracking_logs']
+        read_only_fields = fields
+    
+    @staticmethod
+    def setup_eager_loading(queryset, request=None):
+        """Join the summary relations; tracking logs are only loaded when requested"""
+        queryset = queryset.select_related('customer', 'driver', 'payment')
+        if 'tracking_logs' in (requested_fields(request) or ()):
+            queryset = queryset.prefetch_related('tracking_logs')
+        return queryset
+    
+    get_payment_status = OrderSerializer.get_payment_status
+    get_payment_amount = OrderSerializer.get_payment_amount
+
+
 class OrderCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
@@ -57,7 +148,7 @@ class OrderCreateSerializer(serializers.ModelSerializer):
     
     def to_internal_value(self, data):
         """Round coordinates before validation to avoid max_digits error"""
-        from decimal import Decimal, ROUND_DOWN
+        from decimal import Decimal, InvalidOperation, ROUND_DOWN
         
         # Round coordinates if they exist
         for field in ['pickup_latitude', 'pickup_longitude', 'delivery_latitude', 'delivery_longitude']:
@@ -66,8 +157,8 @@ class OrderCreateSerializer(serializers.ModelSerializer):
                     # Round to 6 decimal places
                     value = Decimal(str(data[field])).quantize(Decimal('0.000001'), rounding=ROUND_DOWN)
                     data[field] = str(value)
-                except (ValueError, TypeError, AttributeError):
-                    pass
+                except (ValueError, TypeError, AttributeError, InvalidOperation):
+                    pass  # left for the field to reject
         
         return super().to_internal_value(data)
     
@@ -78,3 +169,47 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         
         return attrs
 
+
+class PriceQuoteSerializer(serializers.Serializer):
+    """One trip to price; coordinates only, so quoting never geocodes"""
+    pickup_latitude = serializers.DecimalField(max_digits=9, decimal_places=6, min_value=-90, max_value=90)
+    pickup_longitude = serializers.DecimalField(max_digits=10, decimal_places=6, min_value=-180, max_value=180)
+    delivery_latitude = serializers.DecimalField(max_digits=9, decimal_places=6, min_value=-90, max_value=90)
+    delivery_longitude = serializers.DecimalField(max_digits=10, decimal_places=6, min_value=-180, max_value=180)
+
+
+class TrackingLogSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderTracking
+        fields = ['status', 'description', 'created_at']
+
+
+class TrackingDriverSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Driver
+        fields = ['full_name', 'vehicle_type', 'vehicle_registration']
+
+
+class TrackingSerializer(serializers.ModelSerializer):
+    """What the public tracking page shows: no customer record, no driver contact details"""
+    driver = TrackingDriverSerializer(read_only=True)
+    tracking_logs = TrackingLogSerializer(many=True, read_only=True)
+    payment_status = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Order
+        fields = ['tracking_code', 'status', 'price', 'driver',
+                  'pickup_name', 'pickup_phone', 'pickup_address',
+                  'pickup_latitude', 'pickup_longitude',
+                  'delivery_name', 'delivery_phone', 'delivery_address',
+                  'delivery_latitude', 'delivery_longitude',
+                  'created_at', 'updated_at', 'picked_up_at', 'delivered_at',
+                  'tracking_logs', 'payment_status']
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('driver', 'payment').prefetch_related('tracking_logs')
+    
+    def get_payment_status(self, obj):
+        payment = getattr(obj, 'payment', None)
+        return payment.status if payment else None
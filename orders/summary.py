@@ -0,0 +1,233 @@
+"""
+Admin dashboard aggregates, kept in OrderDailySummary.
+
+Every order counts once, in the bucket (local day it was created, current
+status, current driver), with its price and whether its payment completed.
+Signal handlers move an order between buckets as it is saved, paid or
+deleted: they subtract it from the old bucket and add it to the new one in
+the same transaction as the write. Dashboards then read a few rows per day
+instead of every order.
+
+bulk_create skips signals, so bulk writers call record_created(). Changes
+the handlers cannot see - QuerySet.update() of status, orders unassigned in
+SQL when their driver is deleted - are corrected by rebuild() (manage.py
+rebuild_order_summary), which also backfills the table.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DateField, F, OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from users.models import Driver
+from .models import Order, OrderDailySummary
+
+METRICS = ('orders', 'value', 'paid_orders', 'revenue')
+IN_TRANSIT_STATUSES = ('picked_up', 'in_transit')
+DEFAULT_DAYS = 7
+MAX_DAYS = 90
+
+
+def bucket(created_at, status, driver_id):
+    return timezone.localdate(created_at), status, driver_id
+
+
+def contribution(price, paid):
+    price = Decimal(str(price))
+    return {'orders': 1, 'value': price, 'paid_orders': int(paid), 'revenue': price if paid else Decimal('0')}
+
+
+def apply(key, deltas, sign=1):
+    """Add (sign=1) or subtract (sign=-1) `deltas` to the bucket `key`, creating it if needed"""
+    day, status, driver_id = key
+    changes = {field: F(field) + sign * amount for field, amount in deltas.items() if amount}
+    if not changes:
+        return
+    rows = OrderDailySummary.objects.filter(day=day, status=status, driver_id=driver_id)
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            OrderDailySummary.objects.create(
+                day=day, status=status, driver_id=driver_id,
+                **{field: sign * amount for field, amount in deltas.items()}
+            )
+    except IntegrityError:  # created concurrently
+        rows.update(**changes)
+
+
+def is_paid(order_id):
+    from payments.models import Payment
+
+    return Payment.objects.filter(order_id=order_id, status='completed').exists()
+
+
+def _stored_order(order_id, lock=False):
+    """(created_at, status, driver_id, price) as saved, or None"""
+    orders = Order.objects.filter(pk=order_id)
+    if lock:
+        orders = orders.select_for_update()
+    return orders.values_list('created_at', 'status', 'driver_id', 'price').first()
+
+
+def record_created(orders):
+    """Count new, unpaid orders written without signals (bulk_create)"""
+    totals = {}
+    for order in orders:
+        key = bucket(order.created_at, order.status, order.driver_id)
+        deltas = totals.setdefault(key, dict.fromkeys(METRICS, 0))
+        for field, amount in contribution(order.price, False).items():
+            deltas[field] += amount
+    for key, deltas in totals.items():
+        apply(key, deltas)
+
+
+def order_before_save(sender, instance, raw=False, **kwargs):
+    # Order.save() runs in a transaction; the row lock keeps a concurrent save from
+    # moving the order out of the bucket read here before this save moves it too
+    instance._summary_previous = None if raw or instance.pk is None else _stored_order(instance.pk, lock=True)
+
+
+def order_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    new_key = bucket(instance.created_at, instance.status, instance.driver_id)
+    previous = getattr(instance, '_summary_previous', None)
+    if previous is None:  # a new order; its payment cannot have completed yet
+        apply(new_key, contribution(instance.price, False))
+        return
+    created_at, status, driver_id, price = previous
+    old_key = bucket(created_at, status, driver_id)
+    if old_key == new_key and Decimal(str(price)) == Decimal(str(instance.price)):
+        return
+    paid = is_paid(instance.pk)
+    apply(old_key, contribution(price, paid), sign=-1)
+    apply(new_key, contribution(instance.price, paid))
+
+
+def order_deleted(sender, instance, **kwargs):
+    # A cascaded payment is deleted first and has already taken back its revenue
+    apply(bucket(instance.created_at, instance.status, instance.driver_id),
+          contribution(instance.price, is_paid(instance.pk)), sign=-1)
+
+
+def _order_paid(order_id, sign):
+    stored = _stored_order(order_id)
+    if stored is not None:
+        created_at, status, driver_id, price = stored
+        apply(bucket(created_at, status, driver_id), {'paid_orders': 1, 'revenue': Decimal(str(price))}, sign)
+
+
+def payment_before_save(sender, instance, raw=False, **kwargs):
+    instance._summary_was_completed = (
+        not raw and instance.pk is not None
+        and sender.objects.filter(pk=instance.pk, status='completed').exists()
+    )
+
+
+def payment_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    completed = instance.status == 'completed'
+    if completed != getattr(instance, '_summary_was_completed', False):
+        _order_paid(instance.order_id, 1 if completed else -1)
+
+
+def payment_deleted(sender, instance, **kwargs):
+    if instance.status == 'completed':
+        _order_paid(instance.order_id, -1)
+
+
+def rebuild(since=None):
+    """
+    Recompute the buckets of every day from `since` (a date; None for all)
+    from the orders table. Returns the number of buckets written.
+    """
+    orders = Order.objects.all()
+    summaries = OrderDailySummary.objects.all()
+    if since is not None:
+        orders = orders.filter(created_at__gte=timezone.make_aware(datetime.combine(since, time.min)))
+        summaries = summaries.filter(day__gte=since)
+    paid = Q(payment__status='completed')
+    rows = orders.annotate(day=TruncDate('created_at')).values('day', 'status', 'driver_id').annotate(
+        total_orders=Count('id'),
+        total_value=Sum('price'),
+        total_paid_orders=Count('id', filter=paid),
+        total_revenue=Sum('price', filter=paid),
+    ).order_by()
+    with transaction.atomic():
+        buckets = [
+            OrderDailySummary(
+                day=row['day'], status=row['status'], driver_id=row['driver_id'],
+                orders=row['total_orders'], value=row['total_value'] or 0,
+                paid_orders=row['total_paid_orders'], revenue=row['total_revenue'] or 0,
+            )
+            for row in rows
+        ]
+        summaries.delete()
+        OrderDailySummary.objects.bulk_create(buckets, batch_size=500)
+    return len(buckets)
+
+
+def _money(amount):
+    return f'{Decimal(amount):.2f}'  # as the order serializers render prices
+
+
+def dashboard(days=DEFAULT_DAYS):
+    """
+    Totals, per-status counts, the last `days` days and per-driver counts,
+    from one query over the summary table: buckets are grouped by (status,
+    driver, day if within `days` else NULL), a few rows per driver and day.
+    """
+    today = timezone.localdate()
+    since = today - timedelta(days=days - 1)
+    rows = OrderDailySummary.objects.filter(orders__gt=0).values(
+        'status', 'driver_id',
+        # Days after today (clock skew, imported orders) count in the totals only
+        recent=Case(When(day__gte=since, day__lte=today, then=F('day')), output_field=DateField()),
+        driver_name=Subquery(Driver.objects.filter(id=OuterRef('driver_id')).values('full_name')[:1]),
+    ).annotate(
+        **{f'total_{field}': Sum(field) for field in METRICS}
+    ).order_by()
+
+    totals = dict.fromkeys(METRICS, 0)
+    totals['today'] = 0
+    by_status = {status: 0 for status, _ in Order.STATUS_CHOICES}
+    by_day = {since + timedelta(days=offset): {'orders': 0, 'revenue': 0} for offset in range(days)}
+    drivers = {}
+    for row in rows:
+        for field in METRICS:
+            totals[field] += row[f'total_{field}']
+        orders = row['total_orders']
+        by_status[row['status']] = by_status.get(row['status'], 0) + orders
+        if row['recent'] is not None:
+            by_day[row['recent']]['orders'] += orders
+            by_day[row['recent']]['revenue'] += row['total_revenue']
+            if row['recent'] == today:
+                totals['today'] += orders
+        if row['driver_id'] is not None:
+            driver = drivers.setdefault(row['driver_id'], {
+                'id': row['driver_id'], 'full_name': row['driver_name'], 'orders': 0, 'delivered': 0, 'in_progress': 0,
+            })
+            driver['orders'] += orders
+            if row['status'] == 'delivered':
+                driver['delivered'] += orders
+            elif row['status'] in Order.OPEN_STATUSES:
+                driver['in_progress'] += orders
+
+    totals.update({
+        'value': _money(totals['value']),
+        'revenue': _money(totals['revenue']),
+        'pending_assignment': by_status['pending_assignment'],
+        'in_transit': sum(by_status[status] for status in IN_TRANSIT_STATUSES),
+        'delivered': by_status['delivered'],
+    })
+    return {
+        'totals': totals,
+        'by_status': by_status,
+        'days': [{'day': day.isoformat(), 'orders': values['orders'], 'revenue': _money(values['revenue'])}
+                 for day, values in by_day.items()],
+        'drivers': sorted(drivers.values(), key=lambda driver: (-driver['orders'], driver['id'])),
+    }
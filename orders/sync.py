@@ -0,0 +1,166 @@
+"""
+Incremental order sync: ?updated_since=<cursor> on the order lists.
+
+A client starts with an empty cursor, applies each page of changes to its
+local copy (upsert `results` by id, drop `removed` ids) and sends back the
+returned `cursor` until `has_more` is false; later refreshes only transfer
+orders modified since. The cursor is opaque to clients: it holds the
+(updated_at, id) keyset position in the changed orders, the last
+OrderTombstone id seen, when it was issued and whether it was the last page.
+
+updated_at is set when an order is saved, not when its transaction commits,
+so an order can become visible with a time before a cursor already issued.
+Pages of one sync follow the keyset strictly; a caught-up cursor instead
+re-reads the orders updated since ORDER_SYNC_OVERLAP seconds before it was
+issued. Clients upsert by id, so a re-sent order is harmless.
+"""
+import base64
+from datetime import timedelta
+import json
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Order, OrderTombstone
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(updated_at, order_id, tombstone_id, caught_up):
+    state = {
+        't': updated_at.isoformat() if updated_at else None,
+        'i': order_id,
+        'd': tombstone_id,
+        's': timezone.now().isoformat(),
+        'c': caught_up,
+    }
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(updated_at, order_id, tombstone_id, issued_at, caught_up); an empty cursor starts from the beginning"""
+    if not cursor:
+        return None, 0, None, None, False
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        updated_at = parse_datetime(state['t']) if state['t'] else None
+        issued_at = parse_datetime(state['s'])
+        if issued_at is None:
+            raise ValueError(state['s'])
+        return updated_at, int(state['i']), int(state['d']), issued_at, bool(state.get('c', True))
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor) from None
+
+
+def visible_tombstones(user):
+    """Tombstones for orders that left this user's list"""
+    if user.role == 'admin':
+        return OrderTombstone.objects.filter(reason='deleted')
+    if user.role == 'customer':
+        customer_id = getattr(getattr(user, 'customer_profile', None), 'id', None)
+        return OrderTombstone.objects.filter(reason='deleted', customer_id=customer_id)
+    if user.role == 'driver':
+        driver_id = getattr(getattr(user, 'driver_profile', None), 'id', None)
+        return OrderTombstone.objects.filter(driver_id=driver_id)
+    return OrderTombstone.objects.none()
+
+
+def record_unassignment(order, previous_driver_id):
+    """Call when an order moves away from a driver so their synced list drops it"""
+    if previous_driver_id and previous_driver_id != order.driver_id:
+        OrderTombstone.objects.create(
+            order_id=order.id,
+            tracking_code=order.tracking_code,
+            customer_id=order.customer_id,
+            driver_id=previous_driver_id,
+            reason='unassigned',
+        )
+
+
+def changes_response(request, queryset, serializer_class):
+    """
+    One page of changes to `queryset` (already scoped to the caller) after the
+    ?updated_since= cursor. Cancelled orders are reported under `removed`.
+    """
+    try:
+        updated_at, order_id, tombstone_id, issued_at, caught_up = decode_cursor(
+            request.query_params.get('updated_since')
+        )
+    except InvalidCursor:
+        return Response({'error': 'Invalid updated_since cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if issued_at is None:
+        # Full sync: the client has nothing to remove yet, skip the existing tombstones
+        tombstone_id = OrderTombstone.objects.aggregate(last=Max('id'))['last'] or 0
+    elif issued_at < timezone.now() - timedelta(days=settings.ORDER_TOMBSTONE_RETENTION):
+        # Tombstones written since then may be purged; deltas would be incomplete
+        return Response({'error': 'Cursor expired, sync again from an empty updated_since'},
+                        status=status.HTTP_410_GONE)
+
+    limit = settings.ORDER_SYNC_PAGE_SIZE
+    changed = queryset.order_by('updated_at', 'id')
+    if updated_at is not None:
+        overlap_from = issued_at - timedelta(seconds=settings.ORDER_SYNC_OVERLAP)
+        if caught_up and overlap_from <= updated_at:
+            # Orders saved before the cursor may have committed after it was issued
+            changed = changed.filter(updated_at__gte=overlap_from)
+        else:
+            changed = changed.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=order_id))
+    orders = list(changed[:limit + 1])
+
+    tombstones = list(
+        visible_tombstones(request.user).filter(id__gt=tombstone_id)
+        .order_by('id').values('id', 'order_id', 'tracking_code', 'reason')[:limit + 1]
+    )
+    has_more = len(orders) > limit or len(tombstones) > limit
+    orders, tombstones = orders[:limit], tombstones[:limit]
+
+    live = [order for order in orders if order.status != 'cancelled']
+    removed = [{'id': order.id, 'tracking_code': order.tracking_code, 'reason': 'cancelled'}
+               for order in orders if order.status == 'cancelled']
+    # An order reassigned back to a driver is in `results` as well as in their tombstones
+    listed = {order.id for order in orders}
+    for row in tombstones:
+        if row['order_id'] not in listed:
+            listed.add(row['order_id'])
+            removed.append({'id': row['order_id'], 'tracking_code': row['tracking_code'], 'reason': row['reason']})
+
+    if orders:
+        updated_at, order_id = orders[-1].updated_at, orders[-1].id
+    if tombstones:
+        tombstone_id = tombstones[-1]['id']
+
+    return Response({
+        'results': serializer_class(live, many=True, context={'request': request}).data,
+        'removed': removed,
+        'cursor': encode_cursor(updated_at, order_id, tombstone_id, not has_more),
+        'has_more': has_more,
+    })
+
+
+def order_deleted(sender, instance, **kwargs):
+    OrderTombstone.objects.create(
+        order_id=instance.id,
+        tracking_code=instance.tracking_code,
+        customer_id=instance.customer_id,
+        driver_id=instance.driver_id,
+        reason='deleted',
+    )
+
+
+def order_part_saved(sender, instance, **kwargs):
+    # Payment status and tracking logs are part of the order clients sync; bump the order so it is resent
+    Order.objects.filter(pk=instance.order_id).update(updated_at=timezone.now())
+
+
+def purge_tombstones():
+    """Delete tombstones older than any cursor still accepted. Returns the number removed."""
+    cutoff = timezone.now() - timedelta(days=settings.ORDER_TOMBSTONE_RETENTION)
+    deleted, _ = OrderTombstone.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
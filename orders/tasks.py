@@ -0,0 +1,16 @@
+"""Periodic order/maps maintenance tasks"""
+from celery import shared_task
+from .geocoding import purge_expired
+
+
+@shared_task
+def purge_geocode_cache():
+    """Evict expired geocode cache rows"""
+    return purge_expired()
+
+
+@shared_task
+def purge_order_tombstones():
+    """Drop sync tombstones older than ORDER_TOMBSTONE_RETENTION"""
+    from .sync import purge_tombstones
+    return purge_tombstones()
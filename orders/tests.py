@@ -0,0 +1,1185 @@
+"""
+Order app tests.
+Run: python manage.py test orders
+"""
+import asyncio
+import io
+import json
+import os
+import random
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from pakahome.testing import QueryBudgetMixin, QueryPlanMixin
+from payments.models import Payment
+from users.models import User, Customer, Driver
+from . import events
+from .autocomplete import autocomplete
+from .event_views import event_stream
+from .gazetteer import Gazetteer, GazetteerIndex, build
+from .geocoding import geocode, geocode_cache, normalize_address
+from .models import GeocodeCacheEntry, Order, OrderDailySummary, OrderTracking
+from .directions import directions_cache
+from .routing import RouteProblem, haversine_matrix, optimize_stops, route_cost
+from .pricing import PricingEngine, point_in_polygon
+from .summary import rebuild
+
+
+GOOGLE_OK = {
+    'status': 'OK',
+    'results': [{'geometry': {'location': {'lat': -1.2676, 'lng': 36.8108}}}],
+}
+
+
+class GeocodeCacheTestCase(TestCase):
+
+    def setUp(self):
+        geocode_cache.lru.clear()
+        geocode_cache.reset_stats()
+
+    def test_normalize_address(self):
+        self.assertEqual(normalize_address('  Westlands,  Nairobi, Kenya '), 'westlands nairobi')
+        self.assertEqual(normalize_address('WESTLANDS - Nairobi'), 'westlands nairobi')
+
+    def test_repeat_address_skips_google(self):
+        with mock.patch('orders.geocoding.fetch_geocode', return_value=GOOGLE_OK) as fetch:
+            first = geocode('Westlands, Nairobi')
+            second = geocode('westlands nairobi kenya')
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(GeocodeCacheEntry.objects.count(), 1)
+        self.assertEqual(geocode_cache.counters['lru_hits'], 1)
+
+        # A fresh process (empty LRU) is served from the database tier
+        geocode_cache.lru.clear()
+        with mock.patch('orders.geocoding.fetch_geocode') as fetch:
+            geocode('Westlands, Nairobi')
+        fetch.assert_not_called()
+        self.assertEqual(geocode_cache.counters['db_hits'], 1)
+
+    def test_order_creation_geocodes_without_retries(self):
+        user = User.objects.create_user(
+            phone_number='254700000012', email='geocode-customer@test.pakahome.local', password='1234', role='customer'
+        )
+        Customer.objects.create(user=user, full_name='Geocode Customer', phone='254700000012')
+        client = APIClient()
+        client.force_authenticate(user)
+        upstream = mock.Mock()
+        upstream.get.return_value.json.return_value = GOOGLE_OK
+        with mock.patch('orders.geocoding.outbound.client', return_value=upstream) as outbound_client:
+            response = client.post('/api/orders/', {
+                'pickup_name': 'A', 'pickup_phone': '254700000012', 'pickup_address': 'Somewhere Uncached, Nairobi',
+                'delivery_name': 'B', 'delivery_phone': '254700000013', 'delivery_address': 'Elsewhere Uncached',
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual({call.args[0] for call in outbound_client.call_args_list}, {'google_maps_interactive'})
+        self.assertEqual(settings.OUTBOUND_UPSTREAMS['google_maps_interactive']['retries'], 0)
+
+    def test_failed_lookup_not_cached(self):
+        with mock.patch('orders.geocoding.fetch_geocode', return_value={'status': 'ZERO_RESULTS', 'results': []}):
+            geocode('Nowhere')
+        self.assertFalse(GeocodeCacheEntry.objects.exists())
+
+
+def places_payload(*descriptions):
+    return {
+        'status': 'OK',
+        'predictions': [{'description': d, 'place_id': str(i)} for i, d in enumerate(descriptions)],
+    }
+
+
+class AutocompleteTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_exact_query_served_from_cache(self):
+        payload = places_payload('Westlands Road, Nairobi')
+        with mock.patch('orders.autocomplete.fetch_predictions', return_value=payload) as fetch:
+            first = autocomplete('Westlands Ro')
+            second = autocomplete('westlands ro', first['sessiontoken'])
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(second['source'], 'cache')
+        self.assertEqual(second['sessiontoken'], first['sessiontoken'])
+
+    def test_longer_query_narrowed_from_complete_prefix(self):
+        payload = places_payload('Westlands Road, Nairobi', 'Westlands Rose Avenue, Nairobi')
+        with mock.patch('orders.autocomplete.fetch_predictions', return_value=payload):
+            autocomplete('Westlands Ro')
+        with mock.patch('orders.autocomplete.fetch_predictions') as fetch:
+            result = autocomplete('Westlands Road')
+        fetch.assert_not_called()
+        self.assertEqual(result['source'], 'prefix')
+        self.assertEqual([p['description'] for p in result['predictions']], ['Westlands Road, Nairobi'])
+
+    def test_truncated_prefix_goes_upstream(self):
+        payload = places_payload(*[f'Westlands Place {i}' for i in range(5)])
+        with mock.patch('orders.autocomplete.fetch_predictions', return_value=payload):
+            autocomplete('Westlands')
+        with mock.patch('orders.autocomplete.fetch_predictions', return_value=places_payload()) as fetch:
+            autocomplete('Westlands Pl')
+        fetch.assert_called_once()
+
+    def test_picked_prediction_ends_the_session(self):
+        client = APIClient()
+        with mock.patch('orders.autocomplete.fetch_predictions', return_value=places_payload('Sarit Centre')):
+            token = client.get('/api/maps/autocomplete/', {'query': 'Sarit'}).json()['sessiontoken']
+        result = {'formatted_address': 'Sarit Centre, Nairobi', 'place_id': '0',
+                  'geometry': {'location': {'lat': -1.261, 'lng': 36.8025}}}
+        upstream = mock.Mock()
+        upstream.get.return_value.json.return_value = {'status': 'OK', 'result': result}
+        with mock.patch('orders.autocomplete.outbound.client', return_value=upstream):
+            response = client.get('/api/maps/place-details/', {'place_id': '0', 'sessiontoken': token})
+        self.assertEqual(response.json(), {'status': 'OK', 'results': [result]})
+        self.assertEqual(upstream.get.call_args.kwargs['params']['sessiontoken'], token)
+
+
+class GazetteerTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(
+            phone_number='254700000010', email='gazetteer@test.pakahome.local', password='1234', role='customer'
+        )
+        self.customer = Customer.objects.create(user=user, full_name='Gazetteer Customer', phone='254700000010')
+        self.path = os.path.join(tempfile.mkdtemp(), 'gazetteer.idx')
+
+    def deliver(self, pickup, pickup_coords, delivery, delivery_coords):
+        return Order.objects.create(
+            customer=self.customer,
+            pickup_name='A', pickup_phone='254700000010', pickup_address=pickup,
+            pickup_latitude=Decimal(pickup_coords[0]), pickup_longitude=Decimal(pickup_coords[1]),
+            delivery_name='B', delivery_phone='254700000011', delivery_address=delivery,
+            delivery_latitude=Decimal(delivery_coords[0]), delivery_longitude=Decimal(delivery_coords[1]),
+            price=Decimal('150'), status='delivered', delivered_at=timezone.now(),
+        )
+
+    def test_build_and_lookup(self):
+        self.deliver('Sarit Centre, Westlands', ('-1.2610', '36.8025'), 'Yaya Centre, Kilimani', ('-1.2925', '36.7876'))
+        places, read = build(self.path)
+        self.assertEqual((places, read), (2, 1))
+
+        index = GazetteerIndex(self.path)
+        self.addCleanup(index.close)
+        place = index.exact('sarit centre westlands, Kenya')
+        self.assertAlmostEqual(place.latitude, -1.2610)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o644)  # readable by other users' processes
+        self.assertIsNone(index.exact('Westlands'))  # suffix keys are not exact matches
+        self.assertEqual([p.text for p in index.search('westl')], ['Sarit Centre, Westlands'])
+        self.assertEqual([p.text for p in index.search('yaya')], ['Yaya Centre, Kilimani'])
+
+    def test_incremental_build_merges_new_orders(self):
+        self.deliver('Sarit Centre, Westlands', ('-1.2610', '36.8025'), 'Yaya Centre', ('-1.2925', '36.7876'))
+        build(self.path)
+        self.deliver('sarit centre westlands', ('-1.2630', '36.8025'), 'Junction Mall', ('-1.2985', '36.7622'))
+        places, read = build(self.path)
+        self.assertEqual((places, read), (3, 1))
+
+        index = GazetteerIndex(self.path)
+        self.addCleanup(index.close)
+        place = index.exact('Sarit Centre, Westlands')
+        self.assertEqual(place.hits, 2)
+        self.assertAlmostEqual(place.latitude, -1.2620)
+
+    def test_incremental_build_reads_orders_delivered_in_the_same_instant(self):
+        first = self.deliver('Sarit Centre', ('-1.2610', '36.8025'), 'Yaya Centre', ('-1.2925', '36.7876'))
+        build(self.path)
+        second = self.deliver('Junction Mall', ('-1.2985', '36.7622'), 'Prestige Plaza', ('-1.2999', '36.7869'))
+        Order.objects.filter(pk=second.pk).update(delivered_at=first.delivered_at)
+        places, read = build(self.path)
+        self.assertEqual((places, read), (4, 1))
+        self.assertEqual(build(self.path), (4, 0))
+
+    def test_replaced_index_is_closed(self):
+        self.deliver('Sarit Centre', ('-1.2610', '36.8025'), 'Yaya Centre', ('-1.2925', '36.7876'))
+        build(self.path)
+        handle = Gazetteer(self.path)
+        self.assertEqual([p.text for p in handle.search('sarit')], ['Sarit Centre'])
+        old = handle._index
+
+        self.deliver('Sarit Hotel', ('-1.2600', '36.8020'), 'Yaya Centre', ('-1.2925', '36.7876'))
+        build(self.path)
+        os.utime(self.path, ns=(0, os.stat(self.path).st_mtime_ns + 10 ** 9))
+        handle._checked_at = 0
+        self.assertEqual(len(handle.search('sarit')), 2)
+        self.assertTrue(old._mm.closed)
+        self.addCleanup(handle._index.close)
+
+    def test_autocomplete_lists_gazetteer_places_first(self):
+        cache.clear()
+        self.deliver('Sarit Centre, Westlands', ('-1.2610', '36.8025'), 'Yaya Centre', ('-1.2925', '36.7876'))
+        build(self.path)
+        upstream = places_payload('Westlands Road, Nairobi', 'Sarit Centre, Westlands')
+        with mock.patch('orders.autocomplete.gazetteer', Gazetteer(self.path)), \
+                mock.patch('orders.autocomplete.fetch_predictions', return_value=upstream) as fetch:
+            partial = autocomplete('westl')
+            full = autocomplete('Sarit Centre, Westlands')
+        fetch.assert_called_once()
+        self.assertEqual([p['description'] for p in partial['predictions']],
+                         ['Sarit Centre, Westlands', 'Westlands Road, Nairobi'])
+        self.assertEqual(partial['predictions'][0]['source'], 'gazetteer')
+        self.assertEqual(full['source'], 'gazetteer')
+
+
+class OrderListQueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    """List endpoints must run the same number of queries for 2 or 12 orders"""
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            phone_number='254700000040', email='budget-admin@test.pakahome.local', password='1234', role='admin'
+        )
+        customer_user = User.objects.create_user(
+            phone_number='254700000041', email='budget-customer@test.pakahome.local', password='1234', role='customer'
+        )
+        self.customer = Customer.objects.create(user=customer_user, full_name='Budget Customer', phone='254700000041')
+        self.drivers = []
+        for i in range(2):
+            driver_user = User.objects.create_user(
+                phone_number=f'25470000005{i}', email=f'budget-driver{i}@test.pakahome.local', password='1234', role='driver'
+            )
+            self.drivers.append(Driver.objects.create(
+                user=driver_user, full_name=f'Budget Driver {i}', phone=f'25470000005{i}', license_number=f'DLB{i}'
+            ))
+        self.add_orders(2)
+
+    def add_orders(self, count):
+        for i in range(count):
+            order = Order.objects.create(
+                customer=self.customer, driver=self.drivers[i % 2],
+                pickup_name='A', pickup_phone='254700000041', pickup_address='Westlands',
+                delivery_name='B', delivery_phone='254700000042', delivery_address='Kilimani',
+                price=Decimal('150'), status='assigned',
+            )
+            Payment.objects.create(order=order, customer=self.customer, phone_number='254700000041',
+                                   amount=order.price, status='completed')
+            OrderTracking.objects.create(order=order, status='assigned')
+
+    def query_count(self, user, url, budget):
+        client = APIClient()
+        client.force_authenticate(user)
+        with self.assertQueryBudget(budget) as queries:
+            self.assertEqual(client.get(url).status_code, 200)
+        return len(queries.captured_queries)
+
+    def test_list_endpoints_have_constant_query_counts(self):
+        # (user, url, budget)
+        endpoints = [
+            (self.admin, '/api/orders/', 2),  # ETag aggregate + joined rows; cursor pages run no COUNT
+            (self.customer.user, '/api/orders/', 2),
+            (self.drivers[0].user, '/api/orders/', 2),
+            (self.drivers[0].user, '/api/orders/?fields=id,status,tracking_logs', 3),
+            (self.drivers[0].user, '/api/drivers/orders/', 2),
+            (self.admin, '/api/drivers/', 1),
+            (self.admin, '/api/auth/drivers/', 1),
+            (self.admin, '/api/payments/', 3),
+        ]
+        before = [self.query_count(*endpoint) for endpoint in endpoints]
+        self.add_orders(10)
+        after = [self.query_count(*endpoint) for endpoint in endpoints]
+        self.assertEqual(before, after)
+
+
+    def test_list_rows_are_compact_and_fields_selectable(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+
+        row = client.get('/api/orders/').data['results'][0]
+        self.assertNotIn('tracking_logs', row)
+        self.assertEqual(set(row['customer']), {'id', 'full_name', 'phone'})
+        self.assertEqual(row['payment_status'], 'completed')
+
+        row = client.get('/api/orders/', {'fields': 'id,status,tracking_logs'}).data['results'][0]
+        self.assertEqual(set(row), {'id', 'status', 'tracking_logs'})
+        self.assertEqual([log['status'] for log in row['tracking_logs']], ['assigned'])
+
+
+class OrderEventsTestCase(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            phone_number='254700000060', email='events-admin@test.pakahome.local', password='1234', role='admin'
+        )
+        customer_user = User.objects.create_user(
+            phone_number='254700000061', email='events-customer@test.pakahome.local', password='1234', role='customer'
+        )
+        self.customer = Customer.objects.create(user=customer_user, full_name='Events Customer', phone='254700000061')
+        self.order = Order.objects.create(
+            customer=self.customer,
+            pickup_name='A', pickup_phone='254700000061', pickup_address='Westlands',
+            delivery_name='B', delivery_phone='254700000062', delivery_address='Kilimani',
+            price=Decimal('150'), status='accepted',
+        )
+        events._bus = events.LocalBus()
+        self.addCleanup(setattr, events, '_bus', None)
+
+    def test_status_update_publishes_after_commit(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        with mock.patch.object(events.LocalBus, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = client.post(f'/api/orders/{self.order.id}/status/', {'status': 'picked_up'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        event = publish.call_args.args[0]
+        self.assertEqual((event['type'], event['status'], event['previous_status']), ('order.status', 'picked_up', 'accepted'))
+
+    def test_visibility(self):
+        event = events.order_event('order.status', self.order)
+        self.assertTrue(events.visible_to(event, {'role': 'admin'}))
+        self.assertTrue(events.visible_to(event, {'role': 'customer', 'customer_id': self.customer.id}))
+        self.assertFalse(events.visible_to(event, {'role': 'customer', 'customer_id': self.customer.id + 1}))
+        self.assertFalse(events.visible_to(event, {'role': 'driver', 'driver_id': None}))
+        self.assertTrue(events.visible_to(event, {'tracking_code': self.order.tracking_code}))
+
+    def test_stream_delivers_visible_events(self):
+        other = events.order_event('order.status', self.order)
+        other['tracking_code'] = 'PKH-OTHER'
+        mine = events.order_event('order.status', self.order)
+
+        async def read_stream():
+            stream = event_stream({'tracking_code': self.order.tracking_code}, max_age=5)
+            chunks = [await anext(stream)]  # reconnect delay
+            next_chunk = asyncio.ensure_future(anext(stream))
+            await asyncio.sleep(0.05)
+            events.bus().publish(other)
+            events.bus().publish(mine)
+            chunks.append(await next_chunk)
+            await stream.aclose()
+            return chunks
+
+        chunks = asyncio.run(read_stream())
+        self.assertTrue(chunks[0].startswith('retry:'))
+        self.assertTrue(chunks[1].startswith('event: order.status\n'))
+        data = json.loads(chunks[1].split('data: ', 1)[1])
+        self.assertEqual(data['tracking_code'], self.order.tracking_code)
+        self.assertNotIn('customer_id', data)  # public streams only see the status
+
+    def test_stream_needs_asgi(self):
+        response = self.client.get('/api/orders/events/')
+        self.assertEqual(response.status_code, 503)
+
+
+class ConditionalGetTestCase(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(
+            phone_number='254700000070', email='etag@test.pakahome.local', password='1234', role='customer'
+        )
+        self.customer = Customer.objects.create(user=user, full_name='ETag Customer', phone='254700000070')
+        self.order = Order.objects.create(
+            customer=self.customer,
+            pickup_name='A', pickup_phone='254700000070', pickup_address='Westlands',
+            delivery_name='B', delivery_phone='254700000071', delivery_address='Kilimani',
+            price=Decimal('150'), status='pending_payment',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_unchanged_list_is_not_modified(self):
+        first = self.client.get('/api/orders/')
+        etag = first['ETag']
+        with self.assertQueryBudget(2):  # customer profile + one aggregate
+            second = self.client.get('/api/orders/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b'')
+
+        # Other query parameters are a different representation
+        self.assertEqual(self.client.get('/api/orders/?fields=id', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        OrderTracking.objects.create(order=self.order, status='pending_payment')
+        third = self.client.get('/api/orders/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third['ETag'], etag)
+
+    def test_tracking_and_detail_revalidate(self):
+        url = f'/api/orders/tracking/{self.order.tracking_code}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        detail = f'/api/orders/{self.order.id}/'
+        etag = self.client.get(detail)['ETag']
+        self.assertEqual(self.client.get(detail, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Payment.objects.create(order=self.order, customer=self.customer, phone_number='254700000070',
+                               amount=self.order.price, status='pending')
+        self.assertEqual(self.client.get(detail, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_embedded_driver_changes_revalidate(self):
+        from drivers.locations import write_fixes
+
+        driver_user = User.objects.create_user(
+            phone_number='254700000072', email='etag-driver@test.pakahome.local', password='1234', role='driver'
+        )
+        driver = Driver.objects.create(user=driver_user, full_name='ETag Driver', phone='254700000072',
+                                       license_number='DL070', status='busy')
+        self.order.driver = driver
+        self.order.save()
+        detail = f'/api/orders/{self.order.id}/'
+
+        etag = self.client.get(detail)['ETag']
+        now = timezone.now().isoformat()
+        write_fixes([{'driver_id': driver.id, 'latitude': '-1.280000', 'longitude': '36.810000', 'accuracy': None,
+                      'speed': None, 'heading': None, 'recorded_at': now, 'received_at': now}])
+        moved = self.client.get(detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(moved.status_code, 200)
+        self.assertEqual(moved.json()['driver']['current_latitude'], '-1.280000')
+
+        etag = moved['ETag']
+        driver.status = 'available'
+        driver.save(update_fields=['status', 'updated_at'])
+        self.assertEqual(self.client.get(detail, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(ORDER_SYNC_OVERLAP=0)
+class IncrementalSyncTestCase(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            phone_number='254700000080', email='sync-admin@test.pakahome.local', password='1234', role='admin'
+        )
+        customer_user = User.objects.create_user(
+            phone_number='254700000081', email='sync-customer@test.pakahome.local', password='1234', role='customer'
+        )
+        self.customer = Customer.objects.create(user=customer_user, full_name='Sync Customer', phone='254700000081')
+        self.drivers = []
+        for i in range(2):
+            driver_user = User.objects.create_user(
+                phone_number=f'25470000009{i}', email=f'sync-driver{i}@test.pakahome.local', password='1234', role='driver'
+            )
+            self.drivers.append(Driver.objects.create(
+                user=driver_user, full_name=f'Sync Driver {i}', phone=f'25470000009{i}',
+                license_number=f'DLS{i}', status='available'
+            ))
+        self.orders = [
+            Order.objects.create(
+                customer=self.customer, driver=self.drivers[0],
+                pickup_name='A', pickup_phone='254700000081', pickup_address='Westlands',
+                delivery_name='B', delivery_phone='254700000082', delivery_address='Kilimani',
+                price=Decimal('150'), status='assigned',
+            )
+            for _ in range(3)
+        ]
+
+    def sync(self, user, url, cursor=''):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(url, {'updated_since': cursor})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_deltas_follow_the_cursor(self):
+        with self.settings(ORDER_SYNC_PAGE_SIZE=2):
+            first = self.sync(self.admin, '/api/orders/')
+            self.assertTrue(first['has_more'])
+            second = self.sync(self.admin, '/api/orders/', first['cursor'])
+        self.assertFalse(second['has_more'])
+        self.assertEqual(
+            [row['id'] for row in first['results'] + second['results']], [order.id for order in self.orders]
+        )
+
+        cursor = second['cursor']
+        self.assertEqual(self.sync(self.admin, '/api/orders/', cursor)['results'], [])
+
+        self.orders[1].status = 'picked_up'
+        self.orders[1].save()
+        self.orders[2].status = 'cancelled'
+        self.orders[2].save()
+        delta = self.sync(self.admin, '/api/orders/', cursor)
+        self.assertEqual([row['id'] for row in delta['results']], [self.orders[1].id])
+        self.assertEqual(delta['removed'], [
+            {'id': self.orders[2].id, 'tracking_code': self.orders[2].tracking_code, 'reason': 'cancelled'}
+        ])
+
+        # A payment update resends its order
+        cursor = delta['cursor']
+        Payment.objects.create(order=self.orders[0], customer=self.customer, phone_number='254700000081',
+                               amount=self.orders[0].price, status='completed')
+        delta = self.sync(self.admin, '/api/orders/', cursor)
+        self.assertEqual([row['payment_status'] for row in delta['results']], ['completed'])
+
+    def test_tombstones_for_reassigned_and_deleted_orders(self):
+        driver_user = self.drivers[0].user
+        cursor = self.sync(driver_user, '/api/drivers/orders/')['cursor']
+        customer_cursor = self.sync(self.customer.user, '/api/orders/')['cursor']
+
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.post(f'/api/drivers/assign/{self.orders[0].id}/',
+                               {'driver_id': self.drivers[1].id}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        deleted_id = self.orders[2].id
+        self.orders[2].delete()
+
+        delta = self.sync(driver_user, '/api/drivers/orders/', cursor)
+        self.assertEqual(delta['results'], [])
+        self.assertEqual(sorted((row['id'], row['reason']) for row in delta['removed']),
+                         sorted([(self.orders[0].id, 'unassigned'), (deleted_id, 'deleted')]))
+
+        delta = self.sync(self.customer.user, '/api/orders/', customer_cursor)
+        self.assertEqual([row['id'] for row in delta['results']], [self.orders[0].id])
+        self.assertEqual(delta['removed'], [
+            {'id': deleted_id, 'tracking_code': self.orders[2].tracking_code, 'reason': 'deleted'}
+        ])
+
+    @override_settings(ORDER_SYNC_OVERLAP=10)
+    def test_caught_up_cursor_rereads_late_commits(self):
+        cursor = self.sync(self.admin, '/api/orders/')['cursor']
+        # Saved (and stamped) before the cursor was issued, committed after it
+        late = Order.objects.create(
+            customer=self.customer,
+            pickup_name='A', pickup_phone='254700000081', pickup_address='Westlands',
+            delivery_name='B', delivery_phone='254700000082', delivery_address='Kilimani',
+            price=Decimal('150'), status='pending_payment',
+        )
+        Order.objects.filter(pk=late.pk).update(updated_at=self.orders[0].updated_at - timedelta(seconds=1))
+
+        delta = self.sync(self.admin, '/api/orders/', cursor)
+        self.assertIn(late.id, [row['id'] for row in delta['results']])
+        self.assertFalse(delta['has_more'])
+
+        # Once the window has passed, an idle cursor resends nothing
+        with mock.patch('orders.sync.timezone.now', return_value=timezone.now() + timedelta(seconds=30)):
+            cursor = self.sync(self.admin, '/api/orders/', delta['cursor'])['cursor']
+        self.assertEqual(self.sync(self.admin, '/api/orders/', cursor)['results'], [])
+
+    def test_reassigned_back_order_is_not_removed(self):
+        driver_user = self.drivers[0].user
+        cursor = self.sync(driver_user, '/api/drivers/orders/')['cursor']
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        for driver in (self.drivers[1], self.drivers[0]):
+            response = client.post(f'/api/drivers/assign/{self.orders[0].id}/', {'driver_id': driver.id}, format='json')
+            self.assertEqual(response.status_code, 200, response.content)
+
+        delta = self.sync(driver_user, '/api/drivers/orders/', cursor)
+        self.assertEqual([row['id'] for row in delta['results']], [self.orders[0].id])
+        self.assertEqual(delta['removed'], [])
+
+    def test_bad_and_expired_cursors(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        self.assertEqual(client.get('/api/orders/', {'updated_since': 'garbage'}).status_code, 400)
+
+        cursor = self.sync(self.admin, '/api/orders/')['cursor']
+        with mock.patch('orders.sync.timezone.now', return_value=timezone.now() + timedelta(days=31)):
+            self.assertEqual(client.get('/api/orders/', {'updated_since': cursor}).status_code, 410)
+
+
+class RouteOptimizationTestCase(TestCase):
+
+    def test_pickups_precede_deliveries_and_beat_nearest_neighbour(self):
+        rng = random.Random(5)
+        points = [(-1.29, 36.82)]
+        precedence = []
+        for _ in range(60):
+            points.append((rng.uniform(-1.40, -1.20), rng.uniform(36.70, 36.95)))
+            points.append((rng.uniform(-1.40, -1.20), rng.uniform(36.70, 36.95)))
+            precedence.append((len(points) - 2, len(points) - 1))
+        matrix = haversine_matrix(points)
+        problem = RouteProblem(matrix, precedence)
+
+        route, cost = optimize_stops(points, precedence, matrix=matrix, time_limit=2)
+        self.assertEqual(route[0], 0)
+        self.assertEqual(sorted(route), list(range(len(points))))
+        self.assertTrue(problem.feasible(route))
+        self.assertLess(cost, route_cost(problem.nearest_neighbour(), matrix))
+
+    def test_fixed_end_stays_last(self):
+        points = [(-1.30, 36.80), (-1.25, 36.80), (-1.28, 36.80), (-1.26, 36.80), (-1.27, 36.80)]
+        route, _ = optimize_stops(points, end=1)
+        self.assertEqual(route, [0, 2, 4, 3, 1])
+
+    def test_route_optimization_is_local(self):
+        with mock.patch('pakahome.outbound.UpstreamClient.get') as upstream:
+            response = APIClient().get('/api/maps/route-optimization/', {
+                'origin': '-1.30,36.80',
+                'destination': '-1.25,36.80',
+                'waypoints': '-1.26,36.80|-1.28,36.80|-1.27,36.80',
+            })
+        upstream.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['waypoint_order'], [1, 2, 0])
+        self.assertEqual(response.data['source'], 'local')
+
+    def test_driver_route_orders_open_orders(self):
+        user = User.objects.create_user(
+            phone_number='254700000100', email='route-driver@test.pakahome.local', password='1234', role='driver'
+        )
+        driver = Driver.objects.create(user=user, full_name='Route Driver', phone='254700000100', license_number='DLR1',
+                                       current_latitude='-1.300000', current_longitude='36.800000')
+        customer_user = User.objects.create_user(
+            phone_number='254700000101', email='route-customer@test.pakahome.local', password='1234', role='customer'
+        )
+        customer = Customer.objects.create(user=customer_user, full_name='Route Customer', phone='254700000101')
+
+        def order(status, pickup, delivery):
+            return Order.objects.create(
+                customer=customer, driver=driver, status=status, price=Decimal('150'),
+                pickup_name='A', pickup_phone='254700000101', pickup_address='Pickup',
+                pickup_latitude=pickup, pickup_longitude='36.800000',
+                delivery_name='B', delivery_phone='254700000102', delivery_address='Drop',
+                delivery_latitude=delivery, delivery_longitude='36.800000',
+            )
+
+        collected = order('picked_up', '-1.310000', '-1.200000')
+        # Its pickup is near the start but its delivery is right behind the driver
+        waiting = order('accepted', '-1.250000', '-1.299000')
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/maps/driver-route/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(stop['type'], stop['order_id']) for stop in response.data['stops']],
+            [('pickup', waiting.id), ('delivery', waiting.id), ('delivery', collected.id)],
+        )
+
+
+def fake_google(path, params=None, **kwargs):
+    """Stub for UpstreamClient.get answering directions and distance-matrix calls"""
+    response = mock.Mock()
+    if path.endswith('/directions/json'):
+        response.json.return_value = {'status': 'OK', 'routes': [{
+            'summary': 'Waiyaki Way',
+            'overview_polyline': {'points': 'abc~def'},
+            'legs': [{'distance': {'text': '5.2 km', 'value': 5200}, 'duration': {'text': '14 mins', 'value': 840},
+                      'start_address': 'Westlands', 'end_address': 'Kilimani', 'steps': [{'html': 'long'}]}],
+        }]}
+    else:
+        origins, destinations = params['origins'].split('|'), params['destinations'].split('|')
+        response.json.return_value = {'status': 'OK', 'rows': [
+            {'elements': [{'status': 'OK', 'distance': {'value': 1000 * (i + j)}, 'duration': {'value': 60 * (i + j)}}
+                          for j in range(len(destinations))]}
+            for i in range(len(origins))
+        ]}
+    return response
+
+
+class DirectionsCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        directions_cache.lru.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(
+            phone_number='254700000110', email='directions@test.pakahome.local', password='1234', role='customer'
+        ))
+
+    def test_nearby_endpoints_share_one_entry(self):
+        with mock.patch('pakahome.outbound.UpstreamClient.get', side_effect=fake_google) as upstream:
+            first = self.client.get('/api/maps/directions/', {'origin': '-1.26400,36.80300', 'destination': '-1.29000,36.78500'})
+            second = self.client.get('/api/maps/directions/', {'origin': '-1.26410,36.80320', 'destination': '-1.29010,36.78490'})
+        self.assertEqual(upstream.call_count, 1)
+        self.assertEqual(first.data['source'], 'google')
+        self.assertEqual(second.data['source'], 'cache')
+        route = second.data['routes'][0]
+        self.assertEqual(route['overview_polyline']['points'], 'abc~def')
+        self.assertEqual(route['legs'][0]['distance']['value'], 5200)
+        self.assertNotIn('steps', route['legs'][0])
+
+    def test_matrix_fills_missing_pairs_in_batches(self):
+        origins = [f'-1.{2600 + i * 10},36.8000' for i in range(3)]
+        destinations = [f'-1.{3000 + j * 10},36.7500' for j in range(12)]
+        with mock.patch('pakahome.outbound.UpstreamClient.get', side_effect=fake_google) as upstream:
+            response = self.client.post('/api/maps/distance-matrix/',
+                                        {'origins': origins, 'destinations': destinations}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(upstream.call_count, 2)  # 3 x 12 pairs: two blocks of at most 10 destinations
+        self.assertEqual((response.data['fetched'], response.data['cached']), (36, 0))
+        self.assertEqual(len(response.data['rows']), 3)
+        self.assertEqual(len(response.data['rows'][0]), 12)
+
+        with mock.patch('pakahome.outbound.UpstreamClient.get', side_effect=fake_google) as upstream:
+            response = self.client.post('/api/maps/distance-matrix/',
+                                        {'origins': origins, 'destinations': destinations + ['-1.4000,36.7000']},
+                                        format='json')
+        self.assertEqual(upstream.call_count, 1)  # only the new column
+        self.assertEqual((response.data['fetched'], response.data['cached']), (3, 36))
+
+
+class PricingTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(
+            phone_number='254700000120', email='pricing@test.pakahome.local', password='1234', role='customer'
+        ))
+
+    def test_defaults_match_flat_nairobi_pricing(self):
+        from .services import calculate_price
+        self.assertEqual(calculate_price(-1.29, 36.82, -1.26, 36.80), (150, True))
+        self.assertEqual(calculate_price(-1.5, 36.6, -1.1, 37.0), (150, True))  # corners count as inside
+        self.assertEqual(calculate_price(-1.29, 36.82, -0.30, 36.07), (300, False))
+
+    def test_grid_agrees_with_polygon_test(self):
+        polygon = [(-1.40, 36.70), (-1.40, 36.95), (-1.20, 36.95), (-1.30, 36.85), (-1.20, 36.70)]
+        engine = PricingEngine([{'name': 'notch', 'price': 200, 'polygon': polygon}], [], 300, 0.01)
+        zone = engine.zones[0]
+        rng = random.Random(3)
+        for _ in range(2000):
+            lat, lng = rng.uniform(-1.45, -1.15), rng.uniform(36.65, 37.0)
+            self.assertEqual(zone.contains(lat, lng), point_in_polygon(lat, lng, polygon), (lat, lng))
+
+    def test_trip_within_an_outer_zone_is_not_within_nairobi(self):
+        zones = [
+            {'name': 'nairobi', 'price': 150, 'polygon': [(-1.5, 36.6), (-1.5, 37.0), (-1.1, 37.0), (-1.1, 36.6)],
+             'within_nairobi': True},
+            {'name': 'kiambu', 'price': 250, 'polygon': [(-1.1, 36.6), (-1.1, 37.0), (-0.9, 37.0), (-0.9, 36.6)]},
+        ]
+        engine = PricingEngine(zones, [], 300, 0.01)
+        outer = engine.quote(-1.05, 36.80, -0.95, 36.90)
+        self.assertEqual((outer.price, outer.pickup_zone, outer.is_within_nairobi), (Decimal('250'), 'kiambu', False))
+        inner = engine.quote(-1.29, 36.82, -1.26, 36.80)
+        self.assertEqual((inner.price, inner.is_within_nairobi), (Decimal('150'), True))
+        self.assertFalse(engine.quote(-1.29, 36.82, -0.95, 36.90).is_within_nairobi)
+
+    @override_settings(PRICING_DISTANCE_BANDS=[(20, 250), (50, 400)], PRICING_OUTSIDE_NAIROBI=600)
+    def test_bulk_quotes_use_distance_bands(self):
+        trip = {'pickup_latitude': '-1.290000', 'pickup_longitude': '36.820000'}
+        with mock.patch('pakahome.outbound.UpstreamClient.get') as upstream:
+            response = self.client.post('/api/orders/quotes/', {'trips': [
+                dict(trip, delivery_latitude='-1.260000', delivery_longitude='36.800000'),  # same zone
+                dict(trip, delivery_latitude='-1.050000', delivery_longitude='37.080000'),  # ~40 km
+                dict(trip, delivery_latitude='-0.300000', delivery_longitude='36.070000'),  # Nakuru
+            ]}, format='json')
+        upstream.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([quote['price'] for quote in response.data['quotes']], ['150', '400', '600'])
+        self.assertEqual(response.data['quotes'][0]['pickup_zone'], 'nairobi')
+        self.assertIsNone(response.data['quotes'][2]['delivery_zone'])
+
+    def test_bulk_quotes_reject_bad_input(self):
+        self.assertEqual(self.client.post('/api/orders/quotes/', {'trips': []}, format='json').status_code, 400)
+        response = self.client.post('/api/orders/quotes/', {'pickup_latitude': '95'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkImportTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(
+            phone_number='254700000130', email='shipper@test.pakahome.local', password='1234', role='customer'
+        )
+        self.customer = Customer.objects.create(user=user)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def row(self, **fields):
+        base = {
+            'pickup_name': 'Warehouse', 'pickup_phone': '254700000131', 'pickup_address': 'Industrial Area, Nairobi',
+            'pickup_latitude': '-1.3100001', 'pickup_longitude': '36.8500009',
+            'delivery_name': 'Shop', 'delivery_phone': '254700000132', 'delivery_address': 'Westlands, Nairobi',
+            'delivery_latitude': '-1.2640', 'delivery_longitude': '36.8030',
+        }
+        base.update(fields)
+        return {key: value for key, value in base.items() if value is not None}
+
+    def test_partial_failure_geocodes_each_address_once(self):
+        rows = [
+            self.row(),
+            self.row(delivery_address='Kajiado', delivery_latitude=None, delivery_longitude=None),
+            self.row(delivery_address='  kajiado, Kenya', delivery_latitude=None, delivery_longitude=None),
+            self.row(delivery_phone=None),
+        ]
+        with mock.patch('orders.bulk_import.geocode_address', return_value=(-1.8520, 36.7760)) as geocode_address:
+            # savepoint, orders, tracking logs, summary update + savepoint, insert, release (a new day's bucket), release
+            with self.assertNumQueries(8):
+                response = self.client.post('/api/orders/import/', {'orders': rows}, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(geocode_address.call_count, 1)
+        self.assertEqual((response.data['created'], response.data['failed']), (3, 1))
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'created', 'created', 'failed'])
+        self.assertIn('delivery_phone', results[3]['errors'])
+        self.assertEqual(results[0]['price'], '150.00')
+        self.assertEqual(results[1]['price'], '300.00')  # Kajiado is outside the Nairobi zone
+
+        order = Order.objects.get(id=results[1]['order_id'])
+        self.assertEqual(order.tracking_code, results[1]['tracking_code'])
+        self.assertEqual(order.delivery_latitude, Decimal('-1.852000'))
+        self.assertEqual(order.pickup_latitude, Decimal('-1.310000'))
+        self.assertEqual(list(order.tracking_logs.values_list('status', flat=True)), ['pending_payment'])
+        summary = OrderDailySummary.objects.get()
+        self.assertEqual((summary.status, summary.orders, summary.value), ('pending_payment', 3, Decimal('750.00')))
+
+    def test_csv_upload_streams_ndjson(self):
+        header = 'pickup_name,pickup_phone,pickup_address,delivery_name,delivery_phone,delivery_address,' \
+                 'pickup_latitude,pickup_longitude,delivery_latitude,delivery_longitude\n'
+        body = header + ''.join(
+            f'W{i},254700000131,Industrial Area,S{i},254700000132,Westlands,-1.31,36.85,-1.26,36.80\n' for i in range(5)
+        )
+        upload = SimpleUploadedFile('orders.csv', body.encode('utf-8'), content_type='text/csv')
+        with self.settings(ORDER_IMPORT_CHUNK_SIZE=2):
+            response = self.client.post('/api/orders/import/?stream=true', {'file': upload}, format='multipart')
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([line['row'] for line in lines[:-1]], [1, 2, 3, 4, 5])
+        self.assertEqual(lines[-1], {'summary': {'created': 5, 'failed': 0}})
+        self.assertEqual(Order.objects.filter(customer=self.customer).count(), 5)
+
+    def test_non_numeric_coordinate_fails_only_its_row(self):
+        rows = [self.row(), self.row(pickup_latitude='n/a'), self.row(delivery_longitude={'lng': 36.8}), self.row()]
+        response = self.client.post('/api/orders/import/', {'orders': rows}, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 2))
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'failed', 'failed', 'created'])
+        self.assertIn('pickup_latitude', results[1]['errors'])
+        self.assertIn('delivery_longitude', results[2]['errors'])
+
+    def test_unreadable_csv_fails_a_row_not_the_request(self):
+        header = 'pickup_name,pickup_phone,pickup_address,delivery_name,delivery_phone,delivery_address,' \
+                 'pickup_latitude,pickup_longitude,delivery_latitude,delivery_longitude\n'
+        body = header + 'W1,254700000131,Industrial Area,S1,254700000132,Westlands,-1.31,36.85,-1.26,36.80\n' \
+                      + 'W2,254700000131,Caf\u00e9 Deli,S2,254700000132,Westlands,-1.31,36.85,-1.26,36.80\n'
+        upload = SimpleUploadedFile('orders.csv', body.encode('cp1252'), content_type='text/csv')
+        response = self.client.post('/api/orders/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 1))
+        failure = response.data['results'][1]
+        self.assertEqual((failure['row'], failure['status']), (2, 'failed'))
+        self.assertIn('Line 3 is not UTF-8', failure['errors']['non_field_errors'][0])
+
+        upload = SimpleUploadedFile('orders.csv', header.encode('utf-8') + b'W1,' + b'x' * 200000 + b'\n',
+                                    content_type='text/csv')
+        response = self.client.post('/api/orders/import/?stream=true', {'file': upload}, format='multipart')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertIn('Line 2: field larger than field limit', lines[0]['errors']['non_field_errors'][0])
+        self.assertEqual(lines[-1], {'summary': {'created': 0, 'failed': 1}})
+
+    def test_only_customers_import(self):
+        driver_user = User.objects.create_user(
+            phone_number='254700000133', email='import-driver@test.pakahome.local', password='1234', role='driver'
+        )
+        self.client.force_authenticate(driver_user)
+        response = self.client.post('/api/orders/import/', {'orders': [self.row()]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class TrackingDocumentTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(
+            phone_number='254700000150', email='tracking@test.pakahome.local', password='1234', role='customer'
+        )
+        customer = Customer.objects.create(user=user, full_name='Tracking Customer', phone='254700000150',
+                                           email='tracking@test.pakahome.local')
+        driver_user = User.objects.create_user(
+            phone_number='254700000151', email='tracking-driver@test.pakahome.local', password='1234', role='driver'
+        )
+        self.driver = Driver.objects.create(user=driver_user, full_name='Tracking Driver', phone='254700000151',
+                                            license_number='DL150', status='busy', is_active=True)
+        self.order = Order.objects.create(
+            customer=customer, driver=self.driver,
+            pickup_name='A', pickup_phone='254700000152', pickup_address='Westlands',
+            delivery_name='B', delivery_phone='254700000153', delivery_address='Kilimani',
+            price=Decimal('150'), status='assigned',
+        )
+        self.url = f'/api/orders/tracking/{self.order.tracking_code}/'
+
+    def test_hit_makes_no_queries_and_leaves_out_customer(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=second['ETag'])
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(not_modified.status_code, 304)
+
+        payload = second.json()
+        self.assertNotIn('customer', payload)
+        self.assertNotIn('254700000151', second.content.decode())  # driver phone
+        self.assertNotIn('tracking@test.pakahome.local', second.content.decode())
+        self.assertEqual(payload['driver'], {'full_name': 'Tracking Driver', 'vehicle_type': '',
+                                             'vehicle_registration': ''})
+
+    def test_changes_rebuild_the_document(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.status = 'picked_up'
+            self.order.save()
+            OrderTracking.objects.create(order=self.order, status='picked_up', description='Collected')
+        with self.assertNumQueries(0):  # rebuilt on commit, not on the next read
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'picked_up')
+        self.assertEqual(response.json()['tracking_logs'][0]['description'], 'Collected')
+
+        self.driver.full_name = 'Renamed Driver'
+        self.driver.save()
+        self.assertEqual(self.client.get(self.url).json()['driver']['full_name'], 'Renamed Driver')
+
+    def test_miss_fill_does_not_overwrite_a_committed_change(self):
+        from . import tracking
+
+        real_build = tracking.build_document
+        builds = []
+
+        def build_then_commit(tracking_code):
+            # The reader's rows predate the status change, which commits before it stores them
+            document = real_build(tracking_code)
+            if not builds:
+                builds.append(document)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.order.status = 'picked_up'
+                    self.order.save()
+            return document
+
+        with mock.patch('orders.tracking.build_document', side_effect=build_then_commit):
+            stale = tracking.get_document(self.order.tracking_code)
+        self.assertEqual(json.loads(stale['body'])['status'], 'assigned')
+        self.assertEqual(self.client.get(self.url).json()['status'], 'picked_up')
+
+    def test_deleted_log_and_payment_leave_the_document(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            log = OrderTracking.objects.create(order=self.order, status='assigned', description='Assigned')
+            payment = Payment.objects.create(order=self.order, customer=self.order.customer,
+                                             phone_number='254700000150', amount=self.order.price, status='completed')
+        document = self.client.get(self.url).json()
+        self.assertEqual((len(document['tracking_logs']), document['payment_status']), (1, 'completed'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            log.delete()
+            payment.delete()
+        document = self.client.get(self.url).json()
+        self.assertEqual(document['tracking_logs'], [])
+        self.assertNotEqual(document['payment_status'], 'completed')
+
+    def test_unknown_code(self):
+        self.assertEqual(self.client.get('/api/orders/tracking/PAKANOPE/').status_code, 404)
+
+
+class CursorPaginationTestCase(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            phone_number='254700000160', email='pages-admin@test.pakahome.local', password='1234', role='admin'
+        )
+        user = User.objects.create_user(
+            phone_number='254700000161', email='pages@test.pakahome.local', password='1234', role='customer'
+        )
+        self.customer = Customer.objects.create(user=user, full_name='Pages Customer', phone='254700000161')
+        created = timezone.now() - timedelta(days=1)
+        orders = Order.objects.bulk_create([
+            Order(customer=self.customer, tracking_code=f'PAKAPG{i:04d}',
+                  pickup_name='A', pickup_phone='254700000161', pickup_address='Westlands',
+                  delivery_name='B', delivery_phone='254700000162', delivery_address='Kilimani',
+                  price=Decimal('150'), status='pending_payment')
+            for i in range(45)
+        ])
+        # Every order shares one created_at: pages must still be stable on the id tie-break
+        Order.objects.update(created_at=created)
+        Payment.objects.bulk_create([
+            Payment(order=order, customer=self.customer, phone_number='254700000161', amount=order.price)
+            for order in orders
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def walk(self, url):
+        seen, pages, budgets = [], 0, set()
+        while url:
+            with self.assertQueryBudget(10) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            self.assertFalse(any('COUNT(*)' in query['sql'] or 'OFFSET' in query['sql']
+                                 for query in queries.captured_queries))
+            budgets.add(len(queries.captured_queries))
+            seen.extend(row['id'] for row in response.data['results'])
+            self.last_previous = response.data['previous']
+            url = response.data['next']
+            pages += 1
+        return seen, pages, budgets
+
+    def test_pages_cover_every_row_once_at_a_constant_cost(self):
+        for url, expected in (('/api/orders/?page_size=10', Order), ('/api/payments/?page_size=10', Payment)):
+            seen, pages, budgets = self.walk(url)
+            self.assertEqual(pages, 5)
+            self.assertEqual(len(budgets), 1)  # the last page costs what the first does
+            self.assertEqual(seen, list(expected.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+            previous = self.client.get(self.last_previous).data  # back from the last page
+            self.assertEqual([row['id'] for row in previous['results']], seen[30:40])
+            self.assertIsNotNone(previous['next'])
+
+
+class QueryPlanTestCase(QueryPlanMixin, TestCase):
+    """The hot order queries must walk an index, not scan or sort the table"""
+
+    def setUp(self):
+        customers, drivers = [], []
+        for i in range(20):
+            user = User.objects.create_user(
+                phone_number=f'2547002{i:05d}', email=f'plan-customer{i}@test.pakahome.local', password='1234', role='customer'
+            )
+            customers.append(Customer.objects.create(user=user, full_name=f'Plan Customer {i}', phone=f'2547002{i:05d}'))
+        for i in range(10):
+            user = User.objects.create_user(
+                phone_number=f'2547003{i:05d}', email=f'plan-driver{i}@test.pakahome.local', password='1234', role='driver'
+            )
+            drivers.append(Driver.objects.create(user=user, full_name=f'Plan Driver {i}', phone=f'2547003{i:05d}',
+                                                 license_number=f'DLP{i}'))
+        # Mostly finished orders, as in production: a few pending and open ones
+        statuses = ['delivered'] * 90 + ['cancelled'] * 4 + ['pending_assignment'] * 2 + list(Order.OPEN_STATUSES)
+        orders = Order.objects.bulk_create([
+            Order(customer=customers[i % 20], driver=drivers[i % 10] if statuses[i % 100] != 'pending_assignment' else None,
+                  tracking_code=f'PKPLAN{i:06d}', status=statuses[i % 100],
+                  pickup_name='A', pickup_phone='254700000041', pickup_address='Westlands',
+                  pickup_latitude=Decimal('-1.2676'), pickup_longitude=Decimal('36.8108'),
+                  delivery_name='B', delivery_phone='254700000042', delivery_address='Kilimani',
+                  price=Decimal('150'))
+            for i in range(3000)
+        ])
+        OrderTracking.objects.bulk_create([
+            OrderTracking(order=order, status=order.status) for order in orders for _ in range(2)
+        ])
+        Payment.objects.bulk_create([
+            Payment(order=order, customer=order.customer, phone_number='254700000041', amount=order.price)
+            for order in orders
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.customer, self.driver, self.order = customers[3], drivers[4], orders[1234]
+
+    def test_hot_queries_use_their_indexes(self):
+        newest_first = ('-created_at', '-id')
+        after = Q(created_at__lt=self.order.created_at) | Q(created_at=self.order.created_at, id__lt=self.order.id)
+        cases = [
+            # Cursor pages of each role's order and payment lists
+            (Order.objects.order_by(*newest_first)[:21], 'order_created_at_id_idx'),
+            (Order.objects.filter(after, created_at__lte=self.order.created_at).order_by(*newest_first)[:21],
+             'order_created_at_id_idx'),
+            (Order.objects.filter(customer=self.customer).order_by(*newest_first)[:21], 'order_customer_created_idx'),
+            (Order.objects.filter(driver=self.driver).order_by(*newest_first)[:21], 'order_driver_created_idx'),
+            (Payment.objects.filter(customer=self.customer).order_by(*newest_first)[:21], 'payment_customer_created_idx'),
+            # Dispatch queue and a driver's open orders (route, tracking rebuilds)
+            (Order.objects.filter(status='pending_assignment', pickup_latitude__isnull=False,
+                                  pickup_longitude__isnull=False).order_by('created_at')[:100],
+             'order_pending_created_idx'),
+            (Order.objects.filter(driver=self.driver, status__in=Order.OPEN_STATUSES).order_by('created_at'),
+             'order_driver_created_idx'),
+            # Tracking page and ?updated_since= sync
+            (Order.objects.filter(tracking_code=self.order.tracking_code), None),
+            (self.order.tracking_logs.all(), 'tracking_order_created_idx'),
+            (Order.objects.filter(updated_at__gt=self.order.updated_at).order_by('updated_at', 'id')[:100],
+             'order_updated_at_id_idx'),
+        ]
+        for queryset, index_name in cases:
+            with self.subTest(index=index_name, sql=str(queryset.query)):
+                self.assertUsesIndex(queryset, index_name)
+
+
+class OrderSummaryTestCase(TestCase):
+    """The dashboard summary must always equal a rebuild from the orders table"""
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            phone_number='254700000170', email='summary-admin@test.pakahome.local', password='1234', role='admin'
+        )
+        customer_user = User.objects.create_user(
+            phone_number='254700000171', email='summary-customer@test.pakahome.local', password='1234', role='customer'
+        )
+        self.customer = Customer.objects.create(user=customer_user, full_name='Summary Customer', phone='254700000171')
+        driver_user = User.objects.create_user(
+            phone_number='254700000172', email='summary-driver@test.pakahome.local', password='1234', role='driver'
+        )
+        self.driver = Driver.objects.create(user=driver_user, full_name='Summary Driver', phone='254700000172',
+                                            license_number='DLS1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_order(self, price='150'):
+        order = Order.objects.create(
+            customer=self.customer, pickup_name='A', pickup_phone='254700000171', pickup_address='Westlands',
+            delivery_name='B', delivery_phone='254700000172', delivery_address='Kilimani', price=Decimal(price),
+        )
+        payment = Payment.objects.create(order=order, customer=self.customer, phone_number='254700000171',
+                                         amount=order.price)
+        return order, payment
+
+    def buckets(self):
+        return sorted(
+            (row.day, row.status, row.driver_id, row.orders, row.value, row.paid_orders, row.revenue)
+            for row in OrderDailySummary.objects.exclude(orders=0)
+        )
+
+    def assertMatchesRebuild(self):
+        incremental = self.buckets()
+        rebuild()
+        self.assertEqual(incremental, self.buckets())
+        return incremental
+
+    def test_buckets_follow_order_lifecycle(self):
+        today = timezone.localdate()
+        order, payment = self.create_order()
+        other, _ = self.create_order('300')
+        self.assertEqual(self.assertMatchesRebuild(),
+                         [(today, 'pending_payment', None, 2, Decimal('450.00'), 0, Decimal('0.00'))])
+
+        payment.status = 'completed'  # as the M-Pesa webhook does: payment first, then the order
+        payment.save()
+        order.status = 'pending_assignment'
+        order.save()
+        self.assertMatchesRebuild()
+
+        order.driver, order.status = self.driver, 'assigned'
+        order.save()
+        order.status = 'delivered'
+        order.save()
+        order.save()  # no change, no writes to the summary
+        self.assertEqual(self.assertMatchesRebuild(), [
+            (today, 'delivered', self.driver.id, 1, Decimal('150.00'), 1, Decimal('150.00')),
+            (today, 'pending_payment', None, 1, Decimal('300.00'), 0, Decimal('0.00')),
+        ])
+
+        order.delete()
+        other.delete()
+        self.assertEqual(self.assertMatchesRebuild(), [])
+
+    def test_stats_come_from_one_query(self):
+        order, payment = self.create_order()
+        payment.status = 'completed'
+        payment.save()
+        order.driver, order.status = self.driver, 'in_transit'
+        order.save()
+        self.create_order('300')
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/orders/stats/?days=3')
+        self.assertEqual(response.status_code, 200)
+        totals = response.data['totals']
+        self.assertEqual((totals['orders'], totals['today'], totals['in_transit'], totals['revenue']), (2, 2, 1, '150.00'))
+        self.assertEqual(response.data['by_status']['pending_payment'], 1)
+        self.assertEqual([day['orders'] for day in response.data['days']], [0, 0, 2])
+        self.assertEqual(response.data['days'][-1], {'day': timezone.localdate().isoformat(), 'orders': 2,
+                                                     'revenue': '150.00'})
+        self.assertEqual(response.data['drivers'], [{'id': self.driver.id, 'full_name': 'Summary Driver', 'orders': 1,
+                                                     'delivered': 0, 'in_progress': 1}])
+
+        self.assertEqual(self.client.get('/api/orders/stats/?days=0').status_code, 400)
+        self.client.force_authenticate(self.customer.user)
+        self.assertEqual(self.client.get('/api/orders/stats/').status_code, 403)
+
+    def test_buckets_after_today_count_in_totals_only(self):
+        order, _ = self.create_order()
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() + timedelta(days=2))
+        rebuild()
+        response = self.client.get('/api/orders/stats/?days=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['totals']['orders'], 1)
+        self.assertEqual([day['orders'] for day in response.data['days']], [0, 0, 0])
+
+    def test_rebuild_command_fixes_sql_updates(self):
+        order, _ = self.create_order()
+        Order.objects.filter(pk=order.pk).update(status='cancelled')  # no signals
+        self.assertEqual(self.buckets()[0][1], 'pending_payment')
+        call_command('rebuild_order_summary', since=timezone.localdate().isoformat(), stdout=io.StringIO())
+        self.assertEqual([bucket[1] for bucket in self.buckets()], ['cancelled'])
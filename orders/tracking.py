@@ -0,0 +1,80 @@
+"""
+Public tracking read model.
+
+Each order has one small, pre-rendered JSON document (TrackingSerializer)
+in the cache under its tracking code, together with its ETag. A request
+for a cached document makes no database queries and is answered with the
+stored bytes, or 304 when the client's copy is current.
+
+Documents are written on first request and whenever the order, one of its
+tracking logs, its payment or its driver is saved. They are dropped right
+away and rebuilt once the transaction commits, so a page never shows a
+status older than the last committed change. A miss is filled only if no
+document was stored meanwhile: the reader may have read the rows before a
+change committed, and must not overwrite that change's rebuild.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import quote_etag
+from rest_framework.renderers import JSONRenderer
+
+from pakahome.cache import CACHE_ERRORS
+from .models import Order
+from .serializers import TrackingSerializer
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_PREFIX = 'tracking:v1:'
+
+
+def document_key(tracking_code):
+    return DOCUMENT_PREFIX + tracking_code
+
+
+def build_document(tracking_code):
+    """{'body': JSON bytes, 'etag'} from the database, or None for an unknown code"""
+    order = TrackingSerializer.setup_eager_loading(Order.objects.filter(tracking_code=tracking_code)).first()
+    if order is None:
+        return None
+    body = JSONRenderer().render(TrackingSerializer(order).data)
+    return {'body': body, 'etag': quote_etag(hashlib.sha1(body).hexdigest())}
+
+
+def _store(tracking_code, document, if_missing=False):
+    try:
+        if document is None:
+            cache.delete(document_key(tracking_code))
+        elif if_missing:
+            cache.add(document_key(tracking_code), document, settings.TRACKING_DOCUMENT_TTL)
+        else:
+            cache.set(document_key(tracking_code), document, settings.TRACKING_DOCUMENT_TTL)
+    except CACHE_ERRORS:
+        logger.warning(f'Cache unavailable; tracking document {tracking_code} not stored', exc_info=True)
+
+
+def get_document(tracking_code):
+    """The cached document, built on a miss; None for an unknown code"""
+    try:
+        document = cache.get(document_key(tracking_code))
+    except CACHE_ERRORS:
+        logger.warning('Cache unavailable; building tracking document', exc_info=True)
+        return build_document(tracking_code)
+    if document is None:
+        document = build_document(tracking_code)
+        if document is not None:
+            _store(tracking_code, document, if_missing=True)
+    return document
+
+
+def rebuild(tracking_code):
+    _store(tracking_code, build_document(tracking_code))
+
+
+def document_changed(tracking_code):
+    """Drop the document now and write the committed state after commit"""
+    _store(tracking_code, None)
+    transaction.on_commit(lambda: rebuild(tracking_code))
@@ -1,9 +1,14 @@
 from django.urls import path
 from . import views
+from .event_views import order_events
 
 urlpatterns = [
     path('', views.OrderListCreateView.as_view(), name='order_list_create'),
     path('<int:id>/', views.OrderDetailView.as_view(), name='order_detail'),
+    path('events/', order_events, name='order_events'),
+    path('quotes/', views.price_quotes, name='price_quotes'),
+    path('import/', views.import_orders, name='import_orders'),
+    path('stats/', views.order_stats, name='order_stats'),
     path('tracking/<str:tracking_code>/', views.track_order, name='track_order'),
     path('<int:order_id>/status/', views.update_order_status, name='update_order_status'),
 ]
@@ -4,16 +4,26 @@ from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from django.db.models import Q
 from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from functools import partial
+import json
 from .models import Order, OrderTracking
-from .serializers import OrderSerializer, OrderCreateSerializer
+from .serializers import OrderSerializer, OrderCreateSerializer, OrderListSerializer, PriceQuoteSerializer
+from .bulk_import import OrderImporter, csv_rows
+from .conditional import conditional_response, etag_matches, orders_etag
+from .events import publish_order_event
+from .sync import changes_response
+from .tracking import get_document
+from .pricing import pricing_engine
+from .summary import DEFAULT_DAYS, MAX_DAYS, dashboard
 from .services import calculate_price, geocode_address, create_tracking_log
 from users.models import Customer, Driver
-from notifications.services import send_sms_notification
+from notifications.services import queue_sms_notification
 
 
 class OrderListCreateView(generics.ListCreateAPIView):
-    """List and create orders"""
-    serializer_class = OrderSerializer
+    """List (compact rows, ?fields=... to choose columns) and create orders"""
+    serializer_class = OrderListSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
@@ -21,23 +31,35 @@ class OrderListCreateView(generics.ListCreateAPIView):
         if user.role == 'customer':
             try:
                 customer = user.customer_profile
-                return Order.objects.filter(customer=customer).select_related('customer', 'driver').prefetch_related('tracking_logs').order_by('-created_at')
+                orders = Order.objects.filter(customer=customer)
             except (Customer.DoesNotExist, AttributeError):
                 return Order.objects.none()
         elif user.role == 'admin':
-            return Order.objects.all().select_related('customer', 'driver', 'payment').prefetch_related('tracking_logs').order_by('-created_at')
+            orders = Order.objects.all()
         elif user.role == 'driver':
             try:
                 driver = user.driver_profile
-                return Order.objects.filter(driver=driver).select_related('customer', 'driver').prefetch_related('tracking_logs').order_by('-created_at')
+                orders = Order.objects.filter(driver=driver)
             except Driver.DoesNotExist:
                 return Order.objects.none()
-        return Order.objects.none()
+        else:
+            return Order.objects.none()
+        return OrderListSerializer.setup_eager_loading(orders, self.request).order_by('-created_at')
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return OrderCreateSerializer
-        return OrderSerializer
+        return OrderListSerializer
+    
+    def list(self, request, *args, **kwargs):
+        """
+        ?updated_since=<cursor> returns only changes since that cursor (see orders.sync);
+        otherwise answer 304 when nothing in the caller's orders changed since their ETag
+        """
+        if 'updated_since' in request.query_params:
+            return changes_response(request, self.filter_queryset(self.get_queryset()), OrderListSerializer)
+        etag = orders_etag(request, self.filter_queryset(self.get_queryset()))
+        return conditional_response(request, etag, partial(super().list, request, *args, **kwargs))
     
     def create(self, request, *args, **kwargs):
         """Override create to handle order creation with proper response"""
@@ -76,7 +98,7 @@ class OrderListCreateView(generics.ListCreateAPIView):
         pickup_lat = serializer.validated_data.get('pickup_latitude')
         pickup_lng = serializer.validated_data.get('pickup_longitude')
         if not pickup_lat or not pickup_lng:
-            lat, lng = geocode_address(serializer.validated_data['pickup_address'])
+            lat, lng = geocode_address(serializer.validated_data['pickup_address'], interactive=True)
             if lat and lng:
                 # Round to 6 decimal places
                 pickup_lat = Decimal(str(lat)).quantize(Decimal('0.000001'), rounding=ROUND_DOWN)
@@ -87,7 +109,7 @@ class OrderListCreateView(generics.ListCreateAPIView):
         delivery_lat = serializer.validated_data.get('delivery_latitude')
         delivery_lng = serializer.validated_data.get('delivery_longitude')
         if not delivery_lat or not delivery_lng:
-            lat, lng = geocode_address(serializer.validated_data['delivery_address'])
+            lat, lng = geocode_address(serializer.validated_data['delivery_address'], interactive=True)
             if lat and lng:
                 # Round to 6 decimal places
                 delivery_lat = Decimal(str(lat)).quantize(Decimal('0.000001'), rounding=ROUND_DOWN)
@@ -133,33 +155,157 @@ class OrderDetailView(generics.RetrieveUpdateAPIView):
         if user.role == 'customer':
             try:
                 customer = user.customer_profile
-                return Order.objects.filter(customer=customer)
+                orders = Order.objects.filter(customer=customer)
             except Customer.DoesNotExist:
                 return Order.objects.none()
         elif user.role == 'admin':
-            return Order.objects.all()
+            orders = Order.objects.all()
         elif user.role == 'driver':
             try:
                 driver = user.driver_profile
-                return Order.objects.filter(driver=driver)
+                orders = Order.objects.filter(driver=driver)
             except Driver.DoesNotExist:
                 return Order.objects.none()
-        return Order.objects.none()
+        else:
+            return Order.objects.none()
+        return OrderSerializer.setup_eager_loading(orders)
+    
+    def retrieve(self, request, *args, **kwargs):
+        etag = orders_etag(request, self.get_queryset().filter(id=kwargs['id']))
+        return conditional_response(request, etag, partial(super().retrieve, request, *args, **kwargs))
 
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def track_order(request, tracking_code):
-    """Public endpoint to track order by tracking code"""
-    try:
-        order = Order.objects.select_related('customer', 'driver').prefetch_related('tracking_logs').get(tracking_code=tracking_code)
-        serializer = OrderSerializer(order)
-        return Response(serializer.data)
-    except Order.DoesNotExist:
+    """Public endpoint to track order by tracking code (served from the tracking read model)"""
+    document = get_document(tracking_code)
+    if document is None:
         return Response(
             {'error': 'Order not found'}, 
             status=status.HTTP_404_NOT_FOUND
         )
+    
+    if etag_matches(request, document['etag']):
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = HttpResponse(document['body'], content_type='application/json')
+    response['ETag'] = document['etag']
+    # Public: no customer details; clients must still revalidate every time
+    response['Cache-Control'] = 'public, no-cache'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def price_quotes(request):
+    """Price trips without creating orders ({"trips": [...]} or one trip)"""
+    trips = request.data.get('trips') if 'trips' in request.data else [request.data]
+    if not isinstance(trips, list) or not trips:
+        return Response(
+            {'error': 'trips must be a non-empty list'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(trips) > settings.PRICING_MAX_QUOTES:
+        return Response(
+            {'error': f'At most {settings.PRICING_MAX_QUOTES} trips per request'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    serializer = PriceQuoteSerializer(data=trips, many=True)
+    serializer.is_valid(raise_exception=True)
+    quotes = pricing_engine().quote_many([
+        (trip['pickup_latitude'], trip['pickup_longitude'], trip['delivery_latitude'], trip['delivery_longitude'])
+        for trip in serializer.validated_data
+    ])
+    return Response({'quotes': [quote.as_dict() for quote in quotes]})
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def import_orders(request):
+    """
+    Create many orders at once from a JSON array ({"orders": [...]} or a bare list)
+    or a CSV upload in the "file" field, with one result per row. Invalid rows are
+    reported and skipped. ?stream=true (or Accept: application/x-ndjson) streams
+    the results as NDJSON while the import runs, ending with a summary line.
+    """
+    if request.user.role != 'customer':
+        return Response(
+            {'error': 'Only customers can create orders'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    try:
+        customer = request.user.customer_profile
+    except Customer.DoesNotExist:
+        return Response(
+            {'error': 'Customer profile not found. Please complete your registration.'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    if 'file' in request.FILES:
+        rows = csv_rows(request.FILES['file'])
+    else:
+        rows = request.data.get('orders') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list) or not rows:
+            return Response(
+                {'error': 'Send a non-empty orders list or a CSV file'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(rows) > settings.ORDER_IMPORT_MAX_ROWS:
+            return Response(
+                {'error': f'At most {settings.ORDER_IMPORT_MAX_ROWS} rows per import'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    importer = OrderImporter(customer)
+    if (request.query_params.get('stream') == 'true'
+            or 'application/x-ndjson' in request.META.get('HTTP_ACCEPT', '')):
+        def lines():
+            for result in importer.run(rows):
+                yield json.dumps(result) + '\n'
+            yield json.dumps({'summary': importer.summary()}) + '\n'
+        
+        response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    results = list(importer.run(rows))
+    summary = importer.summary()
+    if not summary['failed']:
+        response_status = status.HTTP_201_CREATED
+    elif summary['created']:
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_400_BAD_REQUEST
+    return Response(dict(summary, results=results), status=response_status)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def order_stats(request):
+    """
+    Admin dashboard figures from the daily summary table: totals, orders per
+    status and per driver, and orders and revenue for each of the last ?days=
+    days (default 7, up to 90). One query, however many orders there are.
+    """
+    if request.user.role != 'admin':
+        return Response(
+            {'error': 'Only admins can view order stats'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    try:
+        days = int(request.query_params.get('days', DEFAULT_DAYS))
+    except ValueError:
+        days = 0
+    if not 1 <= days <= MAX_DAYS:
+        return Response(
+            {'error': f'days must be a whole number from 1 to {MAX_DAYS}'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return Response(dashboard(days))
 
 
 @api_view(['POST'])
@@ -219,15 +365,16 @@ def update_order_status(request, order_id):
     
     # Create tracking log
     create_tracking_log(order, new_status, description)
+    publish_order_event('order.status', order, previous_status=old_status)
     
-    # Send SMS notifications
+    # Queue SMS notifications (sent by the outbox worker)
     if new_status == 'picked_up':
-        send_sms_notification(
+        queue_sms_notification(
             order.customer.phone,
             f"Your order {order.tracking_code} has been picked up and is on the way!"
         )
     elif new_status == 'delivered':
-        send_sms_notification(
+        queue_sms_notification(
             order.customer.phone,
             f"Your order {order.tracking_code} has been delivered successfully. Thank you!"
         )
@@ -0,0 +1,123 @@
+"""
+Shared cache helpers.
+
+CACHES['default'] is Redis when CACHE_REDIS_URL is set, so every web and
+Celery process sees the same entries; otherwise it is per-process memory.
+
+Keys are namespaced and versioned: key('drivers', ...) embeds the current
+generation of the 'drivers' namespace, and invalidate('drivers') bumps it,
+so every entry under it becomes unreachable at once and simply expires.
+Generations start from the clock, so a namespace whose counter was evicted
+never comes back to an old generation.
+
+A cache outage only costs speed: reads miss and writes are dropped.
+"""
+from functools import wraps
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from redis.exceptions import RedisError
+from rest_framework.response import Response
+
+from orders.conditional import etag_matches
+
+logger = logging.getLogger(__name__)
+
+GENERATION_PREFIX = 'generation:'
+CACHED_HEADERS = ('ETag', 'Cache-Control')
+CACHE_ERRORS = (RedisError, OSError)
+
+
+def generation(namespace):
+    generation_key = GENERATION_PREFIX + namespace
+    current = cache.get(generation_key)
+    if current is None:
+        cache.add(generation_key, time.time_ns(), None)
+        current = cache.get(generation_key, 0)
+    return current
+
+
+def key(namespace, *parts):
+    """Versioned key for `parts` in `namespace`"""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'{namespace}:{generation(namespace)}:{digest}'
+
+
+def invalidate(*namespaces):
+    """Drop every entry under these namespaces"""
+    for namespace in namespaces:
+        generation_key = GENERATION_PREFIX + namespace
+        try:
+            try:
+                cache.incr(generation_key)
+            except ValueError:  # not set yet, or evicted
+                cache.set(generation_key, time.time_ns(), None)
+        except CACHE_ERRORS:
+            logger.warning(f'Cache unavailable; could not invalidate {namespace}', exc_info=True)
+
+
+def invalidate_on_commit(*namespaces):
+    """
+    Invalidate now and again once the current transaction commits, so a read
+    racing the write cannot re-cache the old rows under the new generation
+    """
+    invalidate(*namespaces)
+    transaction.on_commit(lambda: invalidate(*namespaces))
+
+
+def lookup(namespace, *parts):
+    """(key, value or None); the key is None when the cache is unreachable"""
+    try:
+        entry_key = key(namespace, *parts)
+        return entry_key, cache.get(entry_key)
+    except CACHE_ERRORS:
+        logger.warning('Cache unavailable; serving uncached', exc_info=True)
+        return None, None
+
+
+def store(entry_key, value, timeout):
+    try:
+        cache.set(entry_key, value, timeout)
+    except CACHE_ERRORS:
+        logger.warning('Cache unavailable; response not cached', exc_info=True)
+
+
+def cache_response(namespace, timeout=None, vary_on_role=False):
+    """
+    Cache 200 responses of a DRF function view under `namespace` (a string, or
+    a callable taking the view's arguments), keyed by full path and optionally
+    the caller's role. Put it below @api_view/@permission_classes so checks
+    still run. Cached ETags are honoured with 304s.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            name = namespace(request, *args, **kwargs) if callable(namespace) else namespace
+            parts = [request.get_full_path()]
+            if vary_on_role:
+                parts.append(getattr(request.user, 'role', ''))
+            entry_key, entry = lookup(name, *parts)
+            if entry is not None:
+                etag = entry['headers'].get('ETag')
+                if etag and etag_matches(request, etag):
+                    response = Response(status=304)
+                else:
+                    response = Response(entry['data'])
+                for header, value in entry['headers'].items():
+                    response[header] = value
+                response['X-Cache'] = 'HIT'
+                return response
+
+            response = view(request, *args, **kwargs)
+            if entry_key is not None and response.status_code == 200 and getattr(response, 'data', None) is not None:
+                headers = {header: response[header] for header in CACHED_HEADERS if response.has_header(header)}
+                store(entry_key, {'data': response.data, 'headers': headers},
+                      settings.RESPONSE_CACHE_TIMEOUT if timeout is None else timeout)
+                response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,15 @@
+"""
+Celery application for pakahome.
+
+Start a worker (and the beat scheduler for periodic jobs) with:
+    celery -A pakahome worker -B -l info
+"""
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pakahome.settings')
+
+app = Celery('pakahome')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
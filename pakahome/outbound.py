@@ -0,0 +1,281 @@
+"""
+Shared outbound HTTP layer for third-party integrations.
+
+Each upstream in settings.OUTBOUND_UPSTREAMS (Google Maps, KopoKopo,
+Africa's Talking) gets one requests.Session per process with its own
+keep-alive connection pool, timeouts, urllib3 retry policy and circuit
+breaker, plus latency/error/pool metrics:
+
+    response = outbound.client('google_maps').get('/maps/api/geocode/json', params=params)
+
+Paths are joined to the upstream's base_url, so pointing base_url at a
+local stub server swaps the real service out in tests.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'PAKA-HOME/1.0'
+
+DEFAULTS = {
+    'base_url': '',
+    'timeout': (3.05, 10),  # (connect, read) seconds
+    'retries': 2,
+    'retry_backoff': 0.3,
+    'retry_statuses': (502, 503, 504),
+    'retry_methods': ('GET',),  # connect errors are retried for every method
+    'pool_connections': 4,
+    'pool_maxsize': 10,
+    'breaker_threshold': 5,  # consecutive failures before the circuit opens
+    'breaker_reset': 30,  # seconds before a trial request is let through
+}
+
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling an upstream whose circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open -> closed"""
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class UpstreamMetrics:
+    """Request counters, latency histogram and pool usage for one upstream"""
+
+    def __init__(self, pool_maxsize):
+        self.pool_maxsize = pool_maxsize
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = {}
+        self.statuses = {}
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.latency_sum_ms = 0.0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.saturated = 0  # requests started with every pooled connection busy
+
+    def start(self):
+        with self._lock:
+            if self.in_flight >= self.pool_maxsize:
+                self.saturated += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def finish(self, elapsed_ms, status_code=None, error=None):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.latency_sum_ms += elapsed_ms
+            self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+            if status_code is not None:
+                status_class = f'{status_code // 100}xx'
+                self.statuses[status_class] = self.statuses.get(status_class, 0) + 1
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def rejected(self):
+        with self._lock:
+            self.errors['circuit_open'] = self.errors.get('circuit_open', 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            errors = sum(self.errors.values())
+            attempts = self.requests + self.errors.get('circuit_open', 0)
+            histogram = {f'le_{bound}': count for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets)}
+            histogram['le_inf'] = self.buckets[-1]
+            return {
+                'requests': self.requests,
+                'statuses': dict(self.statuses),
+                'errors': dict(self.errors),
+                'error_rate': round(errors / attempts, 4) if attempts else None,
+                'latency_ms': {
+                    'mean': round(self.latency_sum_ms / self.requests, 1) if self.requests else None,
+                    'histogram': histogram,
+                },
+                'pool': {
+                    'maxsize': self.pool_maxsize,
+                    'in_flight': self.in_flight,
+                    'peak_in_flight': self.peak_in_flight,
+                    'saturated': self.saturated,
+                },
+            }
+
+
+class UpstreamClient:
+    """Pooled session for one upstream; use .get()/.post() like requests"""
+
+    def __init__(self, name, base_url='', **options):
+        config = dict(DEFAULTS, **options)
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = config['timeout']
+        self.breaker = CircuitBreaker(config['breaker_threshold'], config['breaker_reset'])
+        self.metrics = UpstreamMetrics(config['pool_maxsize'])
+
+        retry = Retry(
+            total=config['retries'],
+            connect=config['retries'],
+            read=config['retries'],
+            status=config['retries'],
+            backoff_factor=config['retry_backoff'],
+            status_forcelist=config['retry_statuses'],
+            allowed_methods=frozenset(config['retry_methods']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=config['pool_connections'],
+            pool_maxsize=config['pool_maxsize'],
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def url(self, path):
+        if path.startswith(('http://', 'https://')):
+            return path
+        return self.base_url + path
+
+    def request(self, method, path, **kwargs):
+        if not self.breaker.allow():
+            self.metrics.rejected()
+            raise CircuitOpenError(f'{self.name} circuit breaker is open')
+
+        kwargs.setdefault('timeout', self.timeout)
+        self.metrics.start()
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.url(path), **kwargs)
+        except requests.exceptions.RequestException as e:
+            self.metrics.finish((time.perf_counter() - started) * 1000, error=type(e).__name__)
+            self.breaker.failure()
+            logger.warning(f"{self.name} {method} {path} failed: {e}")
+            raise
+        except Exception as e:
+            self.metrics.finish((time.perf_counter() - started) * 1000, error=type(e).__name__)
+            raise
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if response.status_code >= 500:
+            self.metrics.finish(elapsed_ms, response.status_code, error='server_error')
+            self.breaker.failure()
+        else:
+            self.metrics.finish(elapsed_ms, response.status_code)
+            self.breaker.success()
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def stats(self):
+        stats = self.metrics.snapshot()
+        stats['breaker'] = {'state': self.breaker.state, 'consecutive_failures': self.breaker.failures}
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_pid = None
+_lock = threading.Lock()
+
+
+def client(name):
+    """The process-wide client for an upstream in settings.OUTBOUND_UPSTREAMS"""
+    global _clients_pid
+    pid = os.getpid()
+    upstream = _clients.get(name)
+    if upstream is not None and _clients_pid == pid:
+        return upstream
+
+    with _lock:
+        if _clients_pid != pid:
+            # Forked (e.g. a Celery worker child): never share sockets with the parent
+            _clients.clear()
+            _clients_pid = pid
+        upstream = _clients.get(name)
+        if upstream is None:
+            try:
+                options = settings.OUTBOUND_UPSTREAMS[name]
+            except KeyError:
+                raise ValueError(f'Unknown upstream: {name}') from None
+            upstream = _clients[name] = UpstreamClient(name, **options)
+        return upstream
+
+
+def stats():
+    """Metrics for every upstream used by this process"""
+    with _lock:
+        clients = dict(_clients)
+    return {name: upstream.stats() for name, upstream in sorted(clients.items())}
+
+
+def reset():
+    """Close all sessions; clients are rebuilt from settings on next use"""
+    with _lock:
+        for upstream in _clients.values():
+            upstream.close()
+        _clients.clear()
+
+
+@receiver(setting_changed)
+def _reset_on_settings_change(setting, **kwargs):
+    if setting == 'OUTBOUND_UPSTREAMS':
+        reset()
@@ -0,0 +1,122 @@
+"""
+Keyset pagination for the large lists.
+
+Pages are ordered newest first on (created_at, id) and addressed by an
+opaque cursor holding the (created_at, id) of the row they continue from,
+instead of ?page=N. There is no COUNT(*) and no OFFSET - not even among rows
+sharing a created_at - so page 500 is one indexed range scan, the same as
+page 1. Responses are {"next", "previous", "results"}; follow `next` until
+it is null. ?page_size= picks up to max_page_size rows.
+"""
+import base64
+from collections import OrderedDict
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CreatedAtCursorPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.REST_FRAMEWORK['PAGE_SIZE']
+        return min(max(size, 1), self.max_page_size)
+
+    @staticmethod
+    def encode_cursor(row, reverse=False):
+        state = {'t': row.created_at.isoformat(), 'i': row.pk, 'r': int(reverse)}
+        return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        """(created_at, id, reverse), or None on the first page"""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            state = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            created_at = parse_datetime(state['t'])
+            if created_at is None:
+                raise ValueError(state['t'])
+            return created_at, int(state['i']), bool(state['r'])
+        except (ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message) from None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        if position is None:
+            reverse = False
+            rows = queryset.order_by('-created_at', '-id')
+        else:
+            created_at, pk, reverse = position
+            if reverse:  # previous page: the rows just after the cursor, read backwards
+                rows = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk), created_at__gte=created_at
+                ).order_by('created_at', 'id')
+            else:
+                rows = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk), created_at__lte=created_at
+                ).order_by('-created_at', '-id')
+
+        page = list(rows[:size + 1])
+        more = len(page) > size
+        page = page[:size]
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, more
+        else:
+            self.has_next, self.has_previous = more, position is not None
+        if not page:
+            self.has_next = self.has_previous = False
+        self.first, self.last = (page[0], page[-1]) if page else (None, None)
+        return page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.first, reverse=True))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+def paginated_response(request, queryset, serializer_class, **serializer_kwargs):
+    """One cursor page of `queryset` serialized with `serializer_class`, for function views"""
+    paginator = CreatedAtCursorPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    return paginator.get_paginated_response(serializer_class(page, many=True, **serializer_kwargs).data)
@@ -0,0 +1,53 @@
+"""Shared test helpers"""
+from contextlib import contextmanager
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    Fail a test when a block runs more SQL queries than its budget:
+
+        with self.assertQueryBudget(6):
+            self.client.get('/api/orders/')
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(f"{i}. {query['sql']}" for i, query in enumerate(context.captured_queries, start=1))
+            self.fail(f'{executed} queries executed, budget is {budget}:\n{queries}')
+
+
+class QueryPlanMixin:
+    """
+    Fail a test when a queryset's plan reads a whole table or sorts it,
+    rather than walking an index:
+
+        self.assertUsesIndex(Order.objects.filter(status='pending_assignment'), 'order_pending_created_idx')
+
+    Run it over a seeded table after ANALYZE, so the planner sees real sizes.
+    """
+    # Plan lines meaning a full read or an unindexed sort, per backend
+    FULL_SCAN_MARKERS = {
+        'sqlite': ('SCAN ', 'USE TEMP B-TREE'),
+        'postgresql': ('Seq Scan', 'Sort  '),
+    }
+
+    def query_plan(self, queryset):
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, index_name=None):
+        plan = self.query_plan(queryset)
+        markers = self.FULL_SCAN_MARKERS.get(connection.vendor, ())
+        # SQLite words an index walk "SCAN t USING INDEX ..."; only a bare SCAN reads the table
+        scans = [line for line in plan.splitlines()
+                 if any(marker in line for marker in markers) and 'USING' not in line]
+        if scans:
+            self.fail(f'Full scan or sort in plan:\n{plan}\n\n{queryset.query}')
+        if index_name is not None and index_name not in plan:
+            self.fail(f'{index_name} not used:\n{plan}\n\n{queryset.query}')
+        return plan
@@ -0,0 +1,145 @@
+"""
+Outbound HTTP client tests against a local stub server, and shared cache tests.
+Run: python manage.py test pakahome
+"""
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+from unittest import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from redis.exceptions import ConnectionError as RedisConnectionError
+import requests
+from rest_framework.test import APIClient
+from orders.models import Order
+from users.models import User, Customer, Driver
+from . import cache as shared_cache
+from . import outbound
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        server.ports.add(self.client_address[1])
+        status = server.statuses.pop(0) if server.statuses else 200
+        body = b'{"status": "OK"}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class OutboundClientTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = 0
+        self.server.ports = set()
+        self.server.statuses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        upstreams = {
+            'stub': {
+                'base_url': f'http://127.0.0.1:{self.server.server_port}',
+                'retries': 2,
+                'retry_backoff': 0,
+                'breaker_threshold': 2,
+                'breaker_reset': 60,
+            }
+        }
+        overrides = override_settings(OUTBOUND_UPSTREAMS=upstreams)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_connections_are_reused(self):
+        stub = outbound.client('stub')
+        for _ in range(5):
+            self.assertEqual(stub.get('/ping').json(), {'status': 'OK'})
+        self.assertEqual(self.server.requests, 5)
+        self.assertEqual(len(self.server.ports), 1)
+        self.assertEqual(stub.stats()['requests'], 5)
+
+    def test_retries_gateway_errors(self):
+        self.server.statuses = [503, 502]
+        response = outbound.client('stub').get('/ping')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        self.server.statuses = [500, 500]
+        stub = outbound.client('stub')
+        stub.get('/ping')
+        stub.get('/ping')
+        with self.assertRaises(requests.exceptions.RequestException):
+            stub.get('/ping')
+        self.assertEqual(self.server.requests, 2)
+        stats = outbound.stats()['stub']
+        self.assertEqual(stats['breaker']['state'], 'open')
+        self.assertEqual(stats['errors'], {'server_error': 2, 'circuit_open': 1})
+
+
+class SharedCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(
+            phone_number='254700000140', email='cache-admin@test.pakahome.local', password='1234', role='admin'
+        )
+        customer_user = User.objects.create_user(
+            phone_number='254700000141', email='cache-customer@test.pakahome.local', password='1234', role='customer'
+        )
+        self.customer = Customer.objects.create(user=customer_user, full_name='Cache Customer', phone='254700000141')
+        driver_user = User.objects.create_user(
+            phone_number='254700000142', email='cache-driver@test.pakahome.local', password='1234', role='driver'
+        )
+        self.driver = Driver.objects.create(user=driver_user, full_name='Cache Driver', phone='254700000142',
+                                            license_number='DL140', status='available', is_active=True)
+        self.order = Order.objects.create(
+            customer=self.customer, driver=self.driver,
+            pickup_name='A', pickup_phone='254700000141', pickup_address='Westlands',
+            delivery_name='B', delivery_phone='254700000143', delivery_address='Kilimani',
+            price=Decimal('150'), status='assigned',
+        )
+        self.client = APIClient()
+
+    def test_invalidate_moves_namespace_to_a_new_generation(self):
+        first = shared_cache.key('things', 'a')
+        self.assertEqual(shared_cache.key('things', 'a'), first)
+        shared_cache.invalidate('things')
+        self.assertNotEqual(shared_cache.key('things', 'a'), first)
+
+        cache.delete(shared_cache.GENERATION_PREFIX + 'things')  # evicted counter
+        self.assertNotEqual(shared_cache.key('things', 'a'), first)
+
+    def test_driver_lists_vary_on_role_and_follow_driver_saves(self):
+        self.client.force_authenticate(self.admin)
+        self.assertEqual([driver['status'] for driver in self.client.get('/api/drivers/available/').data], ['available'])
+        self.assertEqual(self.client.get('/api/drivers/available/')['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get('/api/auth/drivers/')['X-Cache'], 'MISS')
+
+        self.client.force_authenticate(self.customer.user)
+        self.assertEqual(self.client.get('/api/drivers/available/').status_code, 403)
+
+        self.driver.status = 'busy'
+        self.driver.save(update_fields=['status'])
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.get('/api/drivers/available/').data, [])
+        self.assertEqual(self.client.get('/api/auth/drivers/').data['results'][0]['status'], 'busy')
+
+    def test_cache_outage_serves_uncached(self):
+        self.client.force_authenticate(self.admin)
+        with mock.patch.object(shared_cache.cache, 'get', side_effect=RedisConnectionError('down')), \
+                self.assertLogs('pakahome.cache', 'WARNING'):
+            response = self.client.get('/api/auth/customers/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Cache', response)
+        self.assertEqual(response.data['results'][0]['full_name'], 'Cache Customer')
@@ -15,6 +15,7 @@ urlpatterns = [
     path('api/payments/', include('payments.urls')),
     path('api/notifications/', include('notifications.urls')),
     path('api/maps/', include('orders.map_urls')),
+    path('api/outbound/stats/', pakahome_views.outbound_stats, name='outbound_stats'),
 
     # KopoKopo callback route
     path('payments/kopokopo/callback/', include('payments.urls')),
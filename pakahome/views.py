@@ -3,6 +3,11 @@ from django.shortcuts import redirect, render
 from django.views.decorators.http import require_GET
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.contrib.auth.decorators import login_required
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+
+from . import outbound
 
 
 @require_GET
@@ -34,3 +39,15 @@ def driver_signup_view(request):
     if request.user.is_authenticated and getattr(request.user, 'role', None) == 'driver':
         return redirect('/driver-dashboard/')
     return render(request, 'driver_signup.html')
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def outbound_stats(request):
+    """Per-upstream latency, error and connection pool metrics for this process (admin only)"""
+    if request.user.role != 'admin':
+        return Response(
+            {'error': 'Only admins can view outbound metrics'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    return Response(outbound.stats())
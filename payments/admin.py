@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Payment
+from .models import Payment, WebhookEvent
 
 
 @admin.register(Payment)
@@ -10,3 +10,10 @@ class PaymentAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at', 'updated_at']
     date_hierarchy = 'created_at'
 
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['idempotency_key', 'event_type', 'status', 'attempts', 'received_at', 'processed_at']
+    list_filter = ['status', 'event_type', 'received_at']
+    search_fields = ['idempotency_key']
+    readonly_fields = ['received_at', 'processed_at']
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_created_at_cursor_indexes'),
+        ('payments', '0003_webhookevent'),
+        ('users', '0006_created_at_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['created_at', 'id'], name='payment_created_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['customer', 'created_at', 'id'], name='payment_customer_created_idx'),
+        ),
+    ]
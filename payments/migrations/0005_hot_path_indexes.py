@@ -0,0 +1,20 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_created_at_cursor_indexes'),
+        ('users', '0006_created_at_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='users.customer'),
+        ),
+    ]
@@ -14,7 +14,7 @@ class Payment(models.Model):
     ]
     
     order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='payment')
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='payments')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='payments', db_index=False)  # see Meta
     
     # M-Pesa details
     phone_number = models.CharField(max_length=15)
@@ -33,6 +33,40 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Cursor pages (newest first on created_at, id) of payment_list
+            models.Index(fields=['created_at', 'id'], name='payment_created_at_id_idx'),
+            models.Index(fields=['customer', 'created_at', 'id'], name='payment_customer_created_idx'),
+        ]
+    
     def __str__(self):
         return f"Payment for Order {self.order.tracking_code} - {self.status}"
 
+
+class WebhookEvent(models.Model):
+    """Raw KopoKopo webhook delivery, stored before it is processed"""
+    STATUS_CHOICES = [
+        ('received', 'Received'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+    
+    # KopoKopo event id (or receipt / body hash); the unique index drops redeliveries
+    idempotency_key = models.CharField(max_length=100, unique=True)
+    event_type = models.CharField(max_length=100, blank=True)
+    payload = models.JSONField()
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='received')
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'received_at'], name='webhookevent_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type or 'webhook'} {self.idempotency_key} - {self.status}"
@@ -21,6 +21,18 @@ class PaymentSerializer(serializers.ModelSerializer):
                            'created_at', 'updated_at']
 
 
+class PaymentStatusSerializer(serializers.ModelSerializer):
+    """Lightweight payment state for status polling"""
+    order_id = serializers.IntegerField(read_only=True)
+    order_status = serializers.CharField(source='order.status', read_only=True)
+    
+    class Meta:
+        model = Payment
+        fields = ['id', 'order_id', 'order_status', 'status', 'result_description',
+                  'mpesa_receipt_number', 'checkout_request_id', 'updated_at']
+        read_only_fields = fields
+
+
 class STKPushSerializer(serializers.Serializer):
     order_id = serializers.IntegerField(required=True)
     phone_number = serializers.CharField(max_length=20, required=True)
@@ -1,30 +1,53 @@
 """KopoKopo M-Pesa API integration service"""
 from django.conf import settings
+from django.core.cache import cache
 import requests
+from pakahome import outbound
 import json
 import hashlib
 import hmac
+import time
 from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def get_access_token():
-    """Get KopoKopo OAuth access token using client credentials flow"""
+TOKEN_LOCK_TIMEOUT = 15  # seconds; longer than the token request can take
+# A queued or sent STK push blocks another for the same payment until the payment
+# completes or fails, or this many seconds pass (the phone prompt expires well before)
+STK_PUSH_LOCK_TIMEOUT = 180
+
+
+def stk_push_lock_key(payment_id):
+    return f'payments:stk_push_queued:{payment_id}'
+
+
+def release_stk_push_lock(payment_id):
+    """Allow a new STK push for this payment (it reached a terminal status, or the push failed)"""
+    cache.delete(stk_push_lock_key(payment_id))
+
+
+def _token_cache_key():
+    # Scoped to the client id so switching environments never reuses a token
+    client_hash = hashlib.sha1(settings.KOPOKOPO_CLIENT_ID.encode('utf-8')).hexdigest()[:12]
+    return f'payments:kopokopo_token:{client_hash}'
+
+
+def fetch_access_token():
+    """
+    Request a new KopoKopo OAuth token using the client credentials flow.
+    Returns the token response ({'access_token', 'expires_in', ...}) or None.
+    """
     client_id = settings.KOPOKOPO_CLIENT_ID
     client_secret = settings.KOPOKOPO_CLIENT_SECRET
-    base_url = settings.KOPOKOPO_BASE_URL
     
     if not client_id or not client_secret:
         logger.error("KopoKopo credentials not configured")
         return None
     
-    url = f"{base_url}/oauth/token"
-    
     headers = {
         'Content-Type': 'application/x-www-form-urlencoded',
-        'User-Agent': 'PAKA-HOME/1.0'
     }
     
     data = {
@@ -34,15 +57,14 @@ def get_access_token():
     }
     
     try:
-        response = requests.post(url, data=data, headers=headers, timeout=10)
+        response = outbound.client('kopokopo').post('/oauth/token', data=data, headers=headers, timeout=(3.05, 10))
         logger.info(f"KopoKopo Access Token Response Status: {response.status_code}")
         
         if response.status_code == 200:
             data = response.json()
-            access_token = data.get('access_token')
-            if access_token:
+            if data.get('access_token'):
                 logger.info("KopoKopo access token retrieved successfully")
-                return access_token
+                return data
             else:
                 logger.error(f"KopoKopo access token response: {data}")
         else:
@@ -53,6 +75,80 @@ def get_access_token():
     return None
 
 
+def _store_token(data):
+    expires_in = int(data.get('expires_in') or 3600)
+    entry = {'access_token': data['access_token'], 'expires_at': time.time() + expires_in}
+    # Drop the token from the cache a little before KopoKopo stops accepting it
+    timeout = max(expires_in - settings.KOPOKOPO_TOKEN_EXPIRY_MARGIN, 1)
+    cache.set(_token_cache_key(), entry, timeout)
+    return entry
+
+
+def _wait_for_token(key, lock_key):
+    """Wait for the worker holding the refresh lock to store a token"""
+    deadline = time.monotonic() + TOKEN_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['access_token']
+        if cache.get(lock_key) is None:
+            break
+    return None
+
+
+def refresh_access_token(only_if_due=False):
+    """
+    Fetch a new token and cache it. Only one caller across all workers hits
+    the token endpoint at a time; the others wait for its result.
+    With only_if_due, a cached token that is not yet near expiry is kept.
+    """
+    key = _token_cache_key()
+    lock_key = f'{key}:lock'
+    if only_if_due:
+        entry = cache.get(key)
+        if entry and entry['expires_at'] - time.time() > settings.KOPOKOPO_TOKEN_REFRESH_AHEAD:
+            return entry['access_token']
+
+    if not cache.add(lock_key, True, timeout=TOKEN_LOCK_TIMEOUT):
+        return _wait_for_token(key, lock_key)
+    try:
+        data = fetch_access_token()
+        return _store_token(data)['access_token'] if data else None
+    finally:
+        cache.delete(lock_key)
+
+
+def schedule_token_refresh():
+    """Renew the token in the background, at most once per refresh window"""
+    from .tasks import refresh_kopokopo_token
+
+    if cache.add(f'{_token_cache_key()}:refresh_scheduled', True, timeout=60):
+        refresh_kopokopo_token.delay()
+
+
+def get_access_token():
+    """
+    Get a KopoKopo OAuth access token, served from the cache until shortly
+    before it expires and renewed in the background once it gets close.
+    """
+    if not settings.KOPOKOPO_CLIENT_ID or not settings.KOPOKOPO_CLIENT_SECRET:
+        logger.error("KopoKopo credentials not configured")
+        return None
+
+    entry = cache.get(_token_cache_key())
+    if entry is not None:
+        if entry['expires_at'] - time.time() < settings.KOPOKOPO_TOKEN_REFRESH_AHEAD:
+            schedule_token_refresh()
+        return entry['access_token']
+    return refresh_access_token()
+
+
+def invalidate_access_token():
+    """Forget the cached token (e.g. after KopoKopo rejected it)"""
+    cache.delete(_token_cache_key())
+
+
 def initiate_stk_push(phone_number, amount, order_tracking_code, callback_url, customer_name=None, customer_email=None):
     """
     Initiate KopoKopo M-Pesa STK Push payment
@@ -66,14 +162,10 @@ def initiate_stk_push(phone_number, amount, order_tracking_code, callback_url, c
             'error_details': 'Could not retrieve access token'
         }
     
-    base_url = settings.KOPOKOPO_BASE_URL
-    url = f"{base_url}/api/v1/incoming_payments"
-    
     headers = {
         'Authorization': f'Bearer {access_token}',
         'Content-Type': 'application/json',
         'Accept': 'application/json',
-        'User-Agent': 'PAKA-HOME/1.0'
     }
     
     # Format phone number (ensure it starts with +254)
@@ -139,7 +231,14 @@ def initiate_stk_push(phone_number, amount, order_tracking_code, callback_url, c
     }
     
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
+        response = outbound.client('kopokopo').post('/api/v1/incoming_payments', json=payload, headers=headers)
+        if response.status_code == 401:
+            # Token revoked or expired early: fetch a new one and try once more
+            invalidate_access_token()
+            access_token = get_access_token()
+            if access_token:
+                headers['Authorization'] = f'Bearer {access_token}'
+                response = outbound.client('kopokopo').post('/api/v1/incoming_payments', json=payload, headers=headers)
         response_data = response.json() if response.content else {}
         
         logger.info(f"KopoKopo STK Push Response Status: {response.status_code}")
@@ -0,0 +1,105 @@
+"""Background KopoKopo tasks: STK pushes, webhook processing and token upkeep"""
+from datetime import timedelta
+import logging
+import uuid
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Payment, WebhookEvent
+from .services import initiate_stk_push, refresh_access_token, release_stk_push_lock
+from .webhooks import WebhookError, process_event
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def send_stk_push(payment_id, callback_url):
+    """
+    Send the STK push for a queued payment and record KopoKopo's answer. The
+    push lock is kept once the phone was prompted; the webhook releases it.
+    """
+    try:
+        payment = Payment.objects.select_related('order', 'customer').get(id=payment_id, status='pending')
+    except Payment.DoesNotExist:
+        release_stk_push_lock(payment_id)
+        return False
+
+    customer = payment.customer
+    try:
+        response_data = initiate_stk_push(
+            phone_number=payment.phone_number,
+            amount=payment.amount,
+            order_tracking_code=payment.order.tracking_code,
+            callback_url=callback_url,
+            customer_name=customer.full_name or customer.user.phone_number,
+            customer_email=getattr(customer, 'email', None) or None
+        )
+    except Exception:
+        release_stk_push_lock(payment_id)
+        raise
+
+    if not response_data.get('success'):
+        release_stk_push_lock(payment_id)
+        payment.status = 'failed'
+        payment.result_description = response_data.get('message', 'Payment initiation failed')
+        payment.save(update_fields=['status', 'result_description', 'updated_at'])
+        return False
+
+    payment.merchant_request_id = str(uuid.uuid4())
+    payment.checkout_request_id = response_data.get('payment_request_id') or None
+    payment.status = 'processing'
+    payment.result_description = response_data.get('message', '')
+    payment.save(update_fields=['merchant_request_id', 'checkout_request_id', 'status',
+                                'result_description', 'updated_at'])
+    return True
+
+
+@shared_task
+def refresh_kopokopo_token():
+    """Renew the cached KopoKopo token before it expires"""
+    if not settings.KOPOKOPO_CLIENT_ID or not settings.KOPOKOPO_CLIENT_SECRET:
+        return False
+    return refresh_access_token(only_if_due=True) is not None
+
+
+@shared_task
+def process_webhook_event(event_id):
+    """Apply one stored webhook event; redeliveries never get this far"""
+    with transaction.atomic():
+        event = (WebhookEvent.objects.select_for_update(skip_locked=True)
+                 .filter(id=event_id, status='received').first())
+        if event is None:
+            # Already processed, or another worker has it
+            return False
+        
+        event.attempts += 1
+        try:
+            with transaction.atomic():
+                process_event(event)
+        except WebhookError as e:
+            logger.error(f"Webhook event {event.idempotency_key} rejected: {e}")
+            event.status = 'failed'
+            event.error = str(e)
+        except Exception as e:
+            logger.exception(f"Webhook event {event.idempotency_key} failed")
+            event.error = str(e)
+            if event.attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+                event.status = 'failed'
+        else:
+            event.status = 'processed'
+            event.error = ''
+            event.processed_at = timezone.now()
+        event.save(update_fields=['status', 'attempts', 'error', 'processed_at'])
+    return event.status == 'processed'
+
+
+@shared_task
+def process_pending_webhooks():
+    """Pick up events whose processing task was lost or failed transiently"""
+    cutoff = timezone.now() - timedelta(seconds=settings.WEBHOOK_RETRY_AFTER)
+    event_ids = list(
+        WebhookEvent.objects.filter(status='received', received_at__lte=cutoff)
+        .order_by('received_at').values_list('id', flat=True)[:100]
+    )
+    return sum(1 for event_id in event_ids if process_webhook_event(event_id))
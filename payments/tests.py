@@ -0,0 +1,232 @@
+"""
+KopoKopo token caching and asynchronous STK push tests.
+Run: python manage.py test payments
+"""
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from orders.models import Order
+from users.models import User, Customer
+from . import services
+from notifications.models import SMSLog
+from .models import Payment, WebhookEvent
+from .tasks import process_pending_webhooks, send_stk_push
+
+
+@override_settings(KOPOKOPO_CLIENT_ID='client', KOPOKOPO_CLIENT_SECRET='secret')
+class AccessTokenCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_token_is_reused_until_expiry(self):
+        token = {'access_token': 'abc', 'expires_in': 3600}
+        with mock.patch('payments.services.fetch_access_token', return_value=token) as fetch:
+            self.assertEqual(services.get_access_token(), 'abc')
+            self.assertEqual(services.get_access_token(), 'abc')
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_token_near_expiry_is_refreshed_in_background(self):
+        with mock.patch('payments.services.fetch_access_token', return_value={'access_token': 'old', 'expires_in': 200}):
+            services.get_access_token()
+
+        with mock.patch('payments.services.fetch_access_token', return_value={'access_token': 'new', 'expires_in': 3600}), \
+                mock.patch('payments.tasks.refresh_kopokopo_token.delay') as delay:
+            # Still valid: served from the cache while a refresh is queued once
+            self.assertEqual(services.get_access_token(), 'old')
+            self.assertEqual(services.get_access_token(), 'old')
+            self.assertEqual(delay.call_count, 1)
+            services.refresh_access_token(only_if_due=True)
+            self.assertEqual(services.get_access_token(), 'new')
+
+    def test_concurrent_callers_wait_for_lock_holder(self):
+        key = services._token_cache_key()
+        cache.add(f'{key}:lock', True)
+
+        def other_worker_stores_token(seconds):
+            cache.set(key, {'access_token': 'shared', 'expires_at': time.time() + 3600})
+
+        with mock.patch('payments.services.fetch_access_token') as fetch, \
+                mock.patch('payments.services.time.sleep', side_effect=other_worker_stores_token):
+            self.assertEqual(services.get_access_token(), 'shared')
+        fetch.assert_not_called()
+
+    def test_rejected_token_is_replaced(self):
+        cache.set(services._token_cache_key(), {'access_token': 'revoked', 'expires_at': time.time() + 3600})
+        unauthorized = mock.Mock(status_code=401, content=b'')
+        created = mock.Mock(status_code=201, content=b'', headers={'Location': 'https://k2/incoming_payments/42'})
+
+        with mock.patch('payments.services.fetch_access_token', return_value={'access_token': 'fresh', 'expires_in': 3600}), \
+                mock.patch('pakahome.outbound.UpstreamClient.post', side_effect=[unauthorized, created]) as post:
+            result = services.initiate_stk_push('0700000001', 150, 'PKH123', 'https://example.com/cb')
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['payment_request_id'], '42')
+        self.assertEqual(post.call_args.kwargs['headers']['Authorization'], 'Bearer fresh')
+
+
+class AsyncSTKPushTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            phone_number='254700000020', email='payer@test.pakahome.local', password='1234', role='customer'
+        )
+        self.customer = Customer.objects.create(user=self.user, full_name='Test Payer', phone='254700000020')
+        self.order = Order.objects.create(
+            customer=self.customer,
+            pickup_name='A', pickup_phone='254700000020', pickup_address='Westlands',
+            delivery_name='B', delivery_phone='254700000021', delivery_address='Kilimani',
+            price=Decimal('150'),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_initiate_returns_202_without_calling_kopokopo(self):
+        with mock.patch('payments.views.send_stk_push.delay') as delay, \
+                mock.patch('payments.services.initiate_stk_push') as push:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/payments/stkpush/', {'order_id': self.order.id, 'phone_number': '0700000020'}, format='json')
+            # A second tap while the first is queued does not queue another push
+            with self.captureOnCommitCallbacks(execute=True):
+                again = self.client.post('/api/payments/stkpush/', {'order_id': self.order.id, 'phone_number': '0700000020'}, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(again.status_code, 202)
+        payment = Payment.objects.get(order=self.order)
+        self.assertEqual(response.data['payment_id'], payment.id)
+        self.assertEqual(payment.status, 'pending')
+        delay.assert_called_once_with(payment.id, mock.ANY)
+        push.assert_not_called()
+
+    def test_worker_sends_push_and_status_reflects_it(self):
+        payment = Payment.objects.create(order=self.order, customer=self.customer, phone_number='254700000020',
+                                         amount=self.order.price, status='pending')
+        accepted = {'success': True, 'message': 'Sent', 'payment_request_id': 'req-1'}
+        with mock.patch('payments.tasks.initiate_stk_push', return_value=accepted):
+            self.assertTrue(send_stk_push(payment.id, 'https://example.com/cb'))
+
+        response = self.client.get(f'/api/payments/{payment.id}/status/', {'since': 'pending'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'processing')
+        self.assertEqual(response.data['checkout_request_id'], 'req-1')
+        self.assertFalse(response.has_header('Retry-After'))
+
+        # Unchanged: answered at once with a hint for the next poll, never held
+        response = self.client.get(f'/api/payments/{payment.id}/status/', {'since': 'processing', 'wait': 25})
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_push_lock_is_held_until_the_payment_settles(self):
+        accepted = {'success': True, 'message': 'Sent', 'payment_request_id': 'req-2'}
+        with mock.patch('payments.tasks.initiate_stk_push', return_value=accepted) as push:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/payments/stkpush/', {'order_id': self.order.id, 'phone_number': '0700000020'}, format='json')
+            # The phone was prompted; a second tap must not prompt it again
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/payments/stkpush/', {'order_id': self.order.id, 'phone_number': '0700000020'}, format='json')
+            self.assertEqual(push.call_count, 1)
+
+            payment = Payment.objects.get(order=self.order)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/payments/callback/',
+                                 incoming_payment_callback('lock-1', self.order.tracking_code, 'Failed'), format='json')
+            payment.refresh_from_db()
+            self.assertEqual(payment.status, 'failed')
+
+            # Settled: a new tap sends a new push
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/payments/stkpush/', {'order_id': self.order.id, 'phone_number': '0700000020'}, format='json')
+            self.assertEqual(push.call_count, 2)
+
+    def test_status_is_private_to_the_customer(self):
+        payment = Payment.objects.create(order=self.order, customer=self.customer, phone_number='254700000020',
+                                         amount=self.order.price, status='pending')
+        other = User.objects.create_user(
+            phone_number='254700000022', email='other@test.pakahome.local', password='1234', role='customer'
+        )
+        self.client.force_authenticate(other)
+        response = self.client.get(f'/api/payments/{payment.id}/status/')
+        self.assertEqual(response.status_code, 404)
+
+
+def incoming_payment_callback(event_id, tracking_code, status='Success'):
+    return {
+        'data': {
+            'id': event_id,
+            'type': 'incoming_payment',
+            'attributes': {
+                'status': status,
+                'event': {
+                    'type': 'Incoming Payment Request',
+                    'resource': {
+                        'reference': 'QKL1234XYZ',
+                        'amount': '150.0',
+                        'currency': 'KES',
+                        'sender_phone_number': '+254700000030',
+                        'origination_time': '2024-10-21T09:30:40.123+03:00',
+                    } if status == 'Success' else None,
+                    'errors': None if status == 'Success' else 'Cancelled by user',
+                },
+                'metadata': {'order_tracking_code': tracking_code},
+            },
+        }
+    }
+
+
+class WebhookIngestionTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(
+            phone_number='254700000030', email='hook@test.pakahome.local', password='1234', role='customer'
+        )
+        self.customer = Customer.objects.create(user=user, full_name='Hook Customer', phone='254700000030')
+        self.order = Order.objects.create(
+            customer=self.customer,
+            pickup_name='A', pickup_phone='254700000030', pickup_address='Westlands',
+            delivery_name='B', delivery_phone='254700000031', delivery_address='Kilimani',
+            price=Decimal('150'), status='pending_payment',
+        )
+        self.client = APIClient()
+
+    def post_callback(self, body):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/payments/callback/', body, format='json')
+
+    def test_redelivered_event_is_applied_once(self):
+        body = incoming_payment_callback('evt-1', self.order.tracking_code)
+        first = self.post_callback(body)
+        second = self.post_callback(body)
+
+        self.assertEqual(first.data['message'], 'Event received')
+        self.assertEqual(second.data['message'], 'Duplicate event ignored')
+        self.assertEqual(WebhookEvent.objects.get().status, 'processed')
+        payment = Payment.objects.get(order=self.order)
+        self.assertEqual(payment.status, 'completed')
+        self.assertEqual(payment.mpesa_receipt_number, 'QKL1234XYZ')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending_assignment')
+        self.assertEqual(SMSLog.objects.count(), 1)
+
+    def test_acknowledged_before_processing(self):
+        with mock.patch('payments.views.process_webhook_event.delay') as delay:
+            response = self.post_callback(incoming_payment_callback('evt-2', self.order.tracking_code))
+        self.assertEqual(response.status_code, 200)
+        event = WebhookEvent.objects.get()
+        delay.assert_called_once_with(event.id)
+        self.assertEqual(event.status, 'received')
+        self.assertFalse(Payment.objects.exists())
+
+        # The periodic sweep applies events whose task never ran
+        WebhookEvent.objects.update(received_at=event.received_at - timedelta(minutes=5))
+        self.assertEqual(process_pending_webhooks(), 1)
+        self.assertEqual(Payment.objects.get().status, 'completed')
+
+    def test_unknown_order_fails_without_retry(self):
+        self.post_callback(incoming_payment_callback('evt-3', 'PKH-MISSING'))
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.status, 'failed')
+        self.assertIn('PKH-MISSING', event.error)
@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path('stkpush/', views.initiate_payment, name='initiate_payment'),
     path('callback/', views.payment_callback, name='payment_callback'),
+    path('<int:payment_id>/status/', views.payment_status, name='payment_status'),
     path('', views.payment_list, name='payment_list'),
 ]
 
@@ -0,0 +1,134 @@
+"""
+KopoKopo webhook ingestion.
+
+The callback view only stores the raw event (record_event) and acknowledges
+it; process_event applies it to the Payment and Order on a worker. The
+unique idempotency_key on WebhookEvent drops redelivered events.
+"""
+from datetime import datetime
+import hashlib
+import logging
+
+from django.db import IntegrityError, transaction
+
+from notifications.services import queue_sms_notification
+from orders.events import publish_order_event
+from orders.models import Order
+from .models import Payment, WebhookEvent
+from .services import process_incoming_payment_result, release_stk_push_lock
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookError(Exception):
+    """The event can never be applied (unknown order, missing metadata...)"""
+
+
+def event_idempotency_key(callback_data, request_body):
+    """KopoKopo event id, else the M-Pesa receipt, else a hash of the body"""
+    data = callback_data.get('data') or {}
+    attributes = data.get('attributes') or {}
+    resource = (attributes.get('event') or {}).get('resource') or {}
+    key = data.get('id') or resource.get('reference')
+    if key:
+        return str(key)[:100]
+    return 'sha256:' + hashlib.sha256(request_body.encode('utf-8')).hexdigest()
+
+
+def record_event(callback_data, request_body):
+    """Store a webhook delivery. Returns (event, created); created is False for a redelivery."""
+    attributes = (callback_data.get('data') or {}).get('attributes') or {}
+    key = event_idempotency_key(callback_data, request_body)
+    try:
+        with transaction.atomic():
+            event = WebhookEvent.objects.create(
+                idempotency_key=key,
+                event_type=str((attributes.get('event') or {}).get('type') or '')[:100],
+                payload=callback_data
+            )
+        return event, True
+    except IntegrityError:
+        return WebhookEvent.objects.get(idempotency_key=key), False
+
+
+def parse_transaction_date(value):
+    """Parse KopoKopo's ISO 8601 timestamps (2020-10-21T09:30:40.123+03:00 or ...Z)"""
+    date_str = value.replace('Z', '+00:00')
+    if '.' in date_str and '+' in date_str:
+        # Drop fractional seconds, keep the offset
+        date_part, tz_part = date_str.split('+', 1)
+        date_str = date_part.split('.')[0] + '+' + tz_part
+    elif '.' in date_str:
+        date_str = date_str.split('.')[0]
+    try:
+        return datetime.fromisoformat(date_str)
+    except (ValueError, AttributeError) as e:
+        logger.warning(f"Could not parse transaction date: {e}, value: {value}")
+    try:
+        date_part = value.split('+')[0].split('Z')[0].split('.')[0]
+        return datetime.strptime(date_part, '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        logger.error(f"Failed to parse transaction date: {value}")
+        return None
+
+
+def process_event(event):
+    """Apply an incoming payment result to its Payment and Order"""
+    callback_data = event.payload
+    result = process_incoming_payment_result(callback_data)
+    
+    attributes = (callback_data.get('data') or {}).get('attributes') or {}
+    metadata = attributes.get('metadata') or {}
+    order_tracking_code = metadata.get('order_tracking_code') or metadata.get('order_reference')
+    if not order_tracking_code:
+        raise WebhookError('No order tracking code in callback metadata')
+    
+    try:
+        order = Order.objects.select_related('customer__user').get(tracking_code=order_tracking_code)
+    except Order.DoesNotExist:
+        raise WebhookError(f'Order not found: {order_tracking_code}')
+    
+    payment, created = Payment.objects.select_for_update().get_or_create(
+        order=order,
+        defaults={
+            'customer': order.customer,
+            'phone_number': result.get('sender_phone_number', ''),
+            'amount': order.price,
+            'status': 'pending'
+        }
+    )
+    if payment.status == 'completed':
+        # Already settled by an earlier event for this payment
+        logger.info(f"Payment for order {order_tracking_code} already completed, ignoring event {event.idempotency_key}")
+        return
+    
+    if not result.get('success'):
+        payment.status = 'failed'
+        payment.result_code = 1
+        payment.result_description = str(result.get('error_message', 'Payment failed'))
+        payment.save()
+        transaction.on_commit(lambda: release_stk_push_lock(payment.id))
+        publish_order_event('payment.failed', order, payment_status=payment.status)
+        logger.warning(f"Payment failed for order {order_tracking_code}: {result.get('error_message')}")
+        return
+    
+    payment.status = 'completed'
+    payment.mpesa_receipt_number = result.get('mpesa_receipt_number', '')
+    payment.result_code = 0
+    payment.result_description = 'Payment successful'
+    if result.get('transaction_date'):
+        payment.transaction_date = parse_transaction_date(result['transaction_date'])
+    payment.save()
+    transaction.on_commit(lambda: release_stk_push_lock(payment.id))
+    
+    order.status = 'pending_assignment'
+    order.save()
+    publish_order_event('payment.completed', order, payment_status=payment.status)
+    
+    customer_phone = getattr(payment.customer, 'phone', None) or payment.customer.user.phone_number
+    if customer_phone:
+        queue_sms_notification(
+            customer_phone,
+            f"Payment of KES {payment.amount} for order {order.tracking_code} confirmed. Receipt: {payment.mpesa_receipt_number}"
+        )
+    logger.info(f"Payment completed for order {order_tracking_code}")
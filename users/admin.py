@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Customer, Driver
+from .models import User, Customer, Driver, DriverLocation
 
 
 @admin.register(User)
@@ -24,3 +24,10 @@ class DriverAdmin(admin.ModelAdmin):
     list_filter = ['status', 'is_active']
     search_fields = ['full_name', 'phone', 'license_number']
 
+
+@admin.register(DriverLocation)
+class DriverLocationAdmin(admin.ModelAdmin):
+    list_display = ['driver', 'latitude', 'longitude', 'recorded_at', 'received_at']
+    list_select_related = ['driver']
+    readonly_fields = ['received_at']
+    date_hierarchy = 'recorded_at'
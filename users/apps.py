@@ -4,4 +4,14 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
-
+    
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from .caching import customer_changed, driver_changed, user_changed
+        
+        post_save.connect(driver_changed, sender='users.Driver', dispatch_uid='users.caching.driver_saved')
+        post_delete.connect(driver_changed, sender='users.Driver', dispatch_uid='users.caching.driver_deleted')
+        post_save.connect(customer_changed, sender='users.Customer', dispatch_uid='users.caching.customer_saved')
+        post_delete.connect(customer_changed, sender='users.Customer', dispatch_uid='users.caching.customer_deleted')
+        post_save.connect(user_changed, sender='users.User', dispatch_uid='users.caching.user_saved')
+        post_delete.connect(user_changed, sender='users.User', dispatch_uid='users.caching.user_deleted')
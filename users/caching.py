@@ -0,0 +1,20 @@
+"""Cached responses of the driver and customer lists, and their invalidation"""
+from pakahome.cache import invalidate_on_commit
+
+DRIVERS = 'drivers'  # list_drivers, available_drivers
+CUSTOMERS = 'customers'  # list_customers
+
+
+def driver_changed(sender, instance, **kwargs):
+    invalidate_on_commit(DRIVERS)
+
+
+def customer_changed(sender, instance, **kwargs):
+    invalidate_on_commit(CUSTOMERS)
+
+
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return  # every login saves the user
+    # Both lists embed the user
+    invalidate_on_commit(DRIVERS, CUSTOMERS)
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_alter_driver_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driver',
+            name='location_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DriverLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('accuracy', models.FloatField(blank=True, null=True)),
+                ('speed', models.FloatField(blank=True, null=True)),
+                ('heading', models.FloatField(blank=True, null=True)),
+                ('recorded_at', models.DateTimeField()),
+                ('received_at', models.DateTimeField()),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='locations', to='users.driver')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['driver', 'recorded_at'], name='driverloc_driver_time_idx'), models.Index(fields=['recorded_at'], name='driverloc_time_idx')],
+            },
+        ),
+    ]
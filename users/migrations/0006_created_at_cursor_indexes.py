@@ -0,0 +1,21 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_driver_location'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['created_at', 'id'], name='customer_created_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='driver',
+            index=models.Index(fields=['created_at', 'id'], name='driver_created_at_id_idx'),
+        ),
+    ]
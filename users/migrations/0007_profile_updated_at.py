@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_created_at_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='driver',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -85,6 +85,12 @@ class Customer(models.Model):
     phone = models.CharField(max_length=15)
     address = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # part of the order ETags that embed this profile
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='customer_created_at_id_idx'),  # cursor pages
+        ]
     
     def __str__(self):
         return self.full_name
@@ -107,9 +113,40 @@ class Driver(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='available')
     current_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     current_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    location_updated_at = models.DateTimeField(null=True, blank=True)  # device time of current_latitude/longitude
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # server time; location writes bump it too
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='driver_created_at_id_idx'),  # cursor pages
+        ]
     
     def __str__(self):
         return f"{self.full_name} - {self.license_number}"
 
+
+class DriverLocation(models.Model):
+    """
+    Append-only GPS trail. Rows arrive in bulk from the drivers.locations buffer
+    and whole days are dropped after DRIVER_LOCATION_RETENTION.
+    """
+    driver = models.ForeignKey(Driver, on_delete=models.CASCADE, related_name='locations')
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    accuracy = models.FloatField(null=True, blank=True)  # metres
+    speed = models.FloatField(null=True, blank=True)  # m/s
+    heading = models.FloatField(null=True, blank=True)  # degrees
+    recorded_at = models.DateTimeField()  # device time of the fix
+    received_at = models.DateTimeField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['driver', 'recorded_at'], name='driverloc_driver_time_idx'),
+            models.Index(fields=['recorded_at'], name='driverloc_time_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.driver_id} at {self.recorded_at}"
+
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
+from django.db.models import Count
 from .models import User, Customer, Driver
 
 
@@ -174,7 +175,13 @@ class DriverSerializer(serializers.ModelSerializer):
                   'vehicle_type', 'vehicle_registration', 'status', 
                   'current_latitude', 'current_longitude', 'is_active', 'created_at', 'order_count']
     
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Load the user and order count with the drivers instead of once per driver"""
+        return queryset.select_related('user').annotate(assigned_order_count=Count('orders'))
+    
     def get_order_count(self, obj):
         """Get count of orders assigned to this driver"""
-        return obj.orders.count()
+        count = getattr(obj, 'assigned_order_count', None)
+        return count if count is not None else obj.orders.count()
 
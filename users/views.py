@@ -10,6 +10,9 @@ from .serializers import (
 from .models import User, Customer, Driver
 from orders.models import Order
 from payments.models import Payment
+from pakahome.cache import cache_response
+from pakahome.pagination import paginated_response
+from .caching import CUSTOMERS, DRIVERS
 
 
 @api_view(['POST'])
@@ -108,32 +111,32 @@ def current_user(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@cache_response(CUSTOMERS, vary_on_role=True)
 def list_customers(request):
-    """List all customers (admin only)"""
+    """List all customers, newest first (admin only, cursor-paginated)"""
     if request.user.role != 'admin':
         return Response(
             {'error': 'Only admins can view customers'}, 
             status=status.HTTP_403_FORBIDDEN
         )
     
-    customers = Customer.objects.all().select_related('user').order_by('-created_at')
-    serializer = CustomerSerializer(customers, many=True)
-    return Response(serializer.data)
+    customers = Customer.objects.all().select_related('user')
+    return paginated_response(request, customers, CustomerSerializer)
 
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@cache_response(DRIVERS, vary_on_role=True)
 def list_drivers(request):
-    """List all drivers (admin only)"""
+    """List all drivers, newest first (admin only, cursor-paginated)"""
     if request.user.role != 'admin':
         return Response(
             {'error': 'Only admins can view drivers'}, 
             status=status.HTTP_403_FORBIDDEN
         )
     
-    drivers = Driver.objects.all().select_related('user').order_by('-created_at')
-    serializer = DriverSerializer(drivers, many=True)
-    return Response(serializer.data)
+    drivers = DriverSerializer.setup_eager_loading(Driver.objects.all())
+    return paginated_response(request, drivers, DriverSerializer)
 
 
 @api_view(['POST'])